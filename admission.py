@@ -0,0 +1,227 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Dict, Optional, Set
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("admission")
+
+# 优先级通道：交互请求优先调度并有预留名额，批量请求使用剩余的名额
+INTERACTIVE = "interactive"
+BATCH = "batch"
+LANES = (INTERACTIVE, BATCH)
+# 每个通道保留最近多少次等待时间用于计算分位数
+WAIT_SAMPLES = 1024
+
+
+class AdmissionError(Exception):
+    """在等待时间内没有空闲的上游名额"""
+
+    def __init__(self, permits: int, timeout: float):
+        super().__init__(f"No upstream capacity for {permits} generation(s) within {timeout:.0f}s")
+        self.permits = permits
+        self.timeout = timeout
+
+
+class Ticket:
+    """已获得的上游名额，release()可以安全地重复调用"""
+
+    def __init__(self, controller: "AdmissionController", permits: int, lane: str = INTERACTIVE):
+        self.controller = controller
+        self.permits = permits
+        self.lane = lane
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller._release(self.permits, self.lane)
+
+    @contextlib.asynccontextmanager
+    async def suspended(self, permits: int = 1):
+        """
+        暂时归还permits个名额（例如等待凭证刷新时不占用上游名额），正常退出时重新获得；
+        重新获得超时抛出AdmissionError，出错或被取消时不再重新获得
+        """
+        permits = min(permits, self.permits)
+        if self.released or permits <= 0:
+            yield
+            return
+        self.permits -= permits
+        self.controller._release(permits, self.lane)
+        yield
+        await self.controller.acquire(permits, self.lane)
+        self.permits += permits
+        if self.released:
+            # 等待期间整个名额已被释放（例如请求结束），重新获得的部分也要归还
+            self.controller._release(permits, self.lane)
+
+
+class _LaneStats:
+    """一个通道的占用和排队等待时间"""
+
+    def __init__(self):
+        self.in_use = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.recent_waits = deque(maxlen=WAIT_SAMPLES)
+
+    def record_wait(self, seconds: float) -> None:
+        self.admitted += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self.recent_waits.append(seconds)
+
+    def to_dict(self) -> dict:
+        waits = sorted(self.recent_waits)
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(int(len(waits) * fraction), len(waits) - 1)] * 1000, 1)
+
+        return {
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "timeouts": self.timeouts,
+            "wait_ms_avg": round(self.wait_total / self.admitted * 1000, 1) if self.admitted else None,
+            "wait_ms_p50": percentile(0.5),
+            "wait_ms_p95": percentile(0.95),
+            "wait_ms_max": round(self.wait_max * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """
+    限制同时进行的上游生成数
+
+    每个上游生成占用一个名额，n>1的请求一次性获得n个名额（不会在只拿到一部分名额时阻塞其他请求）。
+    capacity为0表示不限制。
+
+    请求分为交互（interactive）和批量（batch）两个通道：
+    - 交互请求可以使用全部名额，有交互请求在等待时批量请求不会被调度
+    - 批量请求最多使用capacity - reserved个名额，其余名额留给交互请求
+    """
+
+    def __init__(self, capacity: int, timeout: float, reserved: int = 0):
+        self.capacity = capacity
+        self.timeout = timeout
+        self.reserved = reserved
+        self.in_use = 0
+        self.waiting = 0
+        self.lanes: Dict[str, _LaneStats] = {lane: _LaneStats() for lane in LANES}
+        self._condition: Optional[asyncio.Condition] = None
+        # 唤醒等待者的任务，保留引用避免任务在完成前被回收
+        self._notify_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def batch_capacity(self) -> int:
+        """批量通道可以使用的名额（至少为1，预留名额不小于总容量时批量请求仍能逐个进行）"""
+        return max(self.capacity - self.reserved, 1)
+
+    def lane_capacity(self, lane: str) -> int:
+        """lane通道一次最多可以获得的名额，0表示不限制"""
+        if self.capacity <= 0:
+            return 0
+        return self.capacity if lane == INTERACTIVE else self.batch_capacity
+
+    def _can_admit(self, permits: int, lane: str) -> bool:
+        if lane == INTERACTIVE:
+            return self.in_use + permits <= self.capacity
+        return (self.lanes[INTERACTIVE].waiting == 0
+                and self.in_use + permits <= self.capacity
+                and self.lanes[BATCH].in_use + permits <= self.batch_capacity)
+
+    def _get_condition(self) -> asyncio.Condition:
+        # 在事件循环中首次使用时创建，避免绑定到导入时的事件循环
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, permits: int = 1, lane: str = INTERACTIVE) -> Ticket:
+        """在lane通道获得permits个名额，超过等待时间时抛出AdmissionError"""
+        stats = self.lanes[lane]
+        if self.capacity <= 0:
+            self.in_use += permits
+            stats.in_use += permits
+            stats.record_wait(0.0)
+            return Ticket(self, permits, lane)
+
+        # 超过通道容量的请求永远无法满足（调用方应事先拒绝，这里只处理热重载缩小容量的情况）
+        if permits > self.lane_capacity(lane):
+            stats.timeouts += 1
+            logger.warning(f"{lane}请求需要 {permits} 个名额，超过通道容量 {self.lane_capacity(lane)}")
+            raise AdmissionError(permits, self.timeout)
+        condition = self._get_condition()
+        started = time.monotonic()
+        async with condition:
+            self.waiting += 1
+            stats.waiting += 1
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self._can_admit(permits, lane)),
+                    timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+                logger.warning(f"{lane}请求等待上游名额超时（需要 {permits}，占用 {self.in_use}/{self.capacity}）")
+                raise AdmissionError(permits, self.timeout)
+            finally:
+                self.waiting -= 1
+                stats.waiting -= 1
+                # 交互请求不再等待时，被它挡住的批量请求可能可以继续
+                if lane == INTERACTIVE and stats.waiting == 0:
+                    condition.notify_all()
+            self.in_use += permits
+            stats.in_use += permits
+        stats.record_wait(time.monotonic() - started)
+        return Ticket(self, permits, lane)
+
+    def resize(self, capacity: int, timeout: float, reserved: int = 0) -> None:
+        """修改容量、等待时间和预留名额（热重载时使用），已获得的名额不受影响"""
+        self.capacity = capacity
+        self.timeout = timeout
+        self.reserved = reserved
+        if self._condition is not None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # 不在事件循环中调用时，等待中的请求在下一次释放名额时被唤醒
+                return
+            # 容量增大时唤醒等待中的请求
+            self._schedule_notify(loop)
+
+    def _release(self, permits: int, lane: str) -> None:
+        self.in_use -= permits
+        self.lanes[lane].in_use -= permits
+        if self._condition is not None:
+            self._schedule_notify(asyncio.get_running_loop())
+
+    def _schedule_notify(self, loop: asyncio.AbstractEventLoop) -> None:
+        task = loop.create_task(self._notify())
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    async def _notify(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "reserved": self.reserved,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "lanes": {lane: stats.to_dict() for lane, stats in self.lanes.items()},
+        }
@@ -0,0 +1,383 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from starlette.datastructures import Headers
+
+from admission import INTERACTIVE, LANES
+from upstream_errors import openai_error_body
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("auth")
+
+# 跨平台文件锁（阻塞）：多个worker合并写入同一个用量文件
+try:
+    import fcntl
+
+    @contextmanager
+    def _file_lock(path: str) -> Iterator[None]:
+        with open(path, "a+") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+except ImportError:
+    import msvcrt
+
+    @contextmanager
+    def _file_lock(path: str) -> Iterator[None]:
+        with open(path, "a+") as f:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+# 密钥文件中以此前缀表示已经哈希过的key（不在文件中保存明文）
+HASH_PREFIX = "sha256:"
+USAGE_FIELDS = ("requests", "rejected_requests", "prompt_tokens", "completion_tokens")
+
+
+def hash_key(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class TokenBucket:
+    """
+    每分钟per_minute个令牌的令牌桶，容量为per_minute
+
+    charge()可以使余额变为负数（请求结束后才知道实际的token数），余额恢复为正数之前拒绝新请求。
+    """
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float) -> bool:
+        self._refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def charge(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def wait_time(self, amount: float) -> float:
+        """余额达到amount还需要的秒数"""
+        self._refill()
+        return max(amount - self.tokens, 0) / self.rate
+
+    def remaining(self) -> int:
+        self._refill()
+        return max(int(self.tokens), 0)
+
+    def reset_time(self) -> float:
+        """恢复到满额还需要的秒数"""
+        return self.wait_time(self.capacity)
+
+    def resize(self, per_minute: int) -> None:
+        """修改额度（热重载时使用），按比例保留当前余额"""
+        self._refill()
+        fraction = self.tokens / self.capacity if self.capacity else 1.0
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = fraction * per_minute
+
+
+class ApiKey:
+    """一个API key的额度、默认优先级、令牌桶和尚未写入文件的用量"""
+
+    def __init__(self, key_hash: str, name: str, rpm: int, tpm: int, priority: str = INTERACTIVE):
+        self.key_hash = key_hash
+        # 不可逆的短标识，记录在批量任务和文件中，用于区分所有者和计入额度
+        self.id = key_hash[:16]
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.priority = priority
+        # 额度为0表示不限制
+        self.requests_bucket = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens_bucket = TokenBucket(tpm) if tpm > 0 else None
+        self.pending = dict.fromkeys(USAGE_FIELDS, 0)
+
+    def adopt(self, old: "ApiKey") -> None:
+        """沿用旧配置的令牌桶余额和未写入的用量"""
+        for attribute, limit in (("requests_bucket", self.rpm), ("tokens_bucket", self.tpm)):
+            bucket = getattr(old, attribute)
+            if bucket is not None and limit > 0:
+                bucket.resize(limit)
+                setattr(self, attribute, bucket)
+        for field, value in old.pending.items():
+            self.pending[field] += value
+
+    def record_tokens(self, prompt_tokens: int, completion_tokens: int) -> None:
+        self.pending["prompt_tokens"] += prompt_tokens
+        self.pending["completion_tokens"] += completion_tokens
+        if self.tokens_bucket is not None:
+            self.tokens_bucket.charge(prompt_tokens + completion_tokens)
+
+
+def _format_reset(seconds: float) -> str:
+    """与OpenAI的x-ratelimit-reset-*格式相同，例如"120ms"、"6.5s\""""
+    if seconds < 1:
+        return f"{int(seconds * 1000)}ms"
+    return f"{seconds:.1f}s".replace(".0s", "s")
+
+
+def load_api_keys(path: str, default_rpm: int, default_tpm: int, strict: bool = False) -> Dict[str, ApiKey]:
+    """
+    从JSON文件加载API key（{"key或sha256:哈希": {"name": "...", "rpm": 60, "tpm": 100000, "priority": "batch"}}），
+    返回{key的哈希: ApiKey}；没有rpm/tpm的key使用默认额度，没有priority的key默认为interactive
+
+    文件不存在或无效时记录错误并返回空字典（所有请求都会被拒绝）；strict为True时抛出ValueError（热重载时用于校验）
+    """
+    try:
+        if not path or not os.path.exists(path):
+            raise ValueError(f"API key文件{path}不存在")
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        if not isinstance(entries, dict):
+            raise ValueError("API key文件必须是JSON对象")
+        keys = {}
+        for key, options in entries.items():
+            options = options if isinstance(options, dict) else {"name": options}
+            key_hash = key[len(HASH_PREFIX):].lower() if key.startswith(HASH_PREFIX) else hash_key(key)
+            rpm, tpm = int(options.get("rpm", default_rpm)), int(options.get("tpm", default_tpm))
+            name = str(options.get("name") or key_hash[:8])
+            if rpm < 0 or tpm < 0:
+                raise ValueError(f"{name} 的额度不能为负数")
+            priority = options.get("priority", INTERACTIVE)
+            if priority not in LANES:
+                raise ValueError(f"{name} 的priority必须是{'或'.join(LANES)}")
+            keys[key_hash] = ApiKey(key_hash, name, rpm, tpm, priority)
+        logger.info(f"已从{path}加载 {len(keys)} 个API key")
+        return keys
+    except Exception as e:
+        if strict:
+            raise ValueError(f"API key文件{path}无效: {e}")
+        logger.error(f"加载API key文件时出错: {e}")
+        return {}
+
+
+class ApiKeyStore:
+    """
+    API key的校验、限流和用量统计
+
+    每个请求只做一次字典查找和两次令牌桶计算。用量先在内存中累计，
+    定时合并写入用量文件（多个worker通过文件锁合并，文件中是累计值）。
+    """
+
+    def __init__(self, keys: Dict[str, ApiKey], usage_path: str):
+        self.keys = keys
+        self._by_id = {api_key.id: api_key for api_key in keys.values()}
+        self.usage_path = usage_path
+        # 热重载时删除的key，剩余的用量在下次写入时合并
+        self._retired: List[ApiKey] = []
+
+    def replace(self, keys: Dict[str, ApiKey]) -> None:
+        """替换key列表（热重载），保留仍然存在的key的令牌桶余额；删除的key的用量仍会写入文件"""
+        for key_hash, api_key in keys.items():
+            old = self.keys.get(key_hash)
+            if old is not None:
+                api_key.adopt(old)
+        self._retired += [api_key for key_hash, api_key in self.keys.items() if key_hash not in keys]
+        self.keys = keys
+        self._by_id = {api_key.id: api_key for api_key in keys.values()}
+
+    def authenticate(self, token: str) -> Optional[ApiKey]:
+        if not token:
+            return None
+        return self.keys.get(hash_key(token))
+
+    def get(self, key_id: str) -> Optional[ApiKey]:
+        """按ApiKey.id查找（批量任务代表提交任务的key发出请求时使用）"""
+        return self._by_id.get(key_id)
+
+    def admit(self, api_key: ApiKey) -> Optional[Tuple[str, float]]:
+        """接受请求时返回None，超出额度时返回(超出的额度"requests"或"tokens", 需要等待的秒数)"""
+        tokens_bucket = api_key.tokens_bucket
+        wait = tokens_bucket.wait_time(1) if tokens_bucket is not None else 0
+        if wait > 0:
+            api_key.pending["rejected_requests"] += 1
+            return "tokens", wait
+        requests_bucket = api_key.requests_bucket
+        if requests_bucket is not None and not requests_bucket.take(1):
+            api_key.pending["rejected_requests"] += 1
+            return "requests", requests_bucket.wait_time(1)
+        api_key.pending["requests"] += 1
+        return None
+
+    def rate_limit_headers(self, api_key: ApiKey) -> List[Tuple[bytes, bytes]]:
+        headers = []
+        for kind, limit, bucket in (("requests", api_key.rpm, api_key.requests_bucket),
+                                    ("tokens", api_key.tpm, api_key.tokens_bucket)):
+            if bucket is None:
+                continue
+            headers += [
+                (f"x-ratelimit-limit-{kind}".encode(), str(limit).encode()),
+                (f"x-ratelimit-remaining-{kind}".encode(), str(bucket.remaining()).encode()),
+                (f"x-ratelimit-reset-{kind}".encode(), _format_reset(bucket.reset_time()).encode()),
+            ]
+        return headers
+
+    def _merge_usage(self, api_keys: List[ApiKey]) -> None:
+        """取出尚未写入的用量，合并到用量文件中（在线程中调用）"""
+        deltas: Dict[str, Dict[str, int]] = {}
+        for api_key in api_keys:
+            if not any(api_key.pending.values()):
+                continue
+            total = deltas.setdefault(api_key.name, dict.fromkeys(USAGE_FIELDS, 0))
+            for field in USAGE_FIELDS:
+                total[field] += api_key.pending[field]
+                api_key.pending[field] = 0
+        if not deltas or not self.usage_path:
+            return
+        try:
+            with _file_lock(self.usage_path + ".lock"):
+                usage = {}
+                if os.path.exists(self.usage_path):
+                    with open(self.usage_path, "r", encoding="utf-8") as f:
+                        usage = json.load(f)
+                for name, delta in deltas.items():
+                    record = usage.setdefault(name, dict.fromkeys(USAGE_FIELDS, 0))
+                    for field, value in delta.items():
+                        record[field] = record.get(field, 0) + value
+                    record["updated_at"] = int(time.time())
+                temp_path = f"{self.usage_path}.{os.getpid()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(usage, f, ensure_ascii=False, indent=2)
+                os.replace(temp_path, self.usage_path)
+        except (OSError, ValueError) as e:
+            # 写入失败时放回内存，下次再写
+            logger.error(f"写入用量文件{self.usage_path}失败: {e}")
+            by_name = {api_key.name: api_key for api_key in api_keys}
+            for name, delta in deltas.items():
+                for field, value in delta.items():
+                    by_name[name].pending[field] += value
+
+    def flush(self) -> None:
+        retired, self._retired = self._retired, []
+        self._merge_usage(list(self.keys.values()) + retired)
+
+    async def flush_task(self, interval: float) -> None:
+        """定时写入用量"""
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.flush)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            api_key.name: {
+                "rpm": api_key.rpm,
+                "tpm": api_key.tpm,
+                "priority": api_key.priority,
+                "remaining_requests": api_key.requests_bucket.remaining() if api_key.requests_bucket else None,
+                "remaining_tokens": api_key.tokens_bucket.remaining() if api_key.tokens_bucket else None,
+                "pending_usage": dict(api_key.pending),
+            }
+            for api_key in self.keys.values()
+        }
+
+
+class AuthMiddleware:
+    """
+    校验protected_prefixes下的请求的API key（Authorization: Bearer），并按key限流
+
+    - 无效的key返回401，超出额度返回429（均为OpenAI格式）；WebSocket的key无效时在握手阶段以1008关闭
+    - 通过校验的请求在scope["state"]["api_key"]中记录对应的ApiKey，响应头带有x-ratelimit-*
+    - CORS预检请求（OPTIONS）和带有internal_token的进程内请求（批量任务）不需要API key；
+      进程内请求带有X-On-Behalf-Of（提交批量任务的key的ApiKey.id）时计入该key的额度
+    """
+
+    def __init__(self, app, store: ApiKeyStore, protected_prefixes: Tuple[str, ...] = ("/v1/",),
+                 internal_token: str = ""):
+        self.app = app
+        self.store = store
+        self.protected_prefixes = protected_prefixes
+        self.internal_token = internal_token
+
+    async def _reject(self, scope, send, status: int, body: Dict[str, Any],
+                      headers: List[Tuple[bytes, bytes]]) -> None:
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        data = json.dumps(body).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(data)).encode()),
+            *headers,
+        ]})
+        await send({"type": "http.response.body", "body": data})
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] not in ("http", "websocket") or scope.get("method") == "OPTIONS"
+                or not scope["path"].startswith(self.protected_prefixes)):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        internal = headers.get("x-internal-token")
+        if internal and self.internal_token and hmac.compare_digest(internal.encode(), self.internal_token.encode()):
+            owner = headers.get("x-on-behalf-of")
+            if not owner:
+                await self.app(scope, receive, send)
+                return
+            api_key = self.store.get(owner)
+            if api_key is None:
+                await self._reject(scope, send, 401, openai_error_body(
+                    "The API key that created this batch no longer exists", "invalid_request_error", "invalid_api_key"
+                ), [])
+                return
+        else:
+            token = headers.get("authorization", "").removeprefix("Bearer ").strip()
+            api_key = self.store.authenticate(token)
+            if api_key is None:
+                await self._reject(scope, send, 401, openai_error_body(
+                    "Incorrect API key provided", "invalid_request_error", "invalid_api_key"), [])
+                return
+
+        # WebSocket连接上的每个请求由处理函数分别限流，握手本身不计数
+        limited = self.store.admit(api_key) if scope["type"] == "http" else None
+        if limited is not None:
+            kind, wait = limited
+            logger.warning(f"API key {api_key.name} 超出{kind}额度，需要等待 {wait:.1f} 秒")
+            await self._reject(scope, send, 429, openai_error_body(
+                f"Rate limit reached for {kind} per minute on API key {api_key.name}, please retry after {wait:.1f}s",
+                kind, "rate_limit_exceeded"
+            ), [(b"retry-after", str(max(int(wait + 0.999), 1)).encode()), *self.store.rate_limit_headers(api_key)])
+            return
+
+        scope.setdefault("state", {})["api_key"] = api_key
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []),
+                                                   *self.store.rate_limit_headers(api_key)]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
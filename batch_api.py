@@ -0,0 +1,661 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import APIRouter, File, Form, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse
+
+from upstream_errors import openai_error_response
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("batch-api")
+
+# 执行单个批量请求的函数：(url, 请求体) -> (状态码, 响应体, 响应头)
+Executor = Callable[[str, Dict[str, Any], Optional[str]], Awaitable[Tuple[int, Dict[str, Any], Dict[str, str]]]]
+
+# 目前支持的批量端点
+SUPPORTED_ENDPOINTS = ("/v1/chat/completions",)
+# 批量任务的完成时限
+COMPLETION_WINDOWS = {"24h": 24 * 3600}
+# 未完成（需要由后台执行或恢复）的状态
+ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+# 需要重试的上游状态码（429/503会同时降低并发）
+THROTTLE_STATUS_CODES = (429, 503)
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# 记录提交者（API key的标识）的字段，不返回给客户端
+OWNER_FIELD = "owner"
+
+
+def _write_json_atomic(path: str, content: Dict[str, Any]) -> None:
+    """原子地写入JSON文件（先写临时文件再重命名）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp.", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(content, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _owned(record: Dict[str, Any], owner: Optional[str]) -> bool:
+    """owner是否可以访问record（owner为None表示未启用认证，可以访问所有记录）"""
+    return owner is None or record.get(OWNER_FIELD) == owner
+
+
+def _public(record: Dict[str, Any]) -> Dict[str, Any]:
+    """返回给客户端的对象（去掉内部字段）"""
+    return {key: value for key, value in record.items() if key != OWNER_FIELD}
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+class BatchStore:
+    """
+    文件和批量任务的本地存储
+
+    目录结构:
+        files/<file_id>.jsonl   文件内容
+        files/<file_id>.json    文件对象（OpenAI格式）
+        batches/<batch_id>.json 批量任务对象（OpenAI格式）
+        batches/<batch_id>.cancel 取消标记（任何worker都可以写入）
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files_dir = os.path.join(root, "files")
+        self.batches_dir = os.path.join(root, "batches")
+        os.makedirs(self.files_dir, exist_ok=True)
+        os.makedirs(self.batches_dir, exist_ok=True)
+
+    # ---- 文件 ----
+
+    def file_path(self, file_id: str) -> str:
+        return os.path.join(self.files_dir, f"{file_id}.jsonl")
+
+    def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        if not file_id.startswith("file-"):
+            return None
+        return _read_json(os.path.join(self.files_dir, f"{file_id}.json"))
+
+    def save_file(self, file_object: Dict[str, Any]) -> None:
+        _write_json_atomic(os.path.join(self.files_dir, f"{file_object['id']}.json"), file_object)
+
+    def new_file(self, filename: str, purpose: str, owner: Optional[str] = None) -> Dict[str, Any]:
+        """创建一个空文件并返回其文件对象（owner为所属API key的标识）"""
+        file_object = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": 0,
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+            OWNER_FIELD: owner,
+        }
+        open(self.file_path(file_object["id"]), "wb").close()
+        self.save_file(file_object)
+        return file_object
+
+    def list_files(self, purpose: Optional[str] = None, owner: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出文件；owner不为None时只列出该API key的文件"""
+        files = []
+        for name in os.listdir(self.files_dir):
+            if name.endswith(".json") and not name.startswith("."):
+                file_object = _read_json(os.path.join(self.files_dir, name))
+                if file_object and (purpose is None or file_object["purpose"] == purpose) and _owned(file_object, owner):
+                    files.append(file_object)
+        return sorted(files, key=lambda f: f["created_at"], reverse=True)
+
+    def delete_file(self, file_id: str) -> bool:
+        if self.get_file(file_id) is None:
+            return False
+        for path in (self.file_path(file_id), os.path.join(self.files_dir, f"{file_id}.json")):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        return True
+
+    # ---- 批量任务 ----
+
+    def _batch_path(self, batch_id: str) -> str:
+        return os.path.join(self.batches_dir, f"{batch_id}.json")
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        if not batch_id.startswith("batch_"):
+            return None
+        return _read_json(self._batch_path(batch_id))
+
+    def save_batch(self, batch: Dict[str, Any]) -> None:
+        _write_json_atomic(self._batch_path(batch["id"]), batch)
+
+    def list_batches(self, owner: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出批量任务；owner不为None时只列出该API key的任务"""
+        batches = []
+        for name in os.listdir(self.batches_dir):
+            if name.endswith(".json") and not name.startswith("."):
+                batch = _read_json(os.path.join(self.batches_dir, name))
+                if batch and _owned(batch, owner):
+                    batches.append(batch)
+        return sorted(batches, key=lambda b: b["created_at"], reverse=True)
+
+    def next_active_batch(self) -> Optional[Dict[str, Any]]:
+        """最早创建的未完成任务"""
+        active = [batch for batch in self.list_batches() if batch["status"] in ACTIVE_STATUSES]
+        return min(active, key=lambda b: b["created_at"]) if active else None
+
+    def request_cancel(self, batch_id: str) -> None:
+        open(os.path.join(self.batches_dir, f"{batch_id}.cancel"), "w").close()
+
+    def cancel_requested(self, batch_id: str) -> bool:
+        return os.path.exists(os.path.join(self.batches_dir, f"{batch_id}.cancel"))
+
+
+class AdaptiveLimiter:
+    """
+    AIMD并发控制
+
+    每个成功的请求使并发上限增加约 1/上限（即每一轮增加1），
+    遇到限流（429/503）时上限减半并按Retry-After暂停发送新请求。
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.pause_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        delay = self.pause_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self, throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # 同一轮中多个请求同时被限流时只减半一次
+                if now - self._last_decrease > 1.0:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                    logger.warning(f"上游限流，批量并发降低到 {int(self.limit)}")
+                self.pause_until = max(self.pause_until, now + (retry_after or 1.0))
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class BatchRunner:
+    """
+    在后台逐个执行批量任务
+
+    流式读取输入JSONL，由AdaptiveLimiter控制并发，结果逐行追加到输出/错误文件。
+    重启后根据输出/错误文件中已有的custom_id跳过已完成的请求，继续执行。
+    """
+
+    def __init__(self, store: BatchStore, executor: Executor, concurrency: int,
+                 max_retries: int, poll_interval: float):
+        self.store = store
+        self.executor = executor
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self._wake: Optional[asyncio.Event] = None
+
+    def wake(self) -> None:
+        """有新任务或取消请求时唤醒执行循环"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run(self) -> None:
+        """执行主循环"""
+        self._wake = asyncio.Event()
+        while True:
+            batch = await asyncio.to_thread(self.store.next_active_batch)
+            if batch is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            try:
+                await self._run_batch(batch)
+            except Exception as e:
+                logger.error(f"批量任务 {batch['id']} 执行出错: {e}", exc_info=True)
+                await self._finish(batch, "failed", errors=[{"code": "internal_error", "message": str(e), "line": None}])
+
+    # ---- 执行 ----
+
+    async def _run_batch(self, batch: Dict[str, Any]) -> None:
+        if batch["status"] == "validating":
+            if not await self._validate(batch):
+                return
+        if batch["status"] == "cancelling" or await asyncio.to_thread(self.store.cancel_requested, batch["id"]):
+            await self._mark_cancelling(batch)
+            if not batch.get("output_file_id"):
+                # 还没有开始执行就被取消
+                await self._finish(batch, "cancelled")
+                return
+
+        # 已经写入输出/错误文件的请求不再执行（用于重启后恢复）
+        done = await asyncio.to_thread(self._completed_ids, batch)
+        logger.info(f"开始执行批量任务 {batch['id']}（共 {batch['request_counts']['total']} 个请求，已完成 {len(done)} 个）")
+
+        limiter = AdaptiveLimiter(self.concurrency)
+        # 限制已读取但尚未完成的请求数，避免一次把整个输入文件读入内存
+        pending = asyncio.Semaphore(self.concurrency * 2)
+        tasks: Set[asyncio.Task] = set()
+        last_saved = time.monotonic()
+
+        with open(self.store.file_path(batch["output_file_id"]), "a", encoding="utf-8") as output, \
+                open(self.store.file_path(batch["error_file_id"]), "a", encoding="utf-8") as errors, \
+                open(self.store.file_path(batch["input_file_id"]), "r", encoding="utf-8") as input_file:
+
+            async def execute(item: Dict[str, Any]):
+                try:
+                    result, ok = await self._execute(item, batch["endpoint"], batch.get(OWNER_FIELD), limiter)
+                    (output if ok else errors).write(json.dumps(result, ensure_ascii=False) + "\n")
+                    batch["request_counts"]["completed" if ok else "failed"] += 1
+                finally:
+                    pending.release()
+
+            try:
+                stopped = False
+                while not stopped:
+                    lines = await asyncio.to_thread(_read_lines, input_file, 256)
+                    if not lines:
+                        break
+                    for line in lines:
+                        if batch["status"] == "cancelling" or await asyncio.to_thread(self.store.cancel_requested, batch["id"]):
+                            await self._mark_cancelling(batch)
+                            stopped = True
+                            break
+                        if time.time() > batch["expires_at"]:
+                            batch["status"] = "expired"
+                            stopped = True
+                            break
+                        item = json.loads(line)
+                        if item["custom_id"] in done:
+                            continue
+                        await pending.acquire()
+                        task = asyncio.create_task(execute(item))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+
+                        if time.monotonic() - last_saved > 1.0:
+                            # 定期保存进度，供其他worker查询
+                            output.flush()
+                            errors.flush()
+                            await asyncio.to_thread(self.store.save_batch, batch)
+                            last_saved = time.monotonic()
+
+                # 等待已发出的请求完成（批量任务被取消时也不丢弃已经开始的请求）
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                if tasks:
+                    # 执行循环本身被取消（排空或失去leader）：leader锁已经释放，未完成的请求会由新leader重新执行，
+                    # 这里取消它们，不让它们在文件关闭后继续调用上游
+                    running = list(tasks)
+                    for task in running:
+                        task.cancel()
+                    await asyncio.gather(*running, return_exceptions=True)
+                # 保存已经完成的进度，新leader据此跳过已完成的请求
+                output.flush()
+                errors.flush()
+                await asyncio.to_thread(self.store.save_batch, batch)
+
+        if batch["status"] == "cancelling":
+            await self._finish(batch, "cancelled")
+        elif batch["status"] == "expired":
+            await self._finish(batch, "expired")
+        else:
+            batch["status"] = "finalizing"
+            batch["finalizing_at"] = int(time.time())
+            await self._finish(batch, "completed")
+
+    async def _execute(self, item: Dict[str, Any], endpoint: str, owner: Optional[str],
+                       limiter: AdaptiveLimiter) -> Tuple[Dict[str, Any], bool]:
+        """执行一个请求（计入owner的额度），可重试的错误按指数退避重试；返回 (输出行, 是否成功)"""
+        request_id = f"req_{uuid.uuid4().hex}"
+        status, body, error = None, None, None
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            throttled, retry_after = False, None
+            try:
+                status, body, headers = await self.executor(endpoint, item.get("body") or {}, owner)
+                throttled = status in THROTTLE_STATUS_CODES
+                retry_after = _parse_retry_after(headers.get("retry-after"))
+                error = None
+            except Exception as e:
+                status, body, error = None, None, str(e)
+            finally:
+                await limiter.release(throttled, retry_after)
+
+            if status is not None and status not in RETRYABLE_STATUS_CODES:
+                break
+            if attempt < self.max_retries:
+                await asyncio.sleep(retry_after or min(2 ** attempt, 30))
+
+        result = {
+            "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+            "custom_id": item["custom_id"],
+            "response": {"status_code": status, "request_id": request_id, "body": body} if status is not None else None,
+            "error": {"code": "request_failed", "message": error} if error else None,
+        }
+        return result, status is not None and 200 <= status < 300
+
+    # ---- 状态 ----
+
+    async def _validate(self, batch: Dict[str, Any]) -> bool:
+        """检查输入文件的每一行，通过后创建输出/错误文件并进入in_progress"""
+        total, errors = await asyncio.to_thread(
+            _validate_input, self.store.file_path(batch["input_file_id"]), batch["endpoint"]
+        )
+        if errors:
+            await self._finish(batch, "failed", errors=errors)
+            return False
+        batch["request_counts"]["total"] = total
+        owner = batch.get(OWNER_FIELD)
+        for field, suffix in (("output_file_id", "output"), ("error_file_id", "error")):
+            file_object = await asyncio.to_thread(self.store.new_file, f"{batch['id']}_{suffix}.jsonl", "batch_output", owner)
+            batch[field] = file_object["id"]
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = int(time.time())
+        await asyncio.to_thread(self.store.save_batch, batch)
+        return True
+
+    def _completed_ids(self, batch: Dict[str, Any]) -> Set[str]:
+        done = set()
+        for file_id in (batch["output_file_id"], batch["error_file_id"]):
+            _truncate_partial_line(self.store.file_path(file_id))
+            with open(self.store.file_path(file_id), "r", encoding="utf-8") as f:
+                for line in f:
+                    done.add(json.loads(line)["custom_id"])
+        counts = batch["request_counts"]
+        counts["completed"], counts["failed"] = self._count_lines(batch["output_file_id"]), self._count_lines(batch["error_file_id"])
+        return done
+
+    def _count_lines(self, file_id: str) -> int:
+        with open(self.store.file_path(file_id), "r", encoding="utf-8") as f:
+            return sum(1 for _ in f)
+
+    async def _mark_cancelling(self, batch: Dict[str, Any]) -> None:
+        if batch["status"] != "cancelling":
+            batch["status"] = "cancelling"
+            batch["cancelling_at"] = batch.get("cancelling_at") or int(time.time())
+            await asyncio.to_thread(self.store.save_batch, batch)
+
+    async def _finish(self, batch: Dict[str, Any], status: str, errors: Optional[List[Dict[str, Any]]] = None) -> None:
+        now = int(time.time())
+        batch["status"] = status
+        batch[f"{status}_at"] = now
+        if errors:
+            batch["errors"] = {"object": "list", "data": errors}
+        await asyncio.to_thread(self._save_finished, batch)
+        logger.info(f"批量任务 {batch['id']} 结束: {status}，{batch['request_counts']}")
+
+    def _save_finished(self, batch: Dict[str, Any]) -> None:
+        # 更新输出文件的大小
+        for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+            file_object = self.store.get_file(file_id) if file_id else None
+            if file_object:
+                file_object["bytes"] = os.path.getsize(self.store.file_path(file_id))
+                self.store.save_file(file_object)
+        self.store.save_batch(batch)
+
+
+def _truncate_partial_line(path: str) -> None:
+    """进程中断时输出文件可能留下不完整的最后一行，截掉它（对应的请求会重新执行）"""
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        f.seek(0)
+        content = f.read()
+        f.truncate(content.rfind(b"\n") + 1)
+
+
+def _read_lines(f, count: int) -> List[str]:
+    """读取最多count个非空行"""
+    lines = []
+    while len(lines) < count:
+        line = f.readline()
+        if not line:
+            break
+        if line.strip():
+            lines.append(line)
+    return lines
+
+
+def _validate_input(path: str, endpoint: str, max_errors: int = 20) -> Tuple[int, List[Dict[str, Any]]]:
+    """逐行检查输入文件，返回 (请求数, 错误列表)"""
+    total = 0
+    errors = []
+    custom_ids = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            total += 1
+            try:
+                item = json.loads(line)
+                if not isinstance(item, dict) or not item.get("custom_id"):
+                    raise ValueError("Missing custom_id")
+                if item["custom_id"] in custom_ids:
+                    raise ValueError(f"Duplicate custom_id {item['custom_id']}")
+                if item.get("method", "POST") != "POST":
+                    raise ValueError("Only POST is supported")
+                if item.get("url") != endpoint:
+                    raise ValueError(f"url must match the batch endpoint {endpoint}")
+                if not isinstance(item.get("body"), dict):
+                    raise ValueError("Missing request body")
+                custom_ids.add(item["custom_id"])
+            except ValueError as e:
+                errors.append({"code": "invalid_request", "message": str(e), "line": line_number})
+                if len(errors) >= max_errors:
+                    break
+    if total == 0 and not errors:
+        errors.append({"code": "empty_file", "message": "The input file contains no requests", "line": None})
+    return total, errors
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def create_batch_router(store: BatchStore, runner: BatchRunner, max_file_bytes: int,
+                        owner_of: Callable[[Request], Optional[str]] = lambda request: None) -> APIRouter:
+    """
+    创建 /v1/files 和 /v1/batches 的路由
+
+    owner_of返回请求所属的API key的标识（未启用认证时为None），记录在文件和批量任务中：
+    每个key只能看到和操作自己的文件和任务（其他key的返回404），执行任务时计入该key的额度
+    """
+    router = APIRouter()
+
+    def not_found(kind: str, object_id: str) -> JSONResponse:
+        return openai_error_response(404, f"No such {kind}: {object_id}", "invalid_request_error", "not_found")
+
+    def get_file(request: Request, file_id: str) -> Optional[Dict[str, Any]]:
+        file_object = store.get_file(file_id)
+        return file_object if file_object and _owned(file_object, owner_of(request)) else None
+
+    def get_batch(request: Request, batch_id: str) -> Optional[Dict[str, Any]]:
+        batch = store.get_batch(batch_id)
+        return batch if batch and _owned(batch, owner_of(request)) else None
+
+    # ---- 文件 ----
+
+    @router.post("/v1/files")
+    async def upload_file(request: Request, file: UploadFile = File(...), purpose: str = Form(...)):
+        """上传文件（分块写入磁盘，不在内存中保存整个文件）"""
+        if purpose != "batch":
+            return openai_error_response(400, "Only purpose=batch is supported", "invalid_request_error", "invalid_value")
+        file_object = await asyncio.to_thread(store.new_file, file.filename or "upload.jsonl", purpose, owner_of(request))
+        size = 0
+        with open(store.file_path(file_object["id"]), "wb") as f:
+            while True:
+                chunk = await file.read(1024 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_file_bytes:
+                    f.close()
+                    await asyncio.to_thread(store.delete_file, file_object["id"])
+                    return openai_error_response(
+                        413, f"File exceeds the maximum size of {max_file_bytes} bytes",
+                        "invalid_request_error", "file_too_large"
+                    )
+                await asyncio.to_thread(f.write, chunk)
+        file_object["bytes"] = size
+        await asyncio.to_thread(store.save_file, file_object)
+        logger.info(f"已上传文件 {file_object['id']}（{size} 字节）")
+        return _public(file_object)
+
+    @router.get("/v1/files")
+    async def list_files(request: Request, purpose: Optional[str] = None):
+        files = await asyncio.to_thread(store.list_files, purpose, owner_of(request))
+        return {"object": "list", "data": [_public(file_object) for file_object in files]}
+
+    @router.get("/v1/files/{file_id}")
+    def retrieve_file(request: Request, file_id: str):
+        file_object = get_file(request, file_id)
+        return _public(file_object) if file_object else not_found("file", file_id)
+
+    @router.get("/v1/files/{file_id}/content")
+    def retrieve_file_content(request: Request, file_id: str):
+        if get_file(request, file_id) is None:
+            return not_found("file", file_id)
+        return FileResponse(store.file_path(file_id), media_type="application/jsonl")
+
+    @router.delete("/v1/files/{file_id}")
+    def delete_file(request: Request, file_id: str):
+        if get_file(request, file_id) is None or not store.delete_file(file_id):
+            return not_found("file", file_id)
+        return {"id": file_id, "object": "file", "deleted": True}
+
+    # ---- 批量任务 ----
+
+    @router.post("/v1/batches")
+    async def create_batch(request: Request):
+        try:
+            body = await request.json()
+        except ValueError as e:
+            # json.JSONDecodeError和UnicodeDecodeError都是ValueError的子类
+            return openai_error_response(400, f"Invalid JSON body: {e}", "invalid_request_error", "invalid_json")
+        if not isinstance(body, dict):
+            return openai_error_response(400, "Request body must be a JSON object", "invalid_request_error", "invalid_json")
+        input_file_id = body.get("input_file_id", "")
+        if not isinstance(input_file_id, str):
+            return openai_error_response(400, "input_file_id must be a string", "invalid_request_error", "invalid_value")
+        endpoint = body.get("endpoint")
+        completion_window = body.get("completion_window", "24h")
+        if await asyncio.to_thread(get_file, request, input_file_id) is None:
+            return not_found("file", input_file_id)
+        if endpoint not in SUPPORTED_ENDPOINTS:
+            return openai_error_response(
+                400, f"Unsupported endpoint {endpoint}, supported: {', '.join(SUPPORTED_ENDPOINTS)}",
+                "invalid_request_error", "invalid_value"
+            )
+        if not isinstance(completion_window, str) or completion_window not in COMPLETION_WINDOWS:
+            return openai_error_response(400, "completion_window must be 24h", "invalid_request_error", "invalid_value")
+
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": None,
+            "expires_at": now + COMPLETION_WINDOWS[completion_window],
+            "finalizing_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "expired_at": None,
+            "cancelling_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": body.get("metadata"),
+            OWNER_FIELD: owner_of(request),
+        }
+        await asyncio.to_thread(store.save_batch, batch)
+        runner.wake()
+        logger.info(f"已创建批量任务 {batch['id']}（输入文件 {input_file_id}）")
+        return _public(batch)
+
+    @router.get("/v1/batches")
+    async def list_batches(request: Request, limit: int = 20, after: Optional[str] = None):
+        batches = await asyncio.to_thread(store.list_batches, owner_of(request))
+        if after:
+            ids = [batch["id"] for batch in batches]
+            batches = batches[ids.index(after) + 1:] if after in ids else []
+        page = batches[:limit]
+        return {
+            "object": "list",
+            "data": [_public(batch) for batch in page],
+            "first_id": page[0]["id"] if page else None,
+            "last_id": page[-1]["id"] if page else None,
+            "has_more": len(batches) > limit,
+        }
+
+    @router.get("/v1/batches/{batch_id}")
+    def retrieve_batch(request: Request, batch_id: str):
+        batch = get_batch(request, batch_id)
+        return _public(batch) if batch else not_found("batch", batch_id)
+
+    @router.post("/v1/batches/{batch_id}/cancel")
+    def cancel_batch(request: Request, batch_id: str):
+        batch = get_batch(request, batch_id)
+        if batch is None:
+            return not_found("batch", batch_id)
+        if batch["status"] not in ACTIVE_STATUSES:
+            return openai_error_response(
+                409, f"Cannot cancel a batch with status {batch['status']}", "invalid_request_error", "invalid_state"
+            )
+        # 由执行任务的worker看到取消标记后停止发送新请求，等待已发出的请求完成后标记为cancelled
+        store.request_cancel(batch_id)
+        runner.wake()
+        batch["status"] = "cancelling"
+        batch["cancelling_at"] = batch.get("cancelling_at") or int(time.time())
+        return _public(batch)
+
+    return router
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+js_parser 性能测试
+
+生成不同大小的合成Next.js chunk，对比旧的正则提取方式和新的单遍结构解析器；
+另外测试深层嵌套的数组表达式和不平衡（括号、模板、正则没有闭合）的输入，
+结构解析器的耗时应随嵌套深度/重复次数线性增长。
+用法: python bench_js_parser.py [--sizes 100000,300000,1000000] [--depths 250,500,1000,2000] [--repeat 3]
+"""
+
+import argparse
+import logging
+import random
+import re
+import time
+
+from js_parser import find_model_array
+
+logging.disable(logging.INFO)
+
+MODEL_IDS = [
+    "DeepSeek-R1",
+    "Qwen3-235B-A22B-FP8",
+    "meta-llama-Llama-4-Maverick-17B-128E-Instruct-FP8",
+    "nvidia-Llama-3-3-Nemotron-Super-49B-v1",
+    "Qwen-QwQ-32B",
+    "Meta-Llama-3-3-70B-Instruct",
+    "Meta-Llama-3-1-405B-Instruct-FP8",
+    "AkashGen",
+]
+
+
+def legacy_extract(js_content):
+    """旧版 extract_models_from_js 的提取逻辑（模块ID正则 + 按模型ID逐个DOTALL搜索）"""
+    model_array_match = re.search(r'68382[^{]*\{[^{]*\$I[^{]*Jn[^{]*o\}\)[^{]*let\s+o\s*=\s*(\[.*?\])(?=,r\s*=|;)', js_content, re.DOTALL)
+    if model_array_match:
+        pattern = r'\{id:"([^"]+)",name:"([^"]+)",description:"([^"]+)".*?available:(!0|true)'
+        models = [m.group(1) for m in re.finditer(pattern, model_array_match.group(1), re.DOTALL)]
+        if models:
+            return models
+    models = []
+    for model_id in MODEL_IDS:
+        pattern = r'id:"' + re.escape(model_id) + r'".*?name:"([^"]+)".*?description:"([^"]+)".*?available:(!0|true)'
+        if re.search(pattern, js_content, re.DOTALL):
+            models.append(model_id)
+    return models
+
+
+def make_module(rng, index):
+    """生成一个类似压缩后webpack模块的代码片段"""
+    return (
+        f'{index}:(e,t,a)=>{{"use strict";a.d(t,{{A:()=>i}});var n=a({rng.randint(1, 99999)}),r=a.n(n);'
+        f'let s=[{{key:"item-{index}",label:"Item {index}",href:"/p/{index}"}},{{key:"x",onClick:()=>r()}}];'
+        f'let i=e=>{{let{{className:t,...a}}=e;return(0,n.jsx)("div",{{className:(0,r.default)("c-{index}",t),'
+        f'children:s.map(e=>(0,n.jsx)("a",{{href:e.href,children:`${{e.label}}`}}))}})}}}},'
+    )
+
+
+def make_model_array(model_ids=MODEL_IDS):
+    """生成与Akash前端结构相同的模型数组"""
+    items = []
+    for model_id in model_ids:
+        items.append(
+            f'{{id:"{model_id}",name:"{model_id.replace("-", " ")}",description:"Model \\"{model_id}\\" description",'
+            f'temperature:.6,top_p:.95,tokenLimit:128e3,parameters:"70B",architecture:"Dense",'
+            f'hf_repo:"org/{model_id}",aboutContent:"About\\nthis model",thumbnailId:n.default,available:!0}}'
+        )
+    return "[" + ",".join(items) + "]"
+
+
+def make_bundle(size, seed=0, model_ids=MODEL_IDS, model_first=False, extra=""):
+    """生成约size字节的合成chunk，默认模型数组位于末尾（正则方式的最坏情况）"""
+    rng = random.Random(seed)
+    header = '(self.webpackChunk_N_E=self.webpackChunk_N_E||[]).push([[939],{'
+    models = f'68382:(e,t,a)=>{{a.d(t,{{$I:()=>r,Jn:()=>o}});var n=a(2818);let o={make_model_array(model_ids)},r=o[0]}},'
+    parts = []
+    length = len(header) + len(models)
+    index = 1000
+    while length < size:
+        module = make_module(rng, index) + extra
+        parts.append(module)
+        length += len(module)
+        index += 1
+    if model_first:
+        return header + models + "".join(parts) + '}]);'
+    return header + "".join(parts) + models + '}]);'
+
+
+def make_adversarial_bundle(size):
+    """
+    前端已下线某个模型，但代码中仍有许多对它的引用（例如 model:{id:"AkashGen"}）。
+    旧的逐个DOTALL搜索在每个引用处都会扫描到文件末尾寻找available，耗时随 引用数 × 文件大小 增长
+    """
+    return make_bundle(size, model_ids=MODEL_IDS[:-1], model_first=True, extra='x={id:"AkashGen"};')
+
+
+# 嵌套表达式的每一层，%s处是内层表达式
+NESTED_SHAPES = (
+    # 数组后面跟着运算符，旧的解析器在每一层回溯后重新解析内层，耗时随深度指数增长
+    "[{children:%s}].map(f)",
+    "[{children:%s}]+x",
+    # 值是函数调用，每一层都要跳过内层的全部内容，不记住跳过的结束位置时耗时随深度平方增长
+    "f([{a:%s}])",
+)
+
+
+def make_nested_bundle(depth, shape):
+    """嵌套depth层的表达式（例如 [{children:[{children:1}].map(f)}].map(f)），后面是模型数组"""
+    prefix, suffix = shape.split("%s")
+    return f"let t={prefix * depth}1{suffix * depth};let o={make_model_array()};"
+
+
+# 不平衡的输入，每个片段重复多次；每个 [{ 起点的跳过都会遇到没有闭合的括号、模板或正则字符类，
+# 不记住扫描结果时每个起点都要重新扫描到文本末尾
+UNBALANCED_SHAPES = (
+    "[{a:1}",
+    "x=[{a:1+[{b:2}]+",
+    "[{a:`${[{b:`",
+    "[{a:/[/",
+)
+
+
+def make_unbalanced_bundle(count, shape):
+    """重复count次的不平衡片段，后面是模型数组（在没有闭合的内容中，只能从它自己的起点找到）"""
+    return f"{shape * count}let o={make_model_array()};"
+
+
+def bench(func, text, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="js_parser 性能测试")
+    parser.add_argument("--sizes", default="100000,300000,1000000", help="合成chunk的大小（字节，逗号分隔）")
+    parser.add_argument("--depths", default="250,500,1000,2000", help="嵌套表达式的深度（逗号分隔，从小到大）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最好成绩")
+    args = parser.parse_args()
+
+    print(f"{'场景':<12}{'大小':>10}{'旧正则(ms)':>14}{'结构解析(ms)':>16}{'模型数':>8}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for name, text in (("普通", make_bundle(size)), ("对抗", make_adversarial_bundle(size))):
+            legacy_time, legacy_models = bench(legacy_extract, text, args.repeat)
+            new_time, new_models = bench(find_model_array, text, args.repeat)
+            count = len(new_models or [])
+            print(f"{name:<12}{len(text):>10}{legacy_time * 1000:>14.1f}{new_time * 1000:>16.1f}{count:>8}")
+            assert count >= len(MODEL_IDS) - 1, "结构解析器没有找到完整的模型列表"
+
+    depths = [int(d) for d in args.depths.split(",")]
+    print(f"\n{'嵌套表达式':<24}{'深度':>6}{'大小':>10}{'结构解析(ms)':>16}{'模型数':>8}")
+    for shape in NESTED_SHAPES:
+        bench_growth(shape, [(depth, make_nested_bundle(depth, shape)) for depth in depths], args.repeat)
+    print(f"\n{'不平衡输入':<24}{'重复':>6}{'大小':>10}{'结构解析(ms)':>16}{'模型数':>8}")
+    for shape in UNBALANCED_SHAPES:
+        bench_growth(shape, [(depth * 2, make_unbalanced_bundle(depth * 2, shape)) for depth in depths], args.repeat)
+
+
+def bench_growth(shape, texts, repeat):
+    """依次解析规模从小到大的texts（(规模, 文本)），检查耗时随规模线性增长"""
+    previous = None
+    for scale, text in texts:
+        new_time, new_models = bench(find_model_array, text, repeat)
+        count = len(new_models or [])
+        print(f"{shape:<24}{scale:>6}{len(text):>10}{new_time * 1000:>16.1f}{count:>8}")
+        assert count == len(MODEL_IDS), f"{shape} 结构解析器没有找到完整的模型列表"
+        if previous is not None:
+            # 线性增长时耗时之比约等于规模之比，留出计时误差；平方增长时约为规模之比的平方
+            previous_scale, previous_time = previous
+            ratio = scale / previous_scale
+            assert new_time < previous_time * ratio * 1.5 + 0.005, (
+                f"{shape} 规模{previous_scale}->{scale}的解析耗时{previous_time * 1000:.1f}ms->"
+                f"{new_time * 1000:.1f}ms，没有随规模线性增长")
+        previous = (scale, new_time)
+
+if __name__ == "__main__":
+    main()
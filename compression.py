@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import zlib
+from typing import List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("compression")
+
+# brotli和zstd是可选依赖，未安装时只使用gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 压缩级别：偏向速度，JSON的压缩率在这些级别下已经足够
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# 可以压缩的内容类型
+COMPRESSIBLE_TYPES = ("application/json", "application/jsonl", "application/x-ndjson", "text/")
+
+
+class _Compressor:
+    """统一三种压缩算法的流式接口"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    compressor = _Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def available_encodings() -> List[str]:
+    """服务端支持的编码，按优先级排列"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def choose_encoding(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    """
+    根据Accept-Encoding选择编码：q值最高者优先，q值相同时按服务端的优先级
+
+    没有可用的编码（或客户端不接受压缩）时返回None。
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[token] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class CompressionMiddleware:
+    """
+    按Accept-Encoding压缩响应（zstd、br需要安装对应的库，gzip始终可用）
+
+    - 一次性返回的响应小于minimum_size时不压缩，大于thread_cutoff时在线程池中压缩，避免阻塞事件循环
+    - SSE（text/event-stream）原样传输，不影响首个token的延迟
+    - 其他分块传输的响应（例如批量任务的结果文件）逐块压缩
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, thread_cutoff: int = 256 * 1024,
+                 encodings: Optional[List[str]] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_cutoff = thread_cutoff
+        self.encodings = encodings or available_encodings()
+        logger.info(f"响应压缩已启用，支持的编码: {', '.join(self.encodings)}")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressionResponder(send, encoding, self.minimum_size, self.thread_cutoff)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, send, encoding: str, minimum_size: int, thread_cutoff: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.thread_cutoff = thread_cutoff
+        self.start_message = None
+        self.mode: Optional[str] = None  # None: 等待第一个响应体消息；"passthrough"；"stream"
+        self.compressor: Optional[_Compressor] = None
+
+    def _compressible(self, headers: MutableHeaders) -> bool:
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").lower()
+        if content_type.startswith("text/event-stream"):
+            return False
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _mark_encoded(self, headers: MutableHeaders) -> None:
+        headers["content-encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        # 压缩后的表示与原始表示不再逐字节相同，ETag改为弱校验（If-None-Match按弱比较，仍然可以返回304）
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["etag"] = f"W/{etag}"
+
+    async def send(self, message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            if not self._compressible(MutableHeaders(raw=list(message.get("headers", [])))):
+                # 不压缩的响应（包括SSE）立即发送响应头
+                self.mode = "passthrough"
+                await self._send(message)
+                return
+            self.start_message = message
+            return
+        if message_type != "http.response.body":
+            await self._send(message)
+            return
+
+        if self.mode == "passthrough":
+            await self._send(message)
+            return
+        if self.mode == "stream":
+            data = self.compressor.compress(message.get("body", b""))
+            more_body = message.get("more_body", False)
+            if not more_body:
+                data += self.compressor.finish()
+            await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        # 第一个响应体消息：决定是否压缩
+        headers = MutableHeaders(raw=list(self.start_message.get("headers", [])))
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not more_body and len(body) < self.minimum_size:
+            self.mode = "passthrough"
+            await self._send(self.start_message)
+            await self._send(message)
+            return
+
+        self._mark_encoded(headers)
+        if more_body:
+            # 分块传输：逐块压缩（SSE已在_compressible中排除）
+            self.mode = "stream"
+            self.compressor = _Compressor(self.encoding)
+            del headers["content-length"]
+            await self._send({**self.start_message, "headers": headers.raw})
+            await self.send(message)
+            return
+
+        if len(body) >= self.thread_cutoff:
+            data = await asyncio.to_thread(compress, self.encoding, body)
+        else:
+            data = compress(self.encoding, body)
+        headers["content-length"] = str(len(data))
+        self.mode = "passthrough"
+        await self._send({**self.start_message, "headers": headers.raw})
+        await self._send({"type": "http.response.body", "body": data})
@@ -1,9 +1,14 @@
 import os
-from dotenv import load_dotenv
+from typing import Any, Callable, Dict
+from dotenv import dotenv_values, load_dotenv
 import logging
 
+# 进程启动时的环境变量（优先级高于.env文件，热重载时保持相同的优先级）
+_PROCESS_ENV = dict(os.environ)
+
 # 加载.env文件中的环境变量
-load_dotenv()
+ENV_FILE = ".env"
+load_dotenv(ENV_FILE)
 
 # 配置日志
 logging.basicConfig(
@@ -15,10 +20,34 @@ logger = logging.getLogger("config")
 
 # Akash API配置
 AKASH_API_URL = os.getenv("AKASH_API_URL", "https://chat.akash.network/api/chat/")
+AKASH_API_URLS = os.getenv("AKASH_API_URLS", "")  # 多个等价的上游地址（逗号分隔），为空时只使用AKASH_API_URL
 AKASH_JS_URL = os.getenv("AKASH_JS_URL", "https://chat.akash.network/_next/static/chunks/939-e56b9689ddc1242a.js")
 
 # 默认模型
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "DeepSeek-R1")
+MODEL_ALIASES_FILE = os.getenv("MODEL_ALIASES_FILE", "model_aliases.json")  # 自定义模型别名（JSON对象: {"别名": "模型ID"}）
+
+# 模型目录快照配置
+MODEL_CATALOG_FILE = os.getenv("MODEL_CATALOG_FILE", "model_catalog.json")  # 解析后的模型列表及JS文件校验信息
+MODEL_REFRESH_INTERVAL = float(os.getenv("MODEL_REFRESH_INTERVAL", "3600"))  # 后台条件请求刷新间隔（秒）
+MODELS_CACHE_MAX_AGE = int(os.getenv("MODELS_CACHE_MAX_AGE", "60"))  # /v1/models响应允许客户端缓存的时间（秒）
+
+# 模型JS文件自动发现配置（AKASH_JS_URL失效时通过聊天页面和构建清单查找）
+MODEL_DISCOVERY_PAGE_URL = os.getenv("MODEL_DISCOVERY_PAGE_URL", "https://chat.akash.network/")
+MODEL_DISCOVERY_MAX_CHUNK_BYTES = int(os.getenv("MODEL_DISCOVERY_MAX_CHUNK_BYTES", "1048576"))  # 单个候选chunk大小上限
+MODEL_DISCOVERY_BYTE_BUDGET = int(os.getenv("MODEL_DISCOVERY_BYTE_BUDGET", "8388608"))  # 一次发现最多下载的字节数
+MODEL_DISCOVERY_CONCURRENCY = int(os.getenv("MODEL_DISCOVERY_CONCURRENCY", "6"))  # 并行下载数
+
+# 对话历史压缩配置（超出模型上下文时丢弃较早的消息）
+HISTORY_COMPACTION = os.getenv("HISTORY_COMPACTION", "true").lower() == "true"
+HISTORY_OUTPUT_RESERVE = int(os.getenv("HISTORY_OUTPUT_RESERVE", "1024"))  # 请求没有max_tokens时为输出预留的token数
+HISTORY_DROP_MIDDLE = os.getenv("HISTORY_DROP_MIDDLE", "false").lower() == "true"  # 保留开头的消息，丢弃中间的消息
+HISTORY_KEEP_FIRST_MESSAGES = int(os.getenv("HISTORY_KEEP_FIRST_MESSAGES", "2"))  # HISTORY_DROP_MIDDLE时保留的开头消息数
+HISTORY_DEFAULT_CONTEXT_WINDOW = int(os.getenv("HISTORY_DEFAULT_CONTEXT_WINDOW", "0"))  # 模型没有tokenLimit时使用，0表示不压缩
+
+# token统计配置
+TOKENIZER = os.getenv("TOKENIZER", "auto").lower()  # auto/tiktoken/heuristic，auto在安装了tiktoken时使用tiktoken
+TIKTOKEN_ENCODING = os.getenv("TIKTOKEN_ENCODING", "cl100k_base")
 
 # 服务器配置
 HOST = os.getenv("HOST", "0.0.0.0")
@@ -26,7 +55,57 @@ PORT = int(os.getenv("PORT", "8000"))
 
 # Cookie配置
 COOKIE_FILE = os.getenv("COOKIE_FILE", "akash_cookies.json")
-COOKIE_EXPIRY_THRESHOLD = int(os.getenv("COOKIE_EXPIRY_THRESHOLD", "3600"))  # 默认1小时
+COOKIE_EXPIRY_THRESHOLD = int(os.getenv("COOKIE_EXPIRY_THRESHOLD", "3600"))  # 默认1小时，仅在不知道真实过期时间时使用
+COOKIE_WATCH_INTERVAL = float(os.getenv("COOKIE_WATCH_INTERVAL", "5"))  # 检查cookie文件是否被外部修改的间隔（秒），0表示不检查
+CF_CLEARANCE_TTL = int(os.getenv("CF_CLEARANCE_TTL", "1800"))  # cf_clearance没有过期时间时，按签发时间加此值估算
+
+# 凭证刷新调度配置
+CREDENTIAL_REFRESH_LEAD_TIME = float(os.getenv("CREDENTIAL_REFRESH_LEAD_TIME", "600"))  # 提前多少秒刷新
+CREDENTIAL_REFRESH_JITTER = float(os.getenv("CREDENTIAL_REFRESH_JITTER", "60"))  # 刷新时间随机抖动范围（秒）
+CREDENTIAL_REFRESH_MAX_INTERVAL = float(os.getenv("CREDENTIAL_REFRESH_MAX_INTERVAL", "3600"))  # 两次刷新的最长间隔
+CREDENTIAL_REFRESH_MAX_BACKOFF = float(os.getenv("CREDENTIAL_REFRESH_MAX_BACKOFF", "600"))  # 刷新失败后的最长退避时间
+CREDENTIAL_WAIT_TIMEOUT = float(os.getenv("CREDENTIAL_WAIT_TIMEOUT", "30"))  # 非leader等待leader刷新凭证的最长时间（秒），超时后不再重放请求
+CF_BROWSER_REFRESH = os.getenv("CF_BROWSER_REFRESH", "false").lower() == "true"  # 后台刷新失败时是否启动浏览器获取cf_clearance
+
+# 请求体配置
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(32 * 1024 * 1024)))  # 请求体大小上限（解压后），超过时返回413
+
+# 幂等请求配置（Idempotency-Key）
+# 去重结果保存在进程内存中，只在单个进程内有效：默认只在WORKERS=1时开启，多进程模式下不能开启
+IDEMPOTENCY_DEDUP = os.getenv("IDEMPOTENCY_DEDUP", "true" if int(os.getenv("WORKERS", "1")) <= 1 else "false").lower() == "true"
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "3600"))  # 成功的结果保留时间（秒）
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000"))  # 最多保留的结果数，超出时淘汰最久未使用的
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(64 * 1024 * 1024)))  # 保留结果的总大小上限
+
+# API key认证和限流配置
+API_AUTH = os.getenv("API_AUTH", "false").lower() == "true"  # 是否要求/v1/请求带有API key
+API_KEYS_FILE = os.getenv("API_KEYS_FILE", "api_keys.json")  # API key及其额度
+API_KEY_DEFAULT_RPM = int(os.getenv("API_KEY_DEFAULT_RPM", "60"))  # 未单独配置时每个key每分钟的请求数，0表示不限
+API_KEY_DEFAULT_TPM = int(os.getenv("API_KEY_DEFAULT_TPM", "100000"))  # 未单独配置时每个key每分钟的token数，0表示不限
+API_USAGE_FILE = os.getenv("API_USAGE_FILE", "api_usage.json")  # 各key的累计用量
+API_USAGE_FLUSH_INTERVAL = float(os.getenv("API_USAGE_FLUSH_INTERVAL", "30"))  # 用量写入文件的间隔（秒）
+
+# 响应压缩配置
+COMPRESSION = os.getenv("COMPRESSION", "true").lower() == "true"  # 按Accept-Encoding压缩响应（gzip，安装brotli/zstandard后支持br/zstd）
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # 小于此大小的响应不压缩
+COMPRESSION_THREAD_CUTOFF = int(os.getenv("COMPRESSION_THREAD_CUTOFF", str(256 * 1024)))  # 大于此大小的响应在线程池中压缩
+
+# 并发控制配置
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "32"))  # 同时进行的上游生成数，0表示不限制
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", "30"))  # 等待空闲名额的最长时间（秒），超时返回503
+ADMISSION_INTERACTIVE_RESERVED = int(os.getenv("ADMISSION_INTERACTIVE_RESERVED", "8"))  # 为交互请求预留的名额，批量请求不能使用
+MAX_CHOICES = int(os.getenv("MAX_CHOICES", "8"))  # 单个请求的n上限
+
+# WebSocket配置（/v1/chat/completions/ws）
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))  # 每个连接待发送帧的上限，满时暂停读取上游
+WS_MAX_CONCURRENT_REQUESTS = int(os.getenv("WS_MAX_CONCURRENT_REQUESTS", "256"))  # 每个连接同时进行的请求数上限
+
+# 批量任务配置（/v1/files 和 /v1/batches）
+BATCH_DIR = os.getenv("BATCH_DIR", "batch_data")  # 上传的文件、批量任务和结果的存放目录
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # 批量请求的最大并发数（遇到限流时自动降低）
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "3"))  # 单个请求遇到限流或上游错误时的重试次数
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "5"))  # 检查新任务的间隔（秒）
+BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_BYTES", str(200 * 1024 * 1024)))  # 上传文件大小上限
 
 # 重试配置
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
@@ -39,15 +118,154 @@ STREAM_DELAY = float(os.getenv("STREAM_DELAY", "0.01"))  # 秒
 # HTTP请求超时设置
 TIMEOUT = float(os.getenv("TIMEOUT", "30.0"))  # 秒
 
+# 上游连接池配置（所有上游请求共用一个客户端，以下为默认设置，可以在UPSTREAM_HOSTS_FILE中按主机覆盖）
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))  # 每个主机的最大连接数
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "300"))  # 空闲连接保留时间（秒）
+UPSTREAM_MIN_WARM_CONNECTIONS = int(os.getenv("UPSTREAM_MIN_WARM_CONNECTIONS", "2"))  # 后台保持的空闲连接数，0表示不预热
+UPSTREAM_PREWARM_INTERVAL = float(os.getenv("UPSTREAM_PREWARM_INTERVAL", "60"))  # 预热间隔（秒），应小于上游关闭空闲连接的时间
+UPSTREAM_DNS_TTL = float(os.getenv("UPSTREAM_DNS_TTL", "300"))  # DNS解析结果缓存时间（秒），0表示不缓存
+UPSTREAM_HOSTS_FILE = os.getenv("UPSTREAM_HOSTS_FILE", "upstream_hosts.json")  # 按主机覆盖的设置（JSON对象: {"主机名": {...}}）
+UPSTREAM_PROBE_INTERVAL = float(os.getenv("UPSTREAM_PROBE_INTERVAL", "30"))  # 配置了多个上游地址时探测延迟的间隔（秒）
+UPSTREAM_EWMA_ALPHA = float(os.getenv("UPSTREAM_EWMA_ALPHA", "0.3"))  # 延迟和错误率移动平均中新样本的权重（0-1）
+
+# 多进程部署配置
+WORKERS = int(os.getenv("WORKERS", "1"))  # worker进程数，大于1时启用多进程模式
+SHARED_STATE_FILE = os.getenv("SHARED_STATE_FILE", "akash_state.db")  # 进程间共享的Cookie和模型状态
+
+# 排空和无中断重启配置
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "300"))  # 收到SIGTERM后等待进行中请求的最长时间（秒）
+REUSE_PORT = os.getenv("REUSE_PORT", "false").lower() == "true"  # 使用SO_REUSEPORT，新进程可以在旧进程排空时监听同一端口
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # /admin端点的Bearer令牌，为空时只允许本机访问
+
+# 请求追踪配置
+TRACING = os.getenv("TRACING", "true").lower() == "true"  # 记录各阶段耗时（span）并返回Server-Timing响应头
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")  # span导出文件（JSONL），为空时不导出
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(50 * 1024 * 1024)))  # 超过此大小时轮转
+TRACE_FILE_BACKUPS = int(os.getenv("TRACE_FILE_BACKUPS", "3"))  # 保留的轮转文件数
+
+# 事件循环卡顿监控配置
+LOOP_LAG_MONITOR = os.getenv("LOOP_LAG_MONITOR", "true").lower() == "true"  # 记录事件循环卡顿及阻塞代码的调用栈
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))  # 超过此时长的卡顿会被记录
+
+def _parse_bool(value: str) -> bool:
+    return value.lower() == "true"
+
+# 可以热重载（SIGHUP或/admin/reload）的配置项及其解析方式，其余配置项需要重启才能生效
+RELOADABLE_SETTINGS: Dict[str, Callable[[str], Any]] = {
+    "AKASH_API_URL": str,
+    "AKASH_API_URLS": str,
+    "DEFAULT_MODEL": str,
+    "MODEL_ALIASES_FILE": str,
+    "MODEL_REFRESH_INTERVAL": float,
+    "MODELS_CACHE_MAX_AGE": int,
+    "HISTORY_COMPACTION": _parse_bool,
+    "HISTORY_OUTPUT_RESERVE": int,
+    "HISTORY_DROP_MIDDLE": _parse_bool,
+    "HISTORY_KEEP_FIRST_MESSAGES": int,
+    "HISTORY_DEFAULT_CONTEXT_WINDOW": int,
+    "CREDENTIAL_REFRESH_LEAD_TIME": float,
+    "CREDENTIAL_REFRESH_JITTER": float,
+    "CREDENTIAL_REFRESH_MAX_INTERVAL": float,
+    "CREDENTIAL_REFRESH_MAX_BACKOFF": float,
+    "CREDENTIAL_WAIT_TIMEOUT": float,
+    "CF_BROWSER_REFRESH": _parse_bool,
+    "MAX_REQUEST_BODY_BYTES": int,
+    "IDEMPOTENCY_TTL": float,
+    "IDEMPOTENCY_MAX_ENTRIES": int,
+    "IDEMPOTENCY_MAX_BYTES": int,
+    "API_KEY_DEFAULT_RPM": int,
+    "API_KEY_DEFAULT_TPM": int,
+    "MAX_CONCURRENT_GENERATIONS": int,
+    "ADMISSION_TIMEOUT": float,
+    "ADMISSION_INTERACTIVE_RESERVED": int,
+    "MAX_CHOICES": int,
+    "WS_SEND_QUEUE_SIZE": int,
+    "WS_MAX_CONCURRENT_REQUESTS": int,
+    "MAX_RETRIES": int,
+    "RETRY_DELAY": float,
+    "TIMEOUT": float,
+    "DRAIN_TIMEOUT": float,
+    "ADMIN_TOKEN": str,
+}
+
+# 热重载时的取值范围检查：(配置项, 检查函数, 说明)
+_SETTING_CHECKS = [
+    ("AKASH_API_URL", lambda v: v.startswith(("http://", "https://")), "必须是http(s) URL"),
+    ("AKASH_API_URLS", lambda v: all(url.strip().startswith(("http://", "https://")) for url in v.split(",") if url.strip()),
+     "必须是逗号分隔的http(s) URL"),
+    ("DEFAULT_MODEL", bool, "不能为空"),
+    ("MODEL_REFRESH_INTERVAL", lambda v: v > 0, "必须大于0"),
+    ("MAX_REQUEST_BODY_BYTES", lambda v: v > 0, "必须大于0"),
+    ("IDEMPOTENCY_TTL", lambda v: v > 0, "必须大于0"),
+    ("IDEMPOTENCY_MAX_ENTRIES", lambda v: v >= 1, "至少为1"),
+    ("IDEMPOTENCY_MAX_BYTES", lambda v: v > 0, "必须大于0"),
+    ("API_KEY_DEFAULT_RPM", lambda v: v >= 0, "不能为负数"),
+    ("API_KEY_DEFAULT_TPM", lambda v: v >= 0, "不能为负数"),
+    ("MAX_CONCURRENT_GENERATIONS", lambda v: v >= 0, "不能为负数"),
+    ("ADMISSION_TIMEOUT", lambda v: v > 0, "必须大于0"),
+    ("ADMISSION_INTERACTIVE_RESERVED", lambda v: v >= 0, "不能为负数"),
+    ("MAX_CHOICES", lambda v: v >= 1, "至少为1"),
+    ("WS_SEND_QUEUE_SIZE", lambda v: v >= 1, "至少为1"),
+    ("WS_MAX_CONCURRENT_REQUESTS", lambda v: v >= 1, "至少为1"),
+    ("MAX_RETRIES", lambda v: v >= 0, "不能为负数"),
+    ("TIMEOUT", lambda v: v > 0, "必须大于0"),
+    ("DRAIN_TIMEOUT", lambda v: v >= 0, "不能为负数"),
+]
+
+
+def load_settings() -> Dict[str, Any]:
+    """
+    重新读取.env文件和环境变量，返回可热重载的配置项
+
+    只解析和检查，不修改当前配置；任何一项无效时抛出ValueError（列出所有错误）。
+    .env中删除的配置项保持当前值。
+    """
+    env = {name: value for name, value in dotenv_values(ENV_FILE).items() if value is not None}
+    env.update(_PROCESS_ENV)
+    settings, errors = {}, []
+    for name, parse in RELOADABLE_SETTINGS.items():
+        if name not in env:
+            settings[name] = globals()[name]
+            continue
+        try:
+            settings[name] = parse(env[name])
+        except ValueError:
+            errors.append(f"{name}={env[name]!r} 格式错误")
+    for name, check, message in _SETTING_CHECKS:
+        if name in settings and not check(settings[name]):
+            errors.append(f"{name}={settings[name]!r} {message}")
+    if errors:
+        raise ValueError("; ".join(errors))
+    return settings
+
+
+def apply_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """更新本模块中的配置项，返回发生变化的项（{名称: 新值}）"""
+    changed = {name: value for name, value in settings.items() if globals().get(name) != value}
+    globals().update(settings)
+    return changed
+
 # 打印配置信息
 def print_config():
     """打印当前配置信息"""
     logger.info("=== 当前配置 ===")
     logger.info(f"AKASH_API_URL: {AKASH_API_URL}")
-    logger.info(f"DEFAULT_MODEL: {DEFAULT_MODEL}")
+    if AKASH_API_URLS:
+        logger.info(f"AKASH_API_URLS: {AKASH_API_URLS}")
+    logger.info(f"DEFAULT_MODEL: {DEFAULT_MODEL}, MODEL_ALIASES_FILE: {MODEL_ALIASES_FILE}")
+    logger.info(f"MODEL_CATALOG_FILE: {MODEL_CATALOG_FILE}, MODEL_REFRESH_INTERVAL: {MODEL_REFRESH_INTERVAL}")
+    logger.info(f"HISTORY_COMPACTION: {HISTORY_COMPACTION}, HISTORY_DROP_MIDDLE: {HISTORY_DROP_MIDDLE}")
     logger.info(f"HOST: {HOST}, PORT: {PORT}")
+    logger.info(f"MAX_CONCURRENT_GENERATIONS: {MAX_CONCURRENT_GENERATIONS}, ADMISSION_INTERACTIVE_RESERVED: {ADMISSION_INTERACTIVE_RESERVED}, MAX_CHOICES: {MAX_CHOICES}")
     logger.info(f"MAX_RETRIES: {MAX_RETRIES}, RETRY_DELAY: {RETRY_DELAY}")
+    logger.info(f"UPSTREAM_MAX_CONNECTIONS: {UPSTREAM_MAX_CONNECTIONS}, UPSTREAM_MIN_WARM_CONNECTIONS: {UPSTREAM_MIN_WARM_CONNECTIONS}")
+    logger.info(f"API_AUTH: {API_AUTH}, API_KEYS_FILE: {API_KEYS_FILE}")
     logger.info(f"COOKIE_EXPIRY_THRESHOLD: {COOKIE_EXPIRY_THRESHOLD}")
+    logger.info(f"CREDENTIAL_REFRESH_LEAD_TIME: {CREDENTIAL_REFRESH_LEAD_TIME}, CF_BROWSER_REFRESH: {CF_BROWSER_REFRESH}")
+    logger.info(f"WORKERS: {WORKERS}, SHARED_STATE_FILE: {SHARED_STATE_FILE}")
+    logger.info(f"IDEMPOTENCY_DEDUP: {IDEMPOTENCY_DEDUP}")
+    logger.info(f"DRAIN_TIMEOUT: {DRAIN_TIMEOUT}, REUSE_PORT: {REUSE_PORT}")
+    logger.info(f"TRACING: {TRACING}, TRACE_FILE: {TRACE_FILE}")
     logger.info("================")
 
 # 创建示例.env文件
@@ -55,10 +273,34 @@ def create_example_env():
     """创建示例.env文件"""
     env_content = """# Akash API配置
 AKASH_API_URL=https://chat.akash.network/api/chat/
+AKASH_API_URLS=
 AKASH_JS_URL=https://chat.akash.network/_next/static/chunks/939-e56b9689ddc1242a.js
 
 # 默认模型
 DEFAULT_MODEL=DeepSeek-R1
+MODEL_ALIASES_FILE=model_aliases.json
+
+# 模型目录快照配置
+MODEL_CATALOG_FILE=model_catalog.json
+MODEL_REFRESH_INTERVAL=3600
+MODELS_CACHE_MAX_AGE=60
+
+# 模型JS文件自动发现配置（AKASH_JS_URL失效时通过聊天页面和构建清单查找）
+MODEL_DISCOVERY_PAGE_URL=https://chat.akash.network/
+MODEL_DISCOVERY_MAX_CHUNK_BYTES=1048576
+MODEL_DISCOVERY_BYTE_BUDGET=8388608
+MODEL_DISCOVERY_CONCURRENCY=6
+
+# 对话历史压缩配置
+HISTORY_COMPACTION=true
+HISTORY_OUTPUT_RESERVE=1024
+HISTORY_DROP_MIDDLE=false
+HISTORY_KEEP_FIRST_MESSAGES=2
+HISTORY_DEFAULT_CONTEXT_WINDOW=0
+
+# token统计配置
+TOKENIZER=auto
+TIKTOKEN_ENCODING=cl100k_base
 
 # 服务器配置
 HOST=0.0.0.0
@@ -67,6 +309,55 @@ PORT=8000
 # Cookie配置
 COOKIE_FILE=akash_cookies.json
 COOKIE_EXPIRY_THRESHOLD=3600
+COOKIE_WATCH_INTERVAL=5
+CF_CLEARANCE_TTL=1800
+
+# 凭证刷新调度配置
+CREDENTIAL_REFRESH_LEAD_TIME=600
+CREDENTIAL_REFRESH_JITTER=60
+CREDENTIAL_REFRESH_MAX_INTERVAL=3600
+CREDENTIAL_REFRESH_MAX_BACKOFF=600
+CREDENTIAL_WAIT_TIMEOUT=30
+CF_BROWSER_REFRESH=false
+
+# 请求体配置
+MAX_REQUEST_BODY_BYTES=33554432
+
+# 幂等请求配置（去重只在单个进程内有效，默认只在WORKERS=1时开启）
+# IDEMPOTENCY_DEDUP=true
+IDEMPOTENCY_TTL=3600
+IDEMPOTENCY_MAX_ENTRIES=1000
+IDEMPOTENCY_MAX_BYTES=67108864
+
+# API key认证和限流配置
+API_AUTH=false
+API_KEYS_FILE=api_keys.json
+API_KEY_DEFAULT_RPM=60
+API_KEY_DEFAULT_TPM=100000
+API_USAGE_FILE=api_usage.json
+API_USAGE_FLUSH_INTERVAL=30
+
+# 响应压缩配置
+COMPRESSION=true
+COMPRESSION_MIN_SIZE=1024
+COMPRESSION_THREAD_CUTOFF=262144
+
+# 并发控制配置
+MAX_CONCURRENT_GENERATIONS=32
+ADMISSION_TIMEOUT=30
+ADMISSION_INTERACTIVE_RESERVED=8
+MAX_CHOICES=8
+
+# WebSocket配置
+WS_SEND_QUEUE_SIZE=256
+WS_MAX_CONCURRENT_REQUESTS=256
+
+# 批量任务配置
+BATCH_DIR=batch_data
+BATCH_CONCURRENCY=8
+BATCH_MAX_RETRIES=3
+BATCH_POLL_INTERVAL=5
+BATCH_MAX_FILE_BYTES=209715200
 
 # 重试配置
 MAX_RETRIES=3
@@ -78,6 +369,35 @@ STREAM_DELAY=0.01
 
 # HTTP请求超时设置
 TIMEOUT=30.0
+
+# 上游连接池配置
+UPSTREAM_MAX_CONNECTIONS=100
+UPSTREAM_KEEPALIVE_EXPIRY=300
+UPSTREAM_MIN_WARM_CONNECTIONS=2
+UPSTREAM_PREWARM_INTERVAL=60
+UPSTREAM_DNS_TTL=300
+UPSTREAM_HOSTS_FILE=upstream_hosts.json
+UPSTREAM_PROBE_INTERVAL=30
+UPSTREAM_EWMA_ALPHA=0.3
+
+# 多进程部署配置
+WORKERS=1
+SHARED_STATE_FILE=akash_state.db
+
+# 排空和无中断重启配置
+DRAIN_TIMEOUT=300
+REUSE_PORT=false
+ADMIN_TOKEN=
+
+# 请求追踪配置
+TRACING=true
+TRACE_FILE=traces.jsonl
+TRACE_FILE_MAX_BYTES=52428800
+TRACE_FILE_BACKUPS=3
+
+# 事件循环卡顿监控配置
+LOOP_LAG_MONITOR=true
+LOOP_LAG_THRESHOLD_MS=100
 """
     
     # 如果.env文件不存在，则创建
@@ -1,10 +1,14 @@
 import json
 import logging
-import os
+import re
 import time
+from datetime import datetime
 import requests
 from typing import Dict, Optional, Tuple
 
+from config import COOKIE_FILE, COOKIE_EXPIRY_THRESHOLD, CF_CLEARANCE_TTL
+from credential_store import CredentialStore
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -16,37 +20,99 @@ logger = logging.getLogger("cookie-updater")
 # 配置
 AKASH_URL = "https://chat.akash.network/"
 AKASH_SESSION_URL = "https://chat.akash.network/api/auth/session/"
-COOKIE_FILE = "akash_cookies.json"
-COOKIE_EXPIRY_THRESHOLD = 3600  # 1小时，单位：秒
 
+# Cookie文件中保存过期时间的保留字段，不会作为cookie发送
+EXPIRES_KEY = "_expires"
+
+# 需要跟踪过期时间的关键cookie
+TRACKED_COOKIES = ("session_token", "cf_clearance")
+
+# cookie文件的读写层：原子写入、内存缓存、变化通知
+CREDENTIALS = CredentialStore(COOKIE_FILE)
+
+
+def save_cookies(cookies: Dict[str, str], expires: Optional[Dict[str, float]] = None) -> None:
+    """
+    保存cookie到文件（原子写入，会阻塞到数据落盘，后台刷新在线程中调用）
+
+    expires为各cookie的过期时间戳（如果已知）。未提供时，值未变化的cookie保留原有的过期时间。
+    """
+    def build(old: Optional[Dict]) -> Dict:
+        data = dict(cookies)
+        data.pop(EXPIRES_KEY, None)
+        old = old or {}
+        recorded = {
+            name: ts for name, ts in (old.get(EXPIRES_KEY) or {}).items()
+            if old.get(name) == data.get(name)
+        }
+        recorded.update(expires or {})
+        if recorded:
+            data[EXPIRES_KEY] = recorded
+        return data
 
-def save_cookies(cookies: Dict[str, str]) -> None:
-    """保存cookie到文件"""
-    with open(COOKIE_FILE, "w") as f:
-        json.dump(cookies, f)
+    CREDENTIALS.update(build)
     logger.info(f"Cookie已保存到{COOKIE_FILE}")
 
 
-def load_cookies() -> Optional[Dict[str, str]]:
-    """从文件加载cookie"""
-    if not os.path.exists(COOKIE_FILE):
-        logger.info(f"Cookie文件{COOKIE_FILE}不存在")
-        return None
+def _read_cookie_file() -> Optional[Dict]:
+    """读取cookie文件的原始内容（内存缓存，文件变化时才重新读取）"""
+    return CREDENTIALS.read()
+
+
+def parse_cf_clearance_issued_at(cf_clearance: str) -> Optional[float]:
+    """从cf_clearance值中解析签发时间，格式为 <hash>-<时间戳>-<版本>-..."""
+    match = re.search(r'-(\d{10})-', cf_clearance)
+    return float(match.group(1)) if match else None
+
+
+def get_cookie_expiry() -> Dict[str, float]:
+    """
+    获取关键cookie的过期时间戳
+
+    优先使用Set-Cookie或会话接口返回的真实过期时间；
+    cf_clearance没有记录时，按签发时间加CF_CLEARANCE_TTL估算。
+    """
+    try:
+        data = _read_cookie_file() or {}
+    except Exception as e:
+        logger.error(f"读取Cookie过期时间时出错: {e}")
+        data = {}
+    expires = {name: ts for name, ts in (data.get(EXPIRES_KEY) or {}).items() if name in TRACKED_COOKIES}
     
+    cf_clearance = data.get("cf_clearance")
+    if "cf_clearance" not in expires and cf_clearance:
+        issued_at = parse_cf_clearance_issued_at(cf_clearance)
+        if issued_at:
+            expires["cf_clearance"] = issued_at + CF_CLEARANCE_TTL
+    return expires
+
+
+def load_cookies(check_expiry: bool = True) -> Optional[Dict[str, str]]:
+    """从文件加载cookie"""
     try:
-        with open(COOKIE_FILE, "r") as f:
-            cookies = json.load(f)
+        cookies = _read_cookie_file()
+        if cookies is None:
+            logger.info(f"Cookie文件{COOKIE_FILE}不存在")
+            return None
+        expires = cookies.pop(EXPIRES_KEY, None) or {}
         
         # 检查是否包含必要的cookie
         if "cf_clearance" not in cookies or "session_token" not in cookies:
             logger.warning("Cookie文件不包含必要的cookie")
             return None
         
-        # 检查文件修改时间，判断cookie是否过期
-        file_mtime = os.path.getmtime(COOKIE_FILE)
-        if time.time() - file_mtime > COOKIE_EXPIRY_THRESHOLD:
-            logger.info("Cookie可能已过期，需要更新")
-            return None
+        if check_expiry:
+            if expires:
+                # 已知真实过期时间时按其判断
+                if min(expires.values()) <= time.time():
+                    logger.info("Cookie已过期，需要更新")
+                    return None
+            else:
+                # 否则检查文件修改时间，判断cookie是否过期
+                file_mtime = CREDENTIALS.mtime()
+                if file_mtime is None or time.time() - file_mtime > COOKIE_EXPIRY_THRESHOLD:
+                    logger.info("Cookie可能已过期，需要更新")
+                    return None
         
         logger.info("成功加载Cookie")
         return cookies
@@ -162,14 +228,19 @@ def auto_get_cf_clearance() -> Dict[str, str]:
             # 获取 cookies
             cookies = driver.get_cookies()
             cookie_dict = {}
+            expires = {}
             
             for cookie in cookies:
                 cookie_dict[cookie['name']] = cookie['value']
+                if cookie['name'] in TRACKED_COOKIES and cookie.get('expiry'):
+                    expires[cookie['name']] = float(cookie['expiry'])
             
             driver.quit()
             
             if 'cf_clearance' in cookie_dict:
                 logger.info("✅ 成功获取 cf_clearance!")
+                # 保存获取到的 cookies 及其过期时间
+                save_cookies(cookie_dict, expires)
                 return cookie_dict
             else:
                 logger.warning("❌ 未能获取 cf_clearance")
@@ -197,8 +268,8 @@ def auto_update_cookies() -> Dict[str, str]:
     """自动获取和更新cookie"""
     logger.info("尝试自动更新Cookie...")
     
-    # 先加载现有cookie，我们需要cf_clearance
-    existing_cookies = load_cookies()
+    # 先加载现有cookie，我们需要cf_clearance（session_token即使已过期也可以刷新）
+    existing_cookies = load_cookies(check_expiry=False)
     
     if existing_cookies is None or "cf_clearance" not in existing_cookies:
         logger.warning("无法自动更新Cookie：缺少cf_clearance")
@@ -252,8 +323,8 @@ def auto_update_cookies() -> Dict[str, str]:
                 existing_cookies["session_token"] = cookies_dict["session_token"]
                 logger.info("成功自动获取session_token")
                 
-                # 保存更新后的cookie
-                save_cookies(existing_cookies)
+                # 保存更新后的cookie以及真实的过期时间
+                save_cookies(existing_cookies, _extract_expiry(response))
                 return existing_cookies
             else:
                 logger.warning("响应中没有session_token")
@@ -265,6 +336,23 @@ def auto_update_cookies() -> Dict[str, str]:
     
     return {}
 
+
+def _extract_expiry(response: requests.Response) -> Dict[str, float]:
+    """从Set-Cookie属性或会话接口返回的expires字段中提取过期时间"""
+    expires = {}
+    try:
+        session_expires = response.json().get("expires")
+        if session_expires:
+            expires["session_token"] = datetime.fromisoformat(session_expires.replace("Z", "+00:00")).timestamp()
+    except Exception:
+        pass
+    
+    # Set-Cookie上的过期属性优先
+    for cookie in response.cookies:
+        if cookie.name in TRACKED_COOKIES and cookie.expires:
+            expires[cookie.name] = float(cookie.expires)
+    return expires
+
 def get_valid_cookies() -> Tuple[Dict[str, str], bool]:
     """获取有效的cookie，如果需要则更新"""
     # 尝试加载现有cookie
@@ -285,9 +373,6 @@ def get_valid_cookies() -> Tuple[Dict[str, str], bool]:
             if auto_cookies and 'cf_clearance' in auto_cookies:
                 logger.info("半自动化获取 cf_clearance 成功，继续获取 session_token...")
                 
-                # 保存获取到的 cookies
-                save_cookies(auto_cookies)
-                
                 # 尝试使用新的 cf_clearance 获取 session_token
                 cookies = auto_update_cookies()
                 
@@ -321,9 +406,13 @@ def update_cookies_manually() -> Dict[str, str]:
         logger.info("已手动更新Cookie")
     return cookies
 
-def update_cookies_auto() -> Dict[str, str]:
-    """强制自动更新cookie"""
+def update_cookies_auto(allow_browser: bool = False) -> Dict[str, str]:
+    """强制自动更新cookie，allow_browser为True时在失败后尝试半自动化获取cf_clearance"""
     cookies = auto_update_cookies()
+    if not cookies and allow_browser:
+        logger.info("尝试半自动化获取 cf_clearance...")
+        if auto_get_cf_clearance():
+            cookies = auto_update_cookies()
     if cookies:
         logger.info("已自动更新Cookie")
     else:
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, Dict, Optional
+
+from tracing import start_span
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("credential-scheduler")
+
+
+class CredentialScheduler:
+    """
+    基于真实过期时间的凭证刷新调度器
+
+    在session_token/cf_clearance过期前提前刷新（带随机抖动），失败时指数退避重试。
+    请求遇到401/403时调用trigger()立即唤醒调度器；并发的刷新请求共享同一次刷新。
+
+    只有运行run()的进程（leader）刷新凭证。其他进程调用trigger()时交给delegate
+    （例如在共享状态中记录刷新请求，由leader执行），本进程不刷新。
+    """
+
+    def __init__(
+        self,
+        refresh_func: Callable[[], Dict[str, str]],
+        expiry_func: Callable[[], Dict[str, float]],
+        on_refreshed: Callable[[Dict[str, str]], None],
+        lead_time: float,
+        jitter: float,
+        max_interval: float,
+        max_backoff: float,
+        min_interval: float = 30.0,
+        delegate: Optional[Callable[[str], None]] = None,
+    ):
+        self.refresh_func = refresh_func
+        self.expiry_func = expiry_func
+        self.on_refreshed = on_refreshed
+        self.lead_time = lead_time
+        self.jitter = jitter
+        self.max_interval = max_interval
+        self.max_backoff = max_backoff
+        self.min_interval = min_interval
+        self.delegate = delegate
+        self.failures = 0
+        self.last_refresh = 0.0
+        self.last_attempt = 0.0
+        self.last_ok = False
+        self.last_delegated = 0.0
+        self._wake: Optional[asyncio.Event] = None
+        self._inflight: Optional[asyncio.Future] = None
+
+    def _backoff(self) -> float:
+        """连续失败后的指数退避时间"""
+        return min(self.min_interval * (2 ** (self.failures - 1)), self.max_backoff)
+
+    def _next_delay(self) -> float:
+        """计算距离下一次刷新的等待时间"""
+        if self.failures:
+            # 指数退避，加入抖动避免多个进程同时重试
+            return self._backoff() + random.uniform(0, self.jitter)
+
+        delay = self.max_interval
+        # 刷新后仍未更新的过期时间（例如需要浏览器获取的cf_clearance）无法通过刷新解决，忽略它们
+        due_times = [
+            ts - self.lead_time for ts in self.expiry_func().values()
+            if ts - self.lead_time > self.last_refresh
+        ]
+        if due_times:
+            delay = min(delay, min(due_times) - time.time())
+        delay += random.uniform(-self.jitter, self.jitter)
+        return max(delay, self.min_interval)
+
+    @property
+    def running(self) -> bool:
+        """本进程是否运行调度主循环（即负责刷新凭证）"""
+        return self._wake is not None
+
+    def trigger(self, reason: str = "") -> None:
+        """立即唤醒调度器执行一次刷新（不等待结果）；本进程不是leader时交给delegate"""
+        if not self.running:
+            # 同一进程的大量失败请求只转交一次
+            if self.delegate is None or time.time() - self.last_delegated < self.min_interval:
+                return
+            self.last_delegated = time.time()
+            logger.info(f"请求leader刷新凭证: {reason}")
+            self.delegate(reason)
+            return
+        if self._inflight is not None or time.time() - self.last_refresh < self.min_interval:
+            # 刚刚刷新过或正在刷新，避免大量失败请求触发重复刷新
+            return
+        logger.info(f"收到立即刷新请求: {reason}")
+        self._wake.set()
+
+    async def refresh_now(self) -> bool:
+        """执行一次刷新；已有刷新进行中时等待同一个结果"""
+        if self._inflight is not None:
+            return await asyncio.shield(self._inflight)
+
+        self._inflight = asyncio.get_running_loop().create_future()
+        ok = False
+        refresh_span = start_span("credentials.refresh", failures=self.failures)
+        try:
+            # 刷新过程包含同步网络请求，放到线程中执行，避免阻塞事件循环
+            cookies = await asyncio.to_thread(self.refresh_func)
+            if cookies:
+                self.on_refreshed(cookies)
+                self.failures = 0
+                self.last_refresh = time.time()
+                ok = True
+                logger.info("凭证已在后台刷新")
+            else:
+                self.failures += 1
+                logger.warning(f"凭证刷新失败（连续失败 {self.failures} 次）")
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"凭证刷新出错: {e}", exc_info=True)
+        finally:
+            self.last_attempt = time.time()
+            self.last_ok = ok
+            refresh_span.set("ok", ok)
+            refresh_span.end()
+            self._inflight.set_result(ok)
+            self._inflight = None
+        return ok
+
+    async def refresh_if_due(self) -> bool:
+        """
+        请求失败后使用的刷新：已有刷新进行中时等待同一个结果；
+        min_interval内刚结束过一次刷新（连续失败时为退避时间内）时直接返回那次的结果，不再刷新
+        """
+        if self._inflight is not None:
+            return await asyncio.shield(self._inflight)
+        cooldown = self._backoff() if self.failures else self.min_interval
+        if time.time() - self.last_attempt < cooldown:
+            return self.last_ok
+        return await self.refresh_now()
+
+    async def run(self) -> None:
+        """调度主循环（被取消后running变为False，之后的trigger()交给delegate）"""
+        self._wake = asyncio.Event()
+        try:
+            while True:
+                delay = self._next_delay()
+                logger.info(f"下一次凭证刷新将在 {delay:.0f} 秒后进行")
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                await self.refresh_now()
+        finally:
+            self._wake = None
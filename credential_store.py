@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("credential-store")
+
+# 文件的(mtime_ns, size, inode)，任一变化都视为文件已被替换或修改
+_Signature = Tuple[int, int, int]
+
+
+def _signature(path: str) -> Optional[_Signature]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _fsync_directory(path: str) -> None:
+    """rename之后同步目录项，断电后不会丢失新文件（Windows不支持打开目录，跳过）"""
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class CredentialStore:
+    """
+    凭证文件（JSON对象）的读写层
+
+    - 读取：解析结果缓存在内存中，最多每check_interval秒stat一次文件，只有文件变化时才重新读取
+    - 写入：写入临时文件并fsync后rename，读者只会看到完整的旧文件或新文件；同一进程内的写入串行执行，
+      写入文件期间不持有缓存的锁，读取不会等待fsync
+    - 通知：文件内容变化时（本进程写入，或watch()发现其他进程/手动修改）以新内容调用订阅者。
+      订阅者在发现变化的线程中被调用（write()的调用线程或watch()使用的线程池），需要自行保证线程安全
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()  # 保护缓存
+        self._write_lock = threading.Lock()  # 串行化读取-修改-写入
+        self._data: Optional[Dict[str, Any]] = None
+        self._signature: Optional[_Signature] = None
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self._subscribers: List[Callable[[Dict[str, Any]], None]] = []
+        self.reads = 0
+        self.writes = 0
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        self._subscribers.append(callback)
+
+    def _notify(self, data: Dict[str, Any]) -> None:
+        for callback in self._subscribers:
+            try:
+                callback(dict(data))
+            except Exception as e:
+                logger.error(f"凭证变化通知出错: {e}", exc_info=True)
+
+    def _refresh(self, force: bool = False) -> bool:
+        """文件变化时重新读取，返回内容是否变化（调用方持有_lock）"""
+        now = time.monotonic()
+        if not force and self._checked and now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        signature = _signature(self.path)
+        if signature == self._signature:
+            return False
+        if signature is None:
+            changed = self._data is not None
+            self._data, self._signature, self._mtime = None, None, None
+            return changed
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("凭证文件必须是JSON对象")
+        except (OSError, ValueError) as e:
+            # 文件被改坏时保留缓存中的内容，文件修复后再读取
+            logger.error(f"读取凭证文件{self.path}失败，继续使用缓存的凭证: {e}")
+            self._signature = signature
+            return False
+        self.reads += 1
+        changed = data != self._data
+        self._data, self._signature, self._mtime = data, signature, signature[0] / 1e9
+        return changed
+
+    def _load(self, force: bool = False) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """返回(当前内容的副本, 是否发生变化)，读取到其他进程写入的新内容时通知订阅者"""
+        with self._lock:
+            changed = self._refresh(force)
+            data = dict(self._data) if self._data is not None else None
+        if changed and data is not None:
+            logger.info(f"凭证文件{self.path}已被修改，已重新加载")
+            self._notify(data)
+        return data, changed
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        """返回凭证文件内容的副本，文件不存在时返回None"""
+        return self._load()[0]
+
+    def mtime(self) -> Optional[float]:
+        """凭证文件最近一次修改的时间戳"""
+        self._load()
+        return self._mtime
+
+    def update(self, build: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]]) -> Dict[str, Any]:
+        """以当前内容调用build得到新内容并写入（读取和写入之间不会插入本进程的其他写入）"""
+        with self._write_lock:
+            with self._lock:
+                self._refresh(force=True)
+                current = dict(self._data) if self._data is not None else None
+            data = build(current)
+            changed = self._write(data)
+        if changed:
+            self._notify(data)
+        return data
+
+    def write(self, data: Dict[str, Any]) -> None:
+        """原子地写入新内容"""
+        self.update(lambda _old: data)
+
+    def _write(self, data: Dict[str, Any]) -> bool:
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        try:
+            _fsync_directory(self.path)
+        except OSError as e:
+            logger.warning(f"同步凭证文件所在目录失败: {e}")
+        signature = _signature(self.path)
+        with self._lock:
+            self.writes += 1
+            changed = data != self._data
+            self._data, self._signature = dict(data), signature
+            self._mtime = signature[0] / 1e9 if signature else time.time()
+            self._checked = time.monotonic()
+        return changed
+
+    def check(self) -> bool:
+        """立即检查文件是否变化，变化时通知订阅者"""
+        return self._load(force=True)[1]
+
+    async def watch(self, interval: float) -> None:
+        """定时检查文件变化（例如手动编辑或其他工具写入了凭证文件）"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.check)
+            except Exception as e:
+                logger.error(f"检查凭证文件时出错: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "cached": self._data is not None, "reads": self.reads, "writes": self.writes}
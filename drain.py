@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, AsyncGenerator, AsyncIterable, Optional, Tuple
+
+import uvicorn
+
+from upstream_errors import openai_error_body
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("drain")
+
+
+class DrainDeadline(Exception):
+    """排空期限已到，流需要立即结束"""
+
+
+class DrainController:
+    """
+    排空模式（用于无中断重启）
+
+    进入排空模式后不再接受新请求（就绪检查失败），进行中的请求可以继续到期限为止，
+    期限到达时由guard()包装的流抛出DrainDeadline，由调用方发送结束块后关闭。
+    """
+
+    def __init__(self):
+        self.draining = False
+        self.deadline: Optional[float] = None
+        self.active = 0
+        self._idle: Optional[asyncio.Event] = None
+        self._expired: Optional[asyncio.Event] = None
+
+    def _events(self) -> Tuple[asyncio.Event, asyncio.Event]:
+        # 在事件循环中首次使用时创建，避免绑定到导入时的事件循环
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            self._expired = asyncio.Event()
+        return self._idle, self._expired
+
+    def begin(self, timeout: float) -> bool:
+        """进入排空模式，timeout秒后结束仍在进行的流；已在排空时返回False"""
+        if self.draining:
+            return False
+        self.draining = True
+        self.deadline = time.monotonic() + timeout
+        idle, expired = self._events()
+        if self.active == 0:
+            idle.set()
+        asyncio.get_running_loop().call_later(timeout, expired.set)
+        logger.warning(f"进入排空模式：不再接受新请求，{self.active} 个进行中的请求最多等待 {timeout:.0f} 秒")
+        return True
+
+    async def wait(self, grace: float) -> None:
+        """等待进行中的请求全部结束；到期后再等待grace秒（让被截断的流发送结束块）"""
+        idle, _ = self._events()
+        remaining = max(self.deadline - time.monotonic(), 0) + grace
+        try:
+            await asyncio.wait_for(idle.wait(), timeout=remaining)
+            logger.info("进行中的请求已全部结束")
+        except asyncio.TimeoutError:
+            logger.warning(f"排空超时，仍有 {self.active} 个连接未结束")
+
+    def enter(self) -> None:
+        self.active += 1
+
+    def leave(self) -> None:
+        self.active -= 1
+        if self.draining and self.active == 0:
+            self._events()[0].set()
+
+    async def guard(self, stream: AsyncIterable[Any]) -> AsyncGenerator[Any, None]:
+        """逐个产生stream的元素，排空期限到达时关闭stream并抛出DrainDeadline"""
+        _, expired = self._events()
+        iterator = stream.__aiter__()
+        expired_wait = asyncio.ensure_future(expired.wait())
+        next_item = None
+        try:
+            while True:
+                next_item = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait({next_item, expired_wait}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_item.done():
+                    raise DrainDeadline()
+                try:
+                    item = next_item.result()
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            expired_wait.cancel()
+            if next_item is not None and not next_item.done():
+                # 等待被取消的读取结束后才能关闭stream
+                next_item.cancel()
+                await asyncio.gather(next_item, return_exceptions=True)
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+    def stats(self) -> dict:
+        remaining = max(self.deadline - time.monotonic(), 0) if self.deadline else None
+        return {"draining": self.draining, "active": self.active, "deadline_in": remaining}
+
+
+class DrainMiddleware:
+    """
+    统计进行中的请求（包括流式响应的整个传输过程），排空模式下以503拒绝新请求
+
+    exempt_prefixes中的路径（健康检查、管理端点等）始终放行，也不计入进行中的请求。
+    """
+
+    def __init__(self, app, controller: DrainController, exempt_prefixes: Tuple[str, ...] = ()):
+        self.app = app
+        self.controller = controller
+        self.exempt_prefixes = exempt_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or scope["path"].startswith(self.exempt_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        if self.controller.draining:
+            if scope["type"] == "websocket":
+                # 握手阶段关闭连接，客户端收到403
+                await send({"type": "websocket.close", "code": 1012})
+                return
+            body = json.dumps(openai_error_body(
+                "The server is restarting, please retry the request", "server_error", "server_shutting_down"
+            )).encode()
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"1"),
+                (b"connection", b"close"),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        self.controller.enter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.leave()
+
+
+class DrainableServer(uvicorn.Server):
+    """
+    记住本进程中运行的uvicorn服务器，close_on_drain为True时排空由stop_accepting()关闭它的监听socket
+
+    使用SO_REUSEPORT时新旧进程监听同一端口，旧进程关闭监听socket后内核只把新连接分配给新进程；
+    已经接受的连接不受影响（其中的新请求仍由DrainMiddleware返回503）。
+    """
+
+    current: Optional["DrainableServer"] = None
+
+    def __init__(self, config: uvicorn.Config, close_on_drain: bool = False):
+        super().__init__(config)
+        self.close_on_drain = close_on_drain
+
+    async def startup(self, sockets=None) -> None:
+        DrainableServer.current = self
+        await super().startup(sockets=sockets)
+
+
+def stop_accepting() -> bool:
+    """关闭本进程的监听socket；没有通过DrainableServer运行或不需要关闭时返回False"""
+    server = DrainableServer.current
+    if server is None or not server.close_on_drain or not getattr(server, "servers", None):
+        return False
+    for listener in server.servers:
+        listener.close()
+    logger.info("已关闭监听socket，新连接由同一端口上的其他进程接收")
+    return True
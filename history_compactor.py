@@ -0,0 +1,83 @@
+import logging
+from typing import Any, Dict, List
+
+from token_counter import count_message_tokens
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("history-compactor")
+
+
+def compact_history(system: str, messages: List[Dict[str, Any]], budget: int,
+                    drop_middle: bool = False, keep_first: int = 0) -> Dict[str, Any]:
+    """
+    在模型的上下文预算内压缩对话历史
+
+    始终保留系统提示和最后一条消息，然后从最近的消息开始向前保留，直到用完预算。
+    drop_middle为True时，优先保留开头的keep_first条消息（通常是交代任务的第一轮对话），
+    丢弃的是中间的消息。
+
+    Args:
+        system: 系统提示
+        messages: 不含系统提示的消息列表（{"role", "content"}）
+        budget: 可用于输入的token数
+        drop_middle: 是否保留开头的消息、丢弃中间的消息
+        keep_first: drop_middle为True时保留的开头消息数
+
+    Returns:
+        dict: messages（压缩后的消息列表）、dropped（被丢弃消息的原始下标）、
+              dropped_tokens（被丢弃的token数）、tokens（保留部分的估算token数）
+    """
+    counts = [count_message_tokens(msg["role"], msg["content"]) for msg in messages]
+    system_tokens = count_message_tokens("system", system) if system else 0
+    total = system_tokens + sum(counts)
+    if total <= budget or len(messages) <= 1:
+        return {"messages": messages, "dropped": [], "dropped_tokens": 0, "tokens": total}
+
+    used = system_tokens + counts[-1]
+    keep = {len(messages) - 1}
+
+    # 保留开头的消息（只在预算允许时）
+    if drop_middle:
+        for index in range(min(keep_first, len(messages) - 1)):
+            if used + counts[index] > budget:
+                break
+            keep.add(index)
+            used += counts[index]
+
+    # 从最近的消息开始向前保留
+    for index in range(len(messages) - 2, -1, -1):
+        if index in keep:
+            continue
+        if used + counts[index] > budget:
+            break
+        keep.add(index)
+        used += counts[index]
+
+    dropped = [index for index in range(len(messages)) if index not in keep]
+    dropped_tokens = sum(counts[index] for index in dropped)
+    if used > budget:
+        # 系统提示和最后一条消息本身就超出预算，交给上游判断
+        logger.warning(f"系统提示和最后一条消息约 {used} tokens，已超出上下文预算 {budget}")
+    logger.info(f"对话历史超出上下文预算（约 {total}/{budget} tokens），丢弃 {len(dropped)} 条消息（约 {dropped_tokens} tokens）")
+    return {
+        "messages": [msg for index, msg in enumerate(messages) if index in keep],
+        "dropped": dropped,
+        "dropped_tokens": dropped_tokens,
+        "tokens": used,
+    }
+
+
+def format_index_ranges(indices: List[int]) -> str:
+    """将下标列表格式化为紧凑的区间表示，例如 [1, 2, 3, 7] -> "1-3,7"（用于响应头）"""
+    ranges = []
+    for index in sorted(indices):
+        if ranges and index == ranges[-1][1] + 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
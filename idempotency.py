@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi.responses import Response, StreamingResponse
+
+from upstream_errors import openai_error_response
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("idempotency")
+
+# Idempotency-Key的最大长度
+MAX_KEY_LENGTH = 255
+# 流式响应重放时不复制的响应头
+_STREAM_SKIP_HEADERS = (b"content-length",)
+
+
+class IdempotencyError(Exception):
+    """Idempotency-Key无效或与之前的请求冲突"""
+
+    def __init__(self, status_code: int, message: str, code: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.code = code
+
+    def to_response(self) -> Response:
+        return openai_error_response(self.status_code, self.message, "invalid_request_error", self.code)
+
+
+def scope_for(authorization: Optional[str]) -> str:
+    """按API key划分的作用域（只保存哈希，不保存key本身）；没有Authorization时所有请求共用一个作用域"""
+    if not authorization:
+        return "anonymous"
+    return hashlib.sha256(authorization.encode()).hexdigest()[:32]
+
+
+class _Entry:
+    """一个Idempotency-Key对应的执行结果（进行中或已完成）"""
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.created = time.monotonic()
+        self.status_code = 0
+        self.raw_headers: List[Tuple[bytes, bytes]] = []
+        self.body: Optional[bytes] = None
+        self.events: Optional[List[Any]] = None  # 流式响应的各个块
+        self.size = 0
+        self.finished = False
+        self.failed = False
+        self.ready = asyncio.Event()  # 状态码和响应头已确定
+        self._changed = asyncio.Event()  # 流式响应有新的块或已结束
+        self.task: Optional[asyncio.Task] = None
+
+    def append(self, chunk: Any) -> None:
+        self.events.append(chunk)
+        self.size += len(chunk)
+        self._notify()
+
+    def finish(self, failed: bool = False) -> None:
+        self.finished = True
+        self.failed = failed
+        self.ready.set()
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def replay(self) -> AsyncGenerator[Any, None]:
+        """从头产生流式响应的块，进行中时跟随生成"""
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.finished:
+                return
+            await changed.wait()
+
+    def response(self, replayed: bool) -> Response:
+        headers = list(self.raw_headers)
+        if replayed:
+            headers.append((b"idempotent-replayed", b"true"))
+        if self.events is not None:
+            response = StreamingResponse(self.replay(), status_code=self.status_code)
+            response.raw_headers = [(name, value) for name, value in headers if name not in _STREAM_SKIP_HEADERS]
+            return response
+        response = Response(self.body, status_code=self.status_code)
+        response.raw_headers = headers
+        return response
+
+
+class IdempotencyStore:
+    """
+    Idempotency-Key的执行结果（内存中，LRU淘汰）
+
+    - 第一个请求正常执行；执行期间相同key的请求等待并共享同一个结果，流式请求从头跟随同一个生成
+    - 成功的结果保留ttl秒，期间相同key的请求直接返回保存的结果（流式响应按原来的块重放），响应头带有Idempotent-Replayed
+    - 失败的结果不保存，客户端重试时重新执行
+    - 相同key但请求体不同时返回422
+    - 流式请求的生成在后台任务中进行，第一个客户端断开后继续生成，重试的请求可以接上
+
+    条目数和总大小有上限，超出时淘汰最久未使用的已完成条目。
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self.hits = 0
+        self.attached = 0
+        self.evicted = 0
+
+    def _get(self, scope: str, key: str) -> Optional[_Entry]:
+        entry = self._entries.get((scope, key))
+        if entry is None:
+            return None
+        if entry.finished and time.monotonic() - entry.created > self.ttl:
+            del self._entries[(scope, key)]
+            return None
+        self._entries.move_to_end((scope, key))
+        return entry
+
+    def _discard(self, scope: str, key: str, entry: _Entry) -> None:
+        if self._entries.get((scope, key)) is entry:
+            del self._entries[(scope, key)]
+
+    def _evict(self) -> None:
+        total = sum(entry.size for entry in self._entries.values())
+        for item_key in list(self._entries):
+            if len(self._entries) <= self.max_entries and total <= self.max_bytes:
+                return
+            entry = self._entries[item_key]
+            # 进行中的条目不淘汰
+            if entry.finished:
+                del self._entries[item_key]
+                total -= entry.size
+                self.evicted += 1
+
+    async def execute(self, scope: str, key: str, body: bytes,
+                      handler: Callable[[], Awaitable[Response]]) -> Response:
+        """以(scope, key)去重执行handler"""
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise IdempotencyError(400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters", "invalid_idempotency_key")
+        fingerprint = hashlib.sha256(body).hexdigest()
+        entry = self._get(scope, key)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyError(422, "Idempotency-Key was already used with a different request body",
+                                       "idempotency_key_reused")
+            if entry.finished and not entry.failed:
+                self.hits += 1
+            else:
+                self.attached += 1
+            await entry.ready.wait()
+            if entry.failed and entry.events is None:
+                raise IdempotencyError(409, "The original request with this Idempotency-Key failed, please retry",
+                                       "idempotency_request_failed")
+            return entry.response(replayed=True)
+
+        entry = _Entry(fingerprint)
+        self._entries[(scope, key)] = entry
+        self._evict()
+        try:
+            response = await handler()
+        except BaseException:
+            self._discard(scope, key, entry)
+            entry.finish(failed=True)
+            raise
+
+        entry.status_code = response.status_code
+        entry.raw_headers = list(response.raw_headers)
+        if isinstance(response, StreamingResponse):
+            entry.events = []
+            entry.task = asyncio.create_task(self._produce(scope, key, entry, response))
+            entry.ready.set()
+            return entry.response(replayed=False)
+
+        entry.body = response.body
+        entry.size = len(response.body)
+        entry.finish()
+        if response.status_code != 200:
+            self._discard(scope, key, entry)
+        self._evict()
+        return response
+
+    async def _produce(self, scope: str, key: str, entry: _Entry, response: StreamingResponse) -> None:
+        """在后台读取流式响应，与客户端连接无关"""
+        failed = False
+        try:
+            async for chunk in response.body_iterator:
+                entry.append(chunk)
+        except Exception as e:
+            failed = True
+            logger.error(f"Idempotency-Key {key} 的流式响应出错: {e}", exc_info=True)
+        finally:
+            if response.background is not None:
+                await response.background()
+            entry.finish(failed=failed)
+            if failed or entry.size > self.max_bytes:
+                self._discard(scope, key, entry)
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "in_progress": sum(1 for entry in self._entries.values() if not entry.finished),
+            "bytes": sum(entry.size for entry in self._entries.values()),
+            "hits": self.hits,
+            "attached": self.attached,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,110 @@
+import logging
+import zlib
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from upstream_errors import openai_error_response
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("ingestion")
+
+# zstd解压需要zstandard（可选依赖）
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUPPORTED_ENCODINGS = ("identity", "gzip", "x-gzip", "deflate", "zstd")
+# zlib自动识别gzip和zlib头
+ZLIB_AUTO_WBITS = 47
+
+
+class RequestBodyError(Exception):
+    """请求体过大、编码不支持或无法解压"""
+
+    def __init__(self, status_code: int, message: str, code: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.code = code
+
+    def to_response(self) -> JSONResponse:
+        return openai_error_response(self.status_code, self.message, "invalid_request_error", self.code)
+
+
+def _too_large(max_bytes: int) -> RequestBodyError:
+    return RequestBodyError(413, f"Request body exceeds the limit of {max_bytes} bytes", "request_too_large")
+
+
+def _inflate(data: bytes, max_bytes: int) -> bytes:
+    decompressor = zlib.decompressobj(ZLIB_AUTO_WBITS)
+    try:
+        # 限制输出长度，压缩炸弹不会在内存中完全展开
+        body = decompressor.decompress(data, max_bytes + 1)
+    except zlib.error as e:
+        raise RequestBodyError(400, f"Invalid compressed request body: {e}", "invalid_content_encoding")
+    if len(body) > max_bytes or decompressor.unconsumed_tail:
+        raise _too_large(max_bytes)
+    if not decompressor.eof:
+        raise RequestBodyError(400, "Truncated compressed request body", "invalid_content_encoding")
+    return body
+
+
+def _unzstd(data: bytes, max_bytes: int) -> bytes:
+    chunks, size = [], 0
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            while True:
+                chunk = reader.read(max_bytes + 1 - size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                chunks.append(chunk)
+    except zstandard.ZstdError as e:
+        raise RequestBodyError(400, f"Invalid compressed request body: {e}", "invalid_content_encoding")
+    return b"".join(chunks)
+
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """
+    读取请求体，边读边检查大小，超过max_bytes时立即停止读取
+
+    支持gzip/deflate和zstd（需要安装zstandard）压缩的请求体，解压后的大小同样受max_bytes限制。
+    请求体只有一个分块时直接返回该分块，不做拼接复制。
+    """
+    encoding = request.headers.get("content-encoding", "identity").strip().lower() or "identity"
+    if encoding not in SUPPORTED_ENCODINGS:
+        raise RequestBodyError(415, f"Unsupported Content-Encoding {encoding}", "unsupported_content_encoding")
+    if encoding == "zstd" and zstandard is None:
+        logger.warning("收到zstd压缩的请求体，但未安装 zstandard")
+        logger.info("请运行: pip install zstandard")
+        raise RequestBodyError(415, "zstd request bodies are not supported by this server",
+                               "unsupported_content_encoding")
+
+    content_length: Optional[str] = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise _too_large(max_bytes)
+
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large(max_bytes)
+        if chunk:
+            chunks.append(chunk)
+    body = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        return _inflate(body, max_bytes)
+    if encoding == "zstd":
+        return _unzstd(body, max_bytes)
+    return body
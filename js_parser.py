@@ -1,5 +1,6 @@
 import re
 import json
+import bisect
 import logging
 
 # 配置日志
@@ -10,108 +11,524 @@ logging.basicConfig(
 )
 logger = logging.getLogger("js-parser")
 
+# 词法规则
+_WHITESPACE = re.compile(r'\s*')
+_IDENTIFIER = re.compile(r'[A-Za-z_$][\w$]*')
+_NUMBER = re.compile(r'-?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)')
+_ESCAPE = re.compile(r'\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|[\s\S])')
+_SIMPLE_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0', '\n': '', '\r\n': ''}
+# 跳过表达式时只需要关注括号、字符串、模板、正则/注释和逗号
+_INTERESTING = re.compile(r'[\[\]{}()"\'`,/]')
+# 扫描字符串、模板字符串、正则字面量和注释时的停止位置
+_STRING_STOPS = {'"': re.compile(r'["\\]'), "'": re.compile(r"['\\]")}
+_TEMPLATE_STOPS = re.compile(r'[`\\]|\$\{')
+_REGEX_STOPS = re.compile(r'[/\\\[\r\n]')
+_REGEX_CLASS_STOPS = re.compile(r'[\]\\\r\n]')
+_REGEX_FLAGS = re.compile(r'[A-Za-z]*')
+_LINE_END = re.compile(r'\n')
+_COMMENT_END = re.compile(r'\*/')
+# 括号或模板字符串一直到文本末尾都没有闭合
+_UNCLOSED = -1
+# 这些关键字后面的 / 是正则字面量的开头而不是除号
+_REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case', 'do', 'else', 'yield', 'await'}
+_KEYWORDS = {'true': True, 'false': False, 'null': None, 'undefined': None}
+# 到达文本末尾时_peek返回的占位字符
+_EOF = '\x00'
+
+
+class JSLiteralError(ValueError):
+    """遇到对象字面量子集之外的语法"""
+
+
+class _FoundModelArray(Exception):
+    """找到模型数组后提前结束扫描"""
+
+    def __init__(self, models):
+        self.models = models
+
+
+def _decode_escape(match):
+    escape = match.group(1)
+    if escape.startswith('u{'):
+        return chr(int(escape[2:-1], 16))
+    if escape[0] in 'ux' and len(escape) > 1:
+        return chr(int(escape[1:], 16))
+    return _SIMPLE_ESCAPES.get(escape, escape)
+
+
+def _decode_string(raw):
+    """处理JS字符串中的转义字符"""
+    if '\\' not in raw:
+        return raw
+    decoded = _ESCAPE.sub(_decode_escape, raw)
+    # 合并\uXXXX形式的代理对
+    return decoded.encode('utf-16', 'surrogatepass').decode('utf-16', errors='replace')
+
+
+class _LiteralParser:
+    """
+    单遍扫描的JS对象字面量解析器
+
+    支持的子集：对象（含未加引号的键）、数组、字符串（含转义）、数字、
+    !0/!1、true/false/null/undefined、void 0。
+    其他表达式（函数、变量引用等）作为None跳过，跳过时只做词法扫描，不调用值解析器。
+    find_model_array会从很多个起点开始解析同一段文本，所以解析和扫描的结果都按位置记住：
+    每个 { [ 起点的解析结果（包括失败）、每个括号和模板字符串的结束位置（包括没有闭合）、
+    每个同一层记号开始的跳过的结束位置，以及字符串、正则和注释的结束位置。
+    任何位置都只会被扫描常数次，没有闭合的括号也不会让每个起点都重新扫描到文本末尾。
+    """
+
+    def __init__(self, text, on_array):
+        self.s = text
+        self.n = len(text)
+        self.i = 0
+        self.on_array = on_array
+        # 起点 -> (结束位置, 解析结果)
+        self._parsed = {}
+        self._failed = set()
+        # 跳过时经过的 ( [ { ` 的位置 -> 对应的 ) ] } ` 的位置（没有闭合时为_UNCLOSED）
+        self._closing = {}
+        # 包含${...}插值的模板字符串的起点
+        self._interpolated = set()
+        # 同一层的记号位置 -> 从该位置跳过表达式的结束位置
+        self._skip_end = {}
+        # 字符串、正则字面量、注释和除号的起点 -> 结束位置
+        self._token_end = {}
+        # 正则 -> 它在文本中出现的全部位置，见_search
+        self._positions = {}
+
+    def _peek(self):
+        """跳过空白并返回下一个字符（压缩后的代码很少有空白，先走快速路径）"""
+        i = self.i
+        if i < self.n:
+            ch = self.s[i]
+            if ch not in ' \t\r\n':
+                return ch
+            self.i = i = _WHITESPACE.match(self.s, i).end()
+            if i < self.n:
+                return self.s[i]
+        return _EOF
+
+    def _search(self, pattern, i):
+        """
+        pattern在i之后第一次出现的位置，没有时返回-1
+
+        第一次使用时找出pattern的全部位置，之后二分查找：从不同起点的扫描会查找同一个结束位置
+        （例如没有闭合的注释或正则字符类），直接查找时每次都要扫描到文本末尾
+        """
+        positions = self._positions.get(pattern)
+        if positions is None:
+            positions = self._positions[pattern] = [match.start() for match in pattern.finditer(self.s)]
+        k = bisect.bisect_left(positions, i)
+        return positions[k] if k < len(positions) else -1
+
+    def _string_end(self, start):
+        """引号字符串的结束位置（不含）；没有闭合时返回-1"""
+        end = self._token_end.get(start)
+        if end is None:
+            stops = _STRING_STOPS[self.s[start]]
+            i = start + 1
+            while True:
+                j = self._search(stops, i)
+                if j == -1 or self.s[j] != '\\':
+                    break
+                i = j + 2
+            end = self._token_end[start] = -1 if j == -1 else j + 1
+        return end
+
+    def _string(self):
+        start = self.i
+        quote = self.s[start]
+        if quote == '`':
+            closing = self._closing.get(start)
+            if closing is None:
+                self.i = start + 1
+                self._scan([start])
+                closing = self._closing[start]
+            if closing == _UNCLOSED:
+                raise JSLiteralError(f"未闭合的模板字符串: {start}")
+            if start in self._interpolated:
+                raise JSLiteralError(f"模板字符串包含插值: {start}")
+            self.i = closing + 1
+            return _decode_string(self.s[start + 1:closing])
+        end = self._string_end(start)
+        if end == -1:
+            raise JSLiteralError(f"未闭合的字符串: {start}")
+        self.i = end
+        return _decode_string(self.s[start + 1:end - 1])
+
+    def _regex_allowed(self):
+        """根据前一个有效字符判断当前的 / 是正则字面量的开头还是除号"""
+        j = self.i - 1
+        while j >= 0 and self.s[j] in ' \t\r\n':
+            j -= 1
+        if j < 0:
+            return True
+        ch = self.s[j]
+        if ch in ')]':
+            return False
+        if ch.isalnum() or ch in '_$':
+            end = j + 1
+            while j >= 0 and (self.s[j].isalnum() or self.s[j] in '_$'):
+                j -= 1
+            return self.s[j + 1:end] in _REGEX_KEYWORDS
+        return True
+
+    def _regex_end(self, start):
+        """从start的 / 开始的正则字面量的结束位置（不含）；不是完整的正则时返回-1"""
+        in_class = False
+        i = start + 1
+        while True:
+            j = self._search(_REGEX_CLASS_STOPS if in_class else _REGEX_STOPS, i)
+            if j == -1 or self.s[j] in '\r\n':
+                return -1
+            ch = self.s[j]
+            if ch == '\\':
+                i = j + 2
+            elif ch == '[':
+                in_class = True
+                i = j + 1
+            elif in_class:
+                in_class = False
+                i = j + 1
+            elif j == start + 1:
+                return -1
+            else:
+                return _REGEX_FLAGS.match(self.s, j + 1).end()
+
+    def _skip_slash(self):
+        """跳过注释或正则字面量；是除号时只前进一个字符"""
+        start = self.i
+        end = self._token_end.get(start)
+        if end is None:
+            if self.s.startswith('//', start):
+                end = self._search(_LINE_END, start)
+            elif self.s.startswith('/*', start):
+                end = self._search(_COMMENT_END, start + 2)
+                end = end if end == -1 else end + 2
+            else:
+                end = self._regex_end(start) if self._regex_allowed() else start + 1
+                end = start + 1 if end == -1 else end
+            end = self._token_end[start] = self.n if end == -1 else end
+        self.i = end
+
+    def _scan(self, opened):
+        """
+        从self.i开始词法扫描（括号、字符串、模板字符串、正则/注释和逗号）
+
+        opened为空时跳过一个表达式，停在同一层的 , } ] ) 处；
+        opened为 [模板字符串的起点] 时扫描到该模板字符串结束。
+        经过的括号和模板字符串都记住结束位置，没有闭合的记为_UNCLOSED，再次遇到时直接跳过；
+        模板字符串中的${...}与括号放在同一个栈中，不需要递归。
+        """
+        s = self.s
+        skipping = not opened
+        # 同一层的记号位置，扫描结束后都记住结束位置
+        visited = []
+        while True:
+            if opened and s[opened[-1]] == '`':
+                # 模板字符串的文本部分
+                j = self._search(_TEMPLATE_STOPS, self.i)
+                if j == -1:
+                    self.i = self.n
+                    break
+                ch = s[j]
+                if ch == '\\':
+                    self.i = j + 2
+                elif ch == '`':
+                    self._closing[opened.pop()] = j
+                    self.i = j + 1
+                    if not opened and not skipping:
+                        return
+                else:
+                    self._interpolated.add(opened[-1])
+                    opened.append(j)
+                    self.i = j + 2
+                continue
+
+            match = _INTERESTING.search(s, self.i)
+            if not match:
+                self.i = self.n
+                break
+            self.i = pos = match.start()
+            ch = match.group()
+            if not opened:
+                end = self._skip_end.get(pos)
+                if end is not None:
+                    self.i = end
+                    break
+                visited.append(pos)
+            if ch in '"\'':
+                end = self._string_end(pos)
+                self.i = pos + 1 if end == -1 else end
+            elif ch == '/':
+                self._skip_slash()
+            elif ch in '[{(`':
+                closing = self._closing.get(pos)
+                if closing is None:
+                    opened.append(pos)
+                    self.i = pos + 1
+                elif closing == _UNCLOSED:
+                    self.i = self.n
+                    break
+                else:
+                    self.i = closing + 1
+            elif ch in ']})':
+                if not opened:
+                    break
+                # 模板字符串中${...}的 } 回到文本部分
+                self._closing[opened.pop()] = pos
+                self.i = pos + 1
+            elif opened:
+                self.i = pos + 1
+            else:
+                break
+
+        if self.i == self.n:
+            for pos in opened:
+                self._closing[pos] = _UNCLOSED
+        for pos in visited:
+            self._skip_end[pos] = self.i
+
+    def _skip_expression(self):
+        """
+        跳过不支持的表达式，停在同一层的 , } ] ) 处
+
+        只做词法扫描，其中的 [{ 数组由find_model_array从各自的起点单独解析
+        """
+        self._scan([])
+
+    def _value_or_skip(self):
+        """解析一个值；不在支持的子集内时跳过整个表达式并返回None"""
+        start = self.i
+        try:
+            value = self._value()
+        except JSLiteralError:
+            # 失败的位置可能在嵌套的括号内，回到开头扫描
+            self.i = start
+        else:
+            if self._peek() in (',', '}', ']'):
+                return value
+            # 值后面还有运算符等内容（例如 [{...}].map(f)），说明是更大的表达式；
+            # 已经解析的值是完整的，从值的末尾继续跳过
+        self._skip_expression()
+        return None
+
+    def _literal(self, ch):
+        """解析 { 或 [ 开头的字面量，记住每个起点的结果"""
+        start = self.i
+        if start in self._failed:
+            raise JSLiteralError(f"不支持的字面量: {start}")
+        if start in self._parsed:
+            self.i, value = self._parsed[start]
+            return value
+        try:
+            value = self._object() if ch == '{' else self._array()
+        except (JSLiteralError, RecursionError):
+            # 嵌套过深的字面量也按失败记住，否则内层的每个起点都会重新递归到上限
+            self._failed.add(start)
+            raise
+        self._parsed[start] = (self.i, value)
+        return value
+
+    def _value(self):
+        ch = self._peek()
+        if ch in '{[':
+            return self._literal(ch)
+        if ch in '"\'`':
+            return self._string()
+        if ch == '!' and self.s.startswith(('!0', '!1'), self.i):
+            self.i += 2
+            return self.s[self.i - 1] == '0'
+        match = _NUMBER.match(self.s, self.i)
+        if match:
+            self.i = match.end()
+            text = match.group()
+            if text.lstrip('-')[:2] in ('0x', '0X'):
+                return int(text, 16)
+            return float(text) if any(c in text for c in '.eE') else int(text)
+        if self.s.startswith('void 0', self.i):
+            self.i += 6
+            return None
+        match = _IDENTIFIER.match(self.s, self.i)
+        if match and match.group() in _KEYWORDS:
+            self.i = match.end()
+            return _KEYWORDS[match.group()]
+        raise JSLiteralError(f"不支持的值: {self.i}")
+
+    def _array(self):
+        self.i += 1
+        items = []
+        while True:
+            ch = self._peek()
+            if ch == ']':
+                self.i += 1
+                break
+            if ch == ',':
+                # 稀疏数组中的空位
+                self.i += 1
+                items.append(None)
+                continue
+            items.append(self._value_or_skip())
+            ch = self._peek()
+            if ch == ',':
+                self.i += 1
+            elif ch != ']':
+                raise JSLiteralError(f"数组中缺少逗号: {self.i}")
+        self.on_array(items)
+        return items
+
+    def _key(self):
+        ch = self._peek()
+        if ch in '"\'':
+            return self._string()
+        match = _IDENTIFIER.match(self.s, self.i) or _NUMBER.match(self.s, self.i)
+        if not match:
+            raise JSLiteralError(f"不支持的对象键: {self.i}")
+        self.i = match.end()
+        return match.group()
+
+    def _object(self):
+        self.i += 1
+        result = {}
+        while True:
+            ch = self._peek()
+            if ch == '}':
+                self.i += 1
+                return result
+            if self.s.startswith('...', self.i):
+                # 展开语法，跳过
+                self.i += 3
+                self._skip_expression()
+            else:
+                key = self._key()
+                ch = self._peek()
+                if ch == ':':
+                    self.i += 1
+                    result[key] = self._value_or_skip()
+                elif ch in (',', '}'):
+                    # 简写属性引用的是变量
+                    result[key] = None
+                else:
+                    # 方法简写等
+                    self._skip_expression()
+                    result[key] = None
+            ch = self._peek()
+            if ch == ',':
+                self.i += 1
+            elif ch != '}':
+                raise JSLiteralError(f"对象中缺少逗号: {self.i}")
+
+
+def parse_js_literal(text, start=0):
+    """
+    解析text中从start开始的一个JS字面量
+
+    Returns:
+        tuple: (解析结果, 结束位置)
+    """
+    parser = _LiteralParser(text, lambda items: None)
+    parser.i = start
+    try:
+        return parser._value(), parser.i
+    except RecursionError:
+        raise JSLiteralError("字面量嵌套过深")
+
+
+def _is_model_array(items):
+    """判断一个数组是否是模型列表：元素都是带id和name的对象，并且有description或available属性"""
+    if not items:
+        return False
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("id"), str) or not isinstance(item.get("name"), str):
+            return False
+    return "description" in items[0] or "available" in items[0]
+
+
+def find_model_array(js_content, include_unavailable=False):
+    """
+    按结构（而不是模块ID）在JavaScript文件中查找模型数组
+
+    依次尝试所有 [{ 开头的数组字面量，元素都是带id/name的对象的数组即为模型列表。
+    已经作为其他字面量的一部分解析过（或解析失败）的起点直接使用记住的结果。
+    保留模型对象中的全部字段。
+
+    Args:
+        js_content: JavaScript文件的内容
+        include_unavailable: 是否包含available为false的模型
+
+    Returns:
+        list: 模型列表；没有找到时返回None
+    """
+    def on_array(items):
+        if _is_model_array(items):
+            raise _FoundModelArray(items)
+
+    parser = _LiteralParser(js_content, on_array)
+    pos = 0
+    try:
+        while True:
+            start = js_content.find('[{', pos)
+            if start == -1:
+                return None
+            # 被跳过的表达式中的数组（例如函数体中的 let o=[{...}]）也要尝试，所以不跳到数组末尾
+            pos = start + 1
+            parser.i = start
+            try:
+                parser._literal('[')
+            except (JSLiteralError, RecursionError):
+                pass
+    except _FoundModelArray as found:
+        models = [
+            model for model in found.models
+            if include_unavailable or model.get("available", True)
+        ]
+        logger.info(f"按结构找到模型数组，共 {len(found.models)} 个模型，其中 {len(models)} 个可用")
+        return models
+
+
+# 所有提取方法都失败时使用的默认模型列表
+DEFAULT_MODELS = [
+    {"id": "DeepSeek-R1", "name": "DeepSeek R1 671B", "description": "Strong Mixture-of-Experts (MoE) LLM"},
+    {"id": "Qwen3-235B-A22B-FP8", "name": "Qwen3 235B A22B", "description": "Advanced reasoning model with 235B parameters (22B active)"},
+    {"id": "meta-llama-Llama-4-Maverick-17B-128E-Instruct-FP8", "name": "Llama 4 Maverick 17B 128E", "description": "400B parameter model (17B active) with 128 experts"},
+    {"id": "nvidia-Llama-3-3-Nemotron-Super-49B-v1", "name": "Llama 3.3 Nemotron Super 49B", "description": "Great tradeoff between model accuracy and efficiency"},
+    {"id": "Qwen-QwQ-32B", "name": "Qwen QwQ-32B", "description": "Medium-sized reasoning model with enhanced performance"},
+    {"id": "Meta-Llama-3-3-70B-Instruct", "name": "Llama 3.3 70B", "description": "Well-rounded model with strong capabilities"},
+    {"id": "Meta-Llama-3-1-405B-Instruct-FP8", "name": "Llama 3.1 405B", "description": "Most capable model for complex tasks"},
+    {"id": "AkashGen", "name": "AkashGen", "description": "Generate images using AkashGen"}
+]
+
+
 def extract_models_from_js(js_content):
     """
     从JavaScript文件中提取模型列表
-    
+
     Args:
         js_content: JavaScript文件的内容
-    
+
     Returns:
         list: 模型列表
     """
     try:
-        # 尝试匹配模型数组定义
-        # 首先尝试匹配完整的数组定义
-        # 在JS文件中，模型列表定义在module ID 68382中
-        # 格式为: 68382:(e,t,a)=>{a.d(t,{$I:()=>r,Jn:()=>o});var n=a(2818);let o=[{...}]
-        model_array_match = re.search(r'68382[^{]*\{[^{]*\$I[^{]*Jn[^{]*o\}\)[^{]*let\s+o\s*=\s*(\[.*?\])(?=,r\s*=|;)', js_content, re.DOTALL)
-        
-        if model_array_match:
-            # 提取数组文本
-            array_text = model_array_match.group(1)
-            logger.info(f"找到模型数组定义，长度: {len(array_text)}")
-            
-            # 直接从数组文本中提取模型对象
-            model_objects = []
-            
-            # 使用正则表达式提取每个模型对象的关键属性
-            pattern = r'\{id:"([^"]+)",name:"([^"]+)",description:"([^"]+)".*?available:(!0|true)'
-            matches = re.finditer(pattern, array_text, re.DOTALL)
-            
-            for match in matches:
-                model_id = match.group(1)
-                name = match.group(2)
-                description = match.group(3)
-                available = match.group(4) in ["!0", "true"]
-                
-                if available:  # 只添加可用的模型
-                    model_objects.append({
-                        "id": model_id,
-                        "name": name,
-                        "description": description
-                    })
-            
-            if model_objects:
-                logger.info(f"成功提取 {len(model_objects)} 个模型")
-                return model_objects
-            else:
-                logger.warning("无法从数组文本中提取模型对象")
-        else:
-            logger.warning("无法找到模型数组定义")
-        
-        # 如果上面的方法失败，尝试直接搜索模型ID
-        logger.info("尝试直接搜索模型ID")
-        model_objects = []
-        model_ids = [
-            "DeepSeek-R1", 
-            "Qwen3-235B-A22B-FP8", 
-            "meta-llama-Llama-4-Maverick-17B-128E-Instruct-FP8",
-            "nvidia-Llama-3-3-Nemotron-Super-49B-v1", 
-            "Qwen-QwQ-32B", 
-            "Meta-Llama-3-3-70B-Instruct",
-            "Meta-Llama-3-1-405B-Instruct-FP8", 
-            "AkashGen"
-        ]
-        
-        for model_id in model_ids:
-            # 注意JS中available可能是!0（JavaScript中的true）
-            pattern = r'id:"' + re.escape(model_id) + r'".*?name:"([^"]+)".*?description:"([^"]+)".*?available:(!0|true)'
-            model_match = re.search(pattern, js_content, re.DOTALL)
-            
-            if model_match:
-                model_objects.append({
-                    "id": model_id,
-                    "name": model_match.group(1),
-                    "description": model_match.group(2)
-                })
-        
+        model_objects = find_model_array(js_content)
         if model_objects:
-            logger.info(f"通过直接搜索找到 {len(model_objects)} 个模型")
+            logger.info(f"成功提取 {len(model_objects)} 个模型")
             return model_objects
-        
+
         # 如果所有方法都失败，返回一个默认模型列表
-        logger.warning("所有提取方法都失败，返回默认模型列表")
-        return [
-            {"id": "DeepSeek-R1", "name": "DeepSeek R1 671B", "description": "Strong Mixture-of-Experts (MoE) LLM"},
-            {"id": "Qwen3-235B-A22B-FP8", "name": "Qwen3 235B A22B", "description": "Advanced reasoning model with 235B parameters (22B active)"},
-            {"id": "meta-llama-Llama-4-Maverick-17B-128E-Instruct-FP8", "name": "Llama 4 Maverick 17B 128E", "description": "400B parameter model (17B active) with 128 experts"},
-            {"id": "nvidia-Llama-3-3-Nemotron-Super-49B-v1", "name": "Llama 3.3 Nemotron Super 49B", "description": "Great tradeoff between model accuracy and efficiency"},
-            {"id": "Qwen-QwQ-32B", "name": "Qwen QwQ-32B", "description": "Medium-sized reasoning model with enhanced performance"},
-            {"id": "Meta-Llama-3-3-70B-Instruct", "name": "Llama 3.3 70B", "description": "Well-rounded model with strong capabilities"},
-            {"id": "Meta-Llama-3-1-405B-Instruct-FP8", "name": "Llama 3.1 405B", "description": "Most capable model for complex tasks"},
-            {"id": "AkashGen", "name": "AkashGen", "description": "Generate images using AkashGen"}
-        ]
-    
+        logger.warning("无法找到模型数组定义，返回默认模型列表")
+        return DEFAULT_MODELS
+
     except Exception as e:
         logger.error(f"提取模型列表时出错: {e}", exc_info=True)
         # 返回一个默认模型
-        return [{"id": "DeepSeek-R1", "name": "DeepSeek R1 671B", "description": "Strong Mixture-of-Experts (MoE) LLM"}]
+        return [DEFAULT_MODELS[0]]
 
 # 测试函数
 if __name__ == "__main__":
     import requests
-    
+
     try:
         # 获取JavaScript文件
         response = requests.get(
@@ -120,15 +537,16 @@ if __name__ == "__main__":
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36"
             }
         )
-        
+
         if response.status_code == 200:
             # 提取模型列表
             models = extract_models_from_js(response.text)
             print(f"找到 {len(models)} 个模型:")
             for model in models:
-                print(f"- {model['id']}: {model['name']} - {model['description']}")
+                print(f"- {model['id']}: {model['name']} - {model.get('description', '')}")
+                print(f"  {json.dumps(model, ensure_ascii=False)}")
         else:
             print(f"获取JavaScript文件失败: {response.status_code}")
-    
+
     except Exception as e:
-        print(f"测试时出错: {e}")
\ No newline at end of file
+        print(f"测试时出错: {e}")
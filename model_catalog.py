@@ -0,0 +1,376 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import httpx
+
+from js_parser import find_model_array
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("model-catalog")
+
+# 页面和构建清单中引用的JS chunk路径
+CHUNK_PATH_PATTERN = re.compile(r'(?:/_next/)?static/chunks/[\w\-./\[\]%~@]+?\.js')
+BUILD_MANIFEST_PATTERN = re.compile(r'/_next/static/[\w\-]+/_buildManifest\.js')
+
+# Next.js框架自身的chunk，不可能包含模型列表
+FRAMEWORK_CHUNK_PREFIXES = ("framework-", "webpack-", "polyfills-", "main-", "main-app-")
+
+# 前端没有标记模型能力，按模型ID识别图像生成模型（不能用于聊天补全）
+IMAGE_GENERATION_MODEL_IDS = {"akashgen"}
+
+# 没有记录首次发现时间的模型（默认模型、旧快照）使用的固定created时间，保证各worker返回的列表一致
+DEFAULT_MODEL_CREATED = 1735689600
+
+
+def _as_int(value: Any) -> Optional[int]:
+    """将JS中的数字（可能是1e5这样的浮点数或字符串）转换为整数"""
+    try:
+        return int(float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def model_metadata(model: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    从前端的模型对象中提取路由需要的元数据
+
+    context_window来自tokenLimit；max_output_tokens来自maxTokens/max_tokens（前端没有时为None）
+    """
+    return {
+        "id": model["id"],
+        "name": model.get("name", model["id"]),
+        "description": model.get("description", ""),
+        "available": model.get("available", True) is not False,
+        "context_window": _as_int(model.get("tokenLimit")),
+        "max_output_tokens": _as_int(model.get("maxTokens", model.get("max_tokens"))),
+        "image_generation": model["id"].lower() in IMAGE_GENERATION_MODEL_IDS,
+        "created": _as_int(model.get("created")) or DEFAULT_MODEL_CREATED,
+    }
+
+
+def load_aliases(path: str, strict: bool = False) -> Dict[str, str]:
+    """
+    从JSON文件加载用户自定义的模型别名（{"别名": "模型ID"}），文件不存在时返回空字典
+
+    文件无效时记录错误并返回空字典；strict为True时抛出ValueError（热重载时用于校验）
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            aliases = json.load(f)
+        if not isinstance(aliases, dict):
+            raise ValueError("别名文件必须是JSON对象")
+        logger.info(f"已从{path}加载 {len(aliases)} 个自定义模型别名")
+        return {str(alias): str(model_id) for alias, model_id in aliases.items()}
+    except Exception as e:
+        if strict:
+            raise ValueError(f"模型别名文件{path}无效: {e}")
+        logger.error(f"加载模型别名文件时出错: {e}")
+        return {}
+
+
+class ModelCatalog:
+    """
+    模型目录：模型元数据和预先计算好的名称解析表
+
+    构建后不再修改。刷新时构建新的目录并整体替换全局引用，
+    请求路径上只做一次字典查找，不需要加锁。
+    """
+
+    def __init__(self, models: List[Dict[str, Any]], aliases: Optional[Dict[str, str]] = None,
+                 default_model: Optional[str] = None):
+        self.raw_models = list(models)
+        self.models: Dict[str, Dict[str, Any]] = {}
+        for model in self.raw_models:
+            info = model_metadata(model)
+            self.models[info["id"]] = info
+
+        # 名称解析表（不区分大小写）：模型ID优先于别名，别名指向不存在的模型时忽略
+        self._index: Dict[str, str] = {model_id.lower(): model_id for model_id in self.models}
+        for alias, target in (aliases or {}).items():
+            model_id = self._index.get(target.lower())
+            if model_id is None:
+                logger.debug(f"模型别名 {alias} 指向未知模型 {target}，已忽略")
+                continue
+            self._index.setdefault(alias.lower(), model_id)
+
+        # 未知的模型名使用默认模型，默认模型不能是图像生成模型
+        available = self.available_models()
+        chat_models = [model for model in available if not model["image_generation"]]
+        default = self.resolve(default_model) if default_model else None
+        if default is None or not default["available"] or default["image_generation"]:
+            default = chat_models[0] if chat_models else next(iter(self.models.values()), None)
+        self.default = default
+
+        # 预先序列化/v1/models的响应，目录不变时每次请求直接返回相同的字节和ETag
+        entries = [self._model_entry(model) for model in available]
+        self.models_body = self._serialize({"object": "list", "data": entries})
+        self.models_etag = self._etag(self.models_body)
+        self.model_bodies: Dict[str, Tuple[bytes, str]] = {}
+        for entry in entries:
+            body = self._serialize(entry)
+            self.model_bodies[entry["id"]] = (body, self._etag(body))
+
+    @staticmethod
+    def _model_entry(model: Dict[str, Any]) -> Dict[str, Any]:
+        """OpenAI格式的模型对象"""
+        return {
+            "id": model["id"],
+            "object": "model",
+            "created": model["created"],
+            "owned_by": "akash-network",
+            "permission": [],
+            "root": model["id"],
+            "parent": None
+        }
+
+    @staticmethod
+    def _serialize(content: Dict[str, Any]) -> bytes:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    @staticmethod
+    def _etag(body: bytes) -> str:
+        return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+    def model_body(self, name: str) -> Optional[Tuple[bytes, str]]:
+        """按模型ID或别名返回预先序列化的模型对象和ETag，模型不存在或不可用时返回None"""
+        model = self.resolve(name)
+        return self.model_bodies.get(model["id"]) if model else None
+
+    def resolve(self, name: str) -> Optional[Dict[str, Any]]:
+        """按模型ID或别名（不区分大小写）查找模型，找不到时返回None"""
+        model_id = self._index.get(name.lower())
+        return self.models[model_id] if model_id else None
+
+    def get(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """按精确的模型ID查找模型"""
+        return self.models.get(model_id)
+
+    def available_models(self) -> List[Dict[str, Any]]:
+        """当前可用的模型（保持前端中的顺序）"""
+        return [model for model in self.models.values() if model["available"]]
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+
+def load_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    """
+    从磁盘加载模型目录快照
+
+    快照格式:
+        models: 解析出的模型列表
+        bundle_url: 模型列表所在的JS文件地址
+        etag / last_modified: 上次获取时的响应头，用于条件请求
+        content_hash: JS文件内容的sha256，用于判断是否需要重新解析
+        fetched_at: 上次解析的时间
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if not snapshot.get("models"):
+            logger.warning(f"模型快照{path}中没有模型")
+            return None
+        logger.info(f"已从快照加载 {len(snapshot['models'])} 个模型")
+        return snapshot
+    except Exception as e:
+        logger.error(f"加载模型快照时出错: {e}")
+        return None
+
+
+def save_snapshot(path: str, snapshot: Dict[str, Any]) -> None:
+    """原子地保存模型目录快照（先写临时文件再重命名）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".model_catalog.", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    logger.info(f"模型快照已保存到{path}")
+
+
+def _build_snapshot(bundle_url: str, content: bytes, headers: httpx.Headers, models: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """根据JS文件的响应构建快照"""
+    return {
+        "bundle_url": bundle_url,
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+        "content_hash": hashlib.sha256(content).hexdigest(),
+        "models": models,
+        "fetched_at": time.time(),
+    }
+
+
+def _stamp_created(models: List[Dict[str, Any]], previous: Optional[Dict[str, Any]]) -> None:
+    """为模型记录首次发现的时间（created），已知的模型沿用之前的值，使/v1/models的内容保持稳定"""
+    known = {model["id"]: model.get("created") for model in (previous or {}).get("models", [])}
+    now = int(time.time())
+    for model in models:
+        model["created"] = known.get(model["id"]) or now
+
+
+def _extract_chunk_urls(text: str, base_url: str) -> List[str]:
+    """从HTML或构建清单中提取JS chunk的完整地址（保持出现顺序并去重）"""
+    urls = []
+    for path in CHUNK_PATH_PATTERN.findall(text):
+        name = path.rsplit("/", 1)[-1]
+        if name.startswith(FRAMEWORK_CHUNK_PREFIXES):
+            continue
+        if not path.startswith("/_next/"):
+            path = "/_next/" + path
+        url = urljoin(base_url, path)
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+async def _fetch_limited(client: httpx.AsyncClient, url: str, headers: Dict[str, str], timeout: float,
+                         max_bytes: int, budget: Dict[str, int]) -> Optional[Tuple[bytes, httpx.Headers]]:
+    """下载一个JS chunk，超过单个大小上限或总字节预算时放弃"""
+    async with client.stream("GET", url, headers=headers, timeout=timeout, follow_redirects=True) as response:
+        if response.status_code != 200:
+            return None
+        length = response.headers.get("content-length")
+        if length and (int(length) > max_bytes or int(length) > budget["remaining"]):
+            return None
+        parts = []
+        size = 0
+        async for part in response.aiter_bytes():
+            size += len(part)
+            budget["remaining"] -= len(part)
+            if size > max_bytes or budget["remaining"] < 0:
+                return None
+            parts.append(part)
+        return b"".join(parts), response.headers
+
+
+async def discover_model_bundle(client: httpx.AsyncClient, page_url: str, headers: Dict[str, str], timeout: float,
+                                max_chunk_bytes: int, byte_budget: int,
+                                concurrency: int) -> Optional[Dict[str, Any]]:
+    """
+    通过聊天页面和Next.js构建清单查找当前包含模型列表的JS chunk
+
+    并行下载较小的候选chunk（受单个大小上限和总字节预算限制），
+    按结构查找模型数组，找到后立即停止其余下载。
+
+    Returns:
+        dict: 新的快照；没有找到时返回None
+    """
+    page = await client.get(page_url, headers=headers, timeout=timeout, follow_redirects=True)
+    if page.status_code != 200:
+        logger.warning(f"获取聊天页面失败，状态码: {page.status_code}")
+        return None
+
+    candidates = _extract_chunk_urls(page.text, page_url)
+    manifest_match = BUILD_MANIFEST_PATTERN.search(page.text)
+    if manifest_match:
+        manifest = await client.get(urljoin(page_url, manifest_match.group(0)), headers=headers,
+                                    timeout=timeout, follow_redirects=True)
+        if manifest.status_code == 200:
+            candidates += [url for url in _extract_chunk_urls(manifest.text, page_url) if url not in candidates]
+    logger.info(f"发现 {len(candidates)} 个候选JS chunk")
+
+    budget = {"remaining": byte_budget}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(url: str) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            if budget["remaining"] <= 0:
+                return None
+            try:
+                fetched = await _fetch_limited(client, url, headers, timeout, max_chunk_bytes, budget)
+            except httpx.HTTPError as e:
+                logger.warning(f"下载候选chunk失败 {url}: {e}")
+                return None
+        if fetched is None:
+            return None
+        content, response_headers = fetched
+        models = await asyncio.to_thread(find_model_array, content.decode("utf-8", errors="replace"), True)
+        if not models:
+            return None
+        return _build_snapshot(url, content, response_headers, models)
+
+    tasks = [asyncio.create_task(probe(url)) for url in candidates]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            snapshot = await next_done
+            if snapshot:
+                logger.info(f"在 {snapshot['bundle_url']} 中找到模型列表")
+                return snapshot
+    finally:
+        for task in tasks:
+            task.cancel()
+    logger.warning(f"在候选chunk中没有找到模型列表（剩余字节预算: {budget['remaining']}）")
+    return None
+
+
+async def refresh_snapshot(client: httpx.AsyncClient, snapshot: Optional[Dict[str, Any]], bundle_url: str,
+                           headers: Dict[str, str], timeout: float,
+                           discovery: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    使用条件请求刷新模型目录
+
+    优先请求快照中缓存的JS地址（没有时使用bundle_url），只有内容真正变化时才重新解析。
+    缓存的地址失效或其中找不到模型列表时，使用discovery参数（discover_model_bundle的参数）重新查找。
+    返回 (新快照, 是否变化)；失败时返回原快照。
+    """
+    url = (snapshot or {}).get("bundle_url") or bundle_url
+    request_headers = dict(headers)
+    if snapshot and snapshot.get("bundle_url") == url:
+        if snapshot.get("etag"):
+            request_headers["if-none-match"] = snapshot["etag"]
+        if snapshot.get("last_modified"):
+            request_headers["if-modified-since"] = snapshot["last_modified"]
+
+    response = await client.get(url, headers=request_headers, follow_redirects=True, timeout=timeout)
+
+    if response.status_code == 304:
+        logger.info("模型JS文件未变化（304）")
+        return snapshot, False
+    if response.status_code == 200:
+        if snapshot and snapshot.get("content_hash") == hashlib.sha256(response.content).hexdigest():
+            # 服务器没有返回304但内容相同，只更新校验信息
+            logger.info("模型JS文件内容未变化，跳过解析")
+            return {
+                **snapshot,
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified"),
+            }, False
+
+        # 解析整个JS文件比较耗时，放到线程中执行；保留不可用的模型，由目录标记可用性
+        models = await asyncio.to_thread(find_model_array, response.text, True)
+        if models:
+            logger.info(f"成功从JS文件中提取 {len(models)} 个模型")
+            _stamp_created(models, snapshot)
+            return _build_snapshot(url, response.content, response.headers, models), True
+        logger.warning(f"{url} 中没有找到模型列表，可能前端已重新部署")
+    else:
+        logger.warning(f"获取JS文件失败，状态码: {response.status_code}")
+
+    if discovery is None:
+        return snapshot, False
+    discovered = await discover_model_bundle(client, headers=headers, timeout=timeout, **discovery)
+    if discovered is None:
+        logger.warning("无法找到新的模型JS文件，继续使用现有模型列表")
+        return snapshot, False
+    _stamp_created(discovered["models"], snapshot)
+    return discovered, True
@@ -1,25 +1,64 @@
 import asyncio
+import hmac
 import json
 import logging
+import os
+import pstats
 import re
+import secrets
+import signal
 import threading
 import time
 import uuid
-from typing import Dict, List, Optional, Any, AsyncGenerator
+from typing import Callable, Dict, List, Optional, Any, AsyncGenerator, Set
 
 import httpx
-from fastapi import FastAPI, Request, HTTPException, Response, BackgroundTasks
+from fastapi import FastAPI, Request, HTTPException, Response, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
-from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, ValidationError
 
 # 导入自定义模块
-from cookie_updater import get_valid_cookies, update_cookies_auto
-from js_parser import extract_models_from_js
+from auth import ApiKeyStore, AuthMiddleware, load_api_keys
+from cookie_updater import CREDENTIALS, EXPIRES_KEY, get_valid_cookies, load_cookies, update_cookies_auto, get_cookie_expiry
+from admission import BATCH, INTERACTIVE, LANES, AdmissionController, AdmissionError, Ticket
+from batch_api import BatchRunner, BatchStore, create_batch_router
+from credential_scheduler import CredentialScheduler
+from compression import CompressionMiddleware
+from drain import DrainController, DrainDeadline, DrainMiddleware, DrainableServer, stop_accepting
+from idempotency import IdempotencyError, IdempotencyStore, scope_for
+from ingestion import RequestBodyError, read_body
+from history_compactor import compact_history, format_index_ranges
+from profiling import LoopLagMonitor, ProfilerBusy, dump_pstats, format_pstats, run_cprofile, sample_stacks
+from tracing import TracingMiddleware, span, start_span, configure as configure_tracing
+from upstream import EndpointSelector, HostSettings, UpstreamPool, load_host_settings
+from token_counter import StreamingTokenCounter, count_prompt_tokens, count_tokens, usage
+from model_catalog import ModelCatalog, load_aliases, load_snapshot, save_snapshot, refresh_snapshot
+from shared_state import SharedState, LeaderElection
+from upstream_errors import (
+    OK, CHALLENGE, AUTH_FAILURE, UpstreamError,
+    classify_upstream_response, openai_error_body, openai_error_response
+)
 from config import (
-    AKASH_API_URL, DEFAULT_MODEL, HOST, PORT,
+    AKASH_API_URL, AKASH_API_URLS, DEFAULT_MODEL, MODEL_ALIASES_FILE, HOST, PORT,
     MAX_RETRIES, RETRY_DELAY, TIMEOUT, AKASH_JS_URL,
-    print_config
+    UPSTREAM_MAX_CONNECTIONS, UPSTREAM_KEEPALIVE_EXPIRY, UPSTREAM_MIN_WARM_CONNECTIONS, UPSTREAM_PREWARM_INTERVAL,
+    UPSTREAM_DNS_TTL, UPSTREAM_HOSTS_FILE, UPSTREAM_PROBE_INTERVAL, UPSTREAM_EWMA_ALPHA,
+    WORKERS, SHARED_STATE_FILE, MODEL_CATALOG_FILE, MODEL_REFRESH_INTERVAL, MODELS_CACHE_MAX_AGE,
+    MODEL_DISCOVERY_PAGE_URL, MODEL_DISCOVERY_MAX_CHUNK_BYTES, MODEL_DISCOVERY_BYTE_BUDGET,
+    MODEL_DISCOVERY_CONCURRENCY,
+    HISTORY_COMPACTION, HISTORY_OUTPUT_RESERVE, HISTORY_DROP_MIDDLE, HISTORY_KEEP_FIRST_MESSAGES,
+    HISTORY_DEFAULT_CONTEXT_WINDOW, MAX_CONCURRENT_GENERATIONS, ADMISSION_TIMEOUT, MAX_CHOICES,
+    ADMISSION_INTERACTIVE_RESERVED,
+    BATCH_DIR, BATCH_CONCURRENCY, BATCH_MAX_RETRIES, BATCH_POLL_INTERVAL, BATCH_MAX_FILE_BYTES,
+    WS_SEND_QUEUE_SIZE, WS_MAX_CONCURRENT_REQUESTS, DRAIN_TIMEOUT, REUSE_PORT, ADMIN_TOKEN,
+    API_AUTH, API_KEYS_FILE, API_KEY_DEFAULT_RPM, API_KEY_DEFAULT_TPM, API_USAGE_FILE, API_USAGE_FLUSH_INTERVAL,
+    MAX_REQUEST_BODY_BYTES, IDEMPOTENCY_DEDUP, IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_MAX_BYTES, COMPRESSION, COMPRESSION_MIN_SIZE, COMPRESSION_THREAD_CUTOFF, TRACING, TRACE_FILE, TRACE_FILE_MAX_BYTES, TRACE_FILE_BACKUPS, LOOP_LAG_MONITOR, LOOP_LAG_THRESHOLD_MS,
+    CREDENTIAL_REFRESH_LEAD_TIME, CREDENTIAL_REFRESH_JITTER,
+    CREDENTIAL_REFRESH_MAX_INTERVAL, CREDENTIAL_REFRESH_MAX_BACKOFF, CF_BROWSER_REFRESH, COOKIE_WATCH_INTERVAL,
+    CREDENTIAL_WAIT_TIMEOUT,
+    load_settings, apply_settings, print_config
 )
 
 # 配置日志
@@ -33,7 +72,39 @@ logger = logging.getLogger("openai-akash-proxy")
 # 创建FastAPI应用
 app = FastAPI(title="OpenAI to Akash Network Proxy")
 
-# 添加CORS中间件
+# API key校验和按key限流（API_AUTH=true时启用，/health、/ready和管理端点不需要API key）
+# 批量任务在进程内调用本应用，使用随机生成的内部令牌代替API key
+INTERNAL_TOKEN = secrets.token_hex(16)
+API_KEYS = ApiKeyStore(
+    load_api_keys(API_KEYS_FILE, API_KEY_DEFAULT_RPM, API_KEY_DEFAULT_TPM) if API_AUTH else {},
+    API_USAGE_FILE
+)
+if API_AUTH:
+    app.add_middleware(AuthMiddleware, store=API_KEYS, protected_prefixes=("/v1/", "/debug/"),
+                       internal_token=INTERNAL_TOKEN)
+
+# 排空模式：SIGTERM或/admin/drain触发，健康检查和管理端点不受影响
+DRAIN = DrainController()
+app.add_middleware(DrainMiddleware, controller=DRAIN, exempt_prefixes=("/health", "/ready", "/admin/"))
+# 排空期限到达后，等待被截断的流发送结束块的时间（秒）
+DRAIN_CLOSE_GRACE = 5
+
+# 请求追踪：各阶段的span写入本地JSONL文件，主要阶段的耗时通过Server-Timing响应头返回
+# 多进程模式下每个worker写入各自的文件，避免轮转时互相干扰
+configure_tracing(
+    TRACING,
+    TRACE_FILE if WORKERS <= 1 or not TRACE_FILE else f"{TRACE_FILE}.{os.getpid()}",
+    TRACE_FILE_MAX_BYTES,
+    TRACE_FILE_BACKUPS
+)
+app.add_middleware(TracingMiddleware)
+
+# 按Accept-Encoding压缩非流式响应（SSE不压缩）
+if COMPRESSION:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE, thread_cutoff=COMPRESSION_THREAD_CUTOFF)
+
+# 添加CORS中间件（最后添加的中间件在最外层：预检请求直接由它处理，
+# 认证的401/429和排空的503等由内层中间件直接返回的响应也带有CORS头）
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -47,52 +118,109 @@ app.add_middleware(
 # 全局cookie存储
 COOKIES = {}
 
-# Cookie更新锁，防止多线程同时更新
-cookie_update_lock = threading.Lock()
+# 进程间共享状态，多worker模式下由leader负责刷新，其他worker从这里读取
+SHARED_STATE = SharedState(SHARED_STATE_FILE)
+LEADER = LeaderElection(SHARED_STATE_FILE + ".leader.lock")
+
+# 本进程已加载的共享状态各键的写入时间，只有键本身变化时才重新加载
+SHARED_VERSIONS: Dict[str, Optional[float]] = {}
+
+# 将当前Cookie发布到共享状态
+def publish_cookies():
+    SHARED_VERSIONS["cookies"] = SHARED_STATE.set("cookies", dict(COOKIES))
+
+# 将当前模型列表发布到共享状态（别名是各worker的本地配置，由各worker自行构建目录）
+def publish_models():
+    SHARED_VERSIONS["models"] = SHARED_STATE.set("models", {"models": MODEL_CATALOG.raw_models})
+
+# 读取共享状态中自上次加载以来变化过的键，未变化时返回None
+def read_shared_change(key: str) -> Optional[Any]:
+    value, SHARED_VERSIONS[key] = SHARED_STATE.get_if_changed(key, SHARED_VERSIONS.get(key))
+    return value
+
+# 当前进程已应用的热重载代数，其他worker热重载后，本进程在同步共享状态时跟进
+RELOAD_GENERATION: Optional[int] = None
+
+# 从共享状态加载Cookie和模型列表
+# 凭证刷新请求等其他键的写入也会触发同步，这里只处理真正变化的键，模型目录不会被无谓地重建
+def load_shared_state():
+    global MODEL_CATALOG, RELOAD_GENERATION
+    cookies = read_shared_change("cookies")
+    if cookies:
+        COOKIES.update(cookies)
+    models = read_shared_change("models")
+    if models and models.get("models"):
+        MODEL_CATALOG = build_catalog(models["models"])
+    reload_state = read_shared_change("reload")
+    if reload_state and reload_state["generation"] != RELOAD_GENERATION:
+        # 刚启动的进程已经读取了最新的配置，只记录代数
+        if RELOAD_GENERATION is not None:
+            schedule_reload(broadcast=False)
+        RELOAD_GENERATION = reload_state["generation"]
+
+# 仅在其他进程写入过共享状态时才重新加载
+def sync_shared_state():
+    if SHARED_STATE.has_changed():
+        load_shared_state()
+        logger.info("已从共享状态同步Cookie和模型列表")
 
 # 初始化cookie
 def init_cookies():
     global COOKIES
     cookies, _ = get_valid_cookies()
     COOKIES.update(cookies)
+    publish_cookies()
     logger.info("Cookie已初始化")
 
-# 后台定期更新cookie
-def cookie_updater_task():
-    while True:
-        try:
-            with cookie_update_lock:
-                # 首先尝试自动更新
-                cookies = update_cookies_auto()
-                if cookies:
-                    COOKIES.update(cookies)
-                    logger.info("Cookie已在后台自动更新")
-                else:
-                    # 如果自动更新失败，则尝试常规更新方法
-                    cookies, updated = get_valid_cookies()
-                    if updated:
-                        COOKIES.update(cookies)
-                        logger.info("Cookie已在后台更新")
-        except Exception as e:
-            logger.error(f"更新Cookie时出错: {e}")
-        
-        # 每小时检查一次
-        time.sleep(3600)
+# 后台刷新成功后更新全局cookie并发布给其他worker
+def on_cookies_refreshed(cookies: Dict[str, str]):
+    COOKIES.update(cookies)
+    publish_cookies()
+
+# cookie文件变化时（后台刷新写入、手动编辑或其他工具写入）更新全局cookie并发布给其他worker
+# 在发现变化的线程中调用，只做字典更新和共享状态写入
+def on_credentials_changed(data: Dict[str, Any]):
+    cookies = {name: value for name, value in data.items() if name != EXPIRES_KEY}
+    if "cf_clearance" not in cookies or "session_token" not in cookies:
+        return
+    if all(COOKIES.get(name) == value for name, value in cookies.items()):
+        return
+    COOKIES.update(cookies)
+    publish_cookies()
+    logger.info("cookie文件已更新，已应用新的cookie")
+
+CREDENTIALS.subscribe(on_credentials_changed)
+
+# 非leader进程请求leader刷新凭证：在共享状态中记录请求，leader轮询并执行，新cookie通过共享状态发布
+CREDENTIAL_REFRESH_REQUEST_KEY = "credential_refresh_request"
+
+# 非leader等待新cookie时检查共享状态的间隔（秒）
+CREDENTIAL_WAIT_POLL_INTERVAL = 0.5
+
+def request_credential_refresh(reason: str):
+    SHARED_STATE.set(CREDENTIAL_REFRESH_REQUEST_KEY, {"requested_at": time.time(), "pid": os.getpid(), "reason": reason})
+
+# 凭证刷新调度器：按真实过期时间提前刷新，请求路径上不再同步刷新；只有leader刷新
+CREDENTIAL_SCHEDULER = CredentialScheduler(
+    refresh_func=lambda: update_cookies_auto(allow_browser=CF_BROWSER_REFRESH),
+    expiry_func=get_cookie_expiry,
+    on_refreshed=on_cookies_refreshed,
+    lead_time=CREDENTIAL_REFRESH_LEAD_TIME,
+    jitter=CREDENTIAL_REFRESH_JITTER,
+    max_interval=CREDENTIAL_REFRESH_MAX_INTERVAL,
+    max_backoff=CREDENTIAL_REFRESH_MAX_BACKOFF,
+    delegate=request_credential_refresh,
+)
+
+# 上游并发限制：每个上游生成（包括n>1的每个choice）占用一个名额，交互请求有预留名额并优先调度
+ADMISSION = AdmissionController(MAX_CONCURRENT_GENERATIONS, ADMISSION_TIMEOUT, ADMISSION_INTERACTIVE_RESERVED)
 
 # 在请求前确保cookie有效
 def ensure_valid_cookies():
-    with cookie_update_lock:
-        if not COOKIES or "cf_clearance" not in COOKIES or "session_token" not in COOKIES:
-            # 首先尝试自动更新
-            cookies = update_cookies_auto()
-            if cookies:
-                COOKIES.update(cookies)
-                logger.info("Cookie已自动更新")
-            else:
-                # 如果自动更新失败，则使用常规方法
-                cookies, _ = get_valid_cookies()
-                COOKIES.update(cookies)
-                logger.info("Cookie已按需更新")
+    sync_shared_state()
+    if not COOKIES or "cf_clearance" not in COOKIES or "session_token" not in COOKIES:
+        # 缺少必要的cookie时通知调度器立即刷新，不在请求路径上等待
+        CREDENTIAL_SCHEDULER.trigger("缺少必要的cookie")
 AKASH_HEADERS = {
     "accept": "*/*",
     "accept-language": "zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6",
@@ -122,77 +250,80 @@ MODEL_ALIASES = {
     "llama-3-405b": "Meta-Llama-3-1-405B-Instruct-FP8",
 }
 
-# 全局模型列表和映射
-AVAILABLE_MODELS = []
-MODEL_MAPPING = {}
+# 默认模型列表，在没有快照且首次获取完成之前使用
+DEFAULT_MODELS = [
+    {
+        "id": "DeepSeek-R1",
+        "name": "DeepSeek R1 671B",
+        "description": "Strong Mixture-of-Experts (MoE) LLM"
+    }
+]
 
-# 获取Akash可用模型列表
-def fetch_available_models():
-    global AVAILABLE_MODELS, MODEL_MAPPING
-    
-    try:
-        # 先设置一些默认值，以防获取失败
-        default_models = [
-            {
-                "id": "DeepSeek-R1",
-                "name": "DeepSeek R1 671B",
-                "description": "Strong Mixture-of-Experts (MoE) LLM"
-            }
-        ]
-        
-        # 尝试从JavaScript文件中获取模型列表
+# 用户自定义的模型别名，优先于内置别名
+USER_MODEL_ALIASES = load_aliases(MODEL_ALIASES_FILE)
+
+# 根据模型列表构建模型目录（模型ID、内置别名和自定义别名的解析表）
+def build_catalog(models: List[Dict[str, Any]]) -> ModelCatalog:
+    return ModelCatalog(models or DEFAULT_MODELS, {**MODEL_ALIASES, **USER_MODEL_ALIASES}, DEFAULT_MODEL)
+
+# 当前的模型目录，刷新时整体替换
+MODEL_CATALOG = build_catalog(DEFAULT_MODELS)
+
+# 当前的模型目录快照（包含JS文件的ETag、Last-Modified和内容哈希）
+MODEL_SNAPSHOT = None
+
+# 设置模型列表：构建新的模型目录后替换全局引用
+def apply_models(models: List[Dict[str, Any]]):
+    global MODEL_CATALOG
+    MODEL_CATALOG = build_catalog(models)
+    logger.info(f"已加载 {len(MODEL_CATALOG.available_models())} 个可用模型（共 {len(MODEL_CATALOG)} 个）")
+    publish_models()
+
+# 启动时从磁盘快照加载模型列表，不等待网络请求
+def init_models():
+    global MODEL_SNAPSHOT
+    MODEL_SNAPSHOT = load_snapshot(MODEL_CATALOG_FILE)
+    if MODEL_SNAPSHOT:
+        apply_models(MODEL_SNAPSHOT["models"])
+    else:
+        logger.info("没有可用的模型快照，先使用默认模型，后台获取完成后更新")
+        apply_models(DEFAULT_MODELS)
+
+# 成为leader时读取磁盘上的模型快照（JS文件的ETag、Last-Modified和内容哈希），后台刷新据此发送条件请求；
+# 多进程模式下worker没有执行init_models，模型列表来自共享状态，快照需要单独读取
+async def load_model_snapshot():
+    global MODEL_SNAPSHOT
+    MODEL_SNAPSHOT = await asyncio.to_thread(load_snapshot, MODEL_CATALOG_FILE)
+
+# 模型JS文件自动发现参数
+MODEL_DISCOVERY = {
+    "page_url": MODEL_DISCOVERY_PAGE_URL,
+    "max_chunk_bytes": MODEL_DISCOVERY_MAX_CHUNK_BYTES,
+    "byte_budget": MODEL_DISCOVERY_BYTE_BUDGET,
+    "concurrency": MODEL_DISCOVERY_CONCURRENCY,
+}
+
+# 使用条件请求刷新模型列表，只有JS文件变化时才重新解析；JS地址失效时自动重新发现
+# 共用上游连接池（每个请求单独传入TIMEOUT，连接池客户端本身不设超时）
+async def refresh_models():
+    global MODEL_SNAPSHOT
+    snapshot, changed = await refresh_snapshot(
+        UPSTREAM.client, MODEL_SNAPSHOT, AKASH_JS_URL, AKASH_HEADERS, TIMEOUT, discovery=MODEL_DISCOVERY
+    )
+    if snapshot is not MODEL_SNAPSHOT:
+        MODEL_SNAPSHOT = snapshot
+        await asyncio.to_thread(save_snapshot, MODEL_CATALOG_FILE, snapshot)
+    if changed:
+        apply_models(snapshot["models"])
+
+# 后台定期刷新模型列表
+async def model_refresh_task():
+    while True:
         try:
-            response = httpx.get(
-                AKASH_JS_URL,
-                headers=AKASH_HEADERS,
-                follow_redirects=True,
-                timeout=TIMEOUT
-            )
-            
-            if response.status_code == 200:
-                # 使用专门的解析模块提取模型列表
-                extracted_models = extract_models_from_js(response.text)
-                
-                if extracted_models:
-                    AVAILABLE_MODELS = extracted_models
-                    logger.info(f"成功从JS文件中提取 {len(AVAILABLE_MODELS)} 个模型")
-                else:
-                    # 如果提取失败，使用默认模型
-                    AVAILABLE_MODELS = default_models
-                    logger.warning("无法从JS文件中提取模型，使用默认模型")
-            else:
-                # 如果请求失败，使用默认模型
-                AVAILABLE_MODELS = default_models
-                logger.warning(f"获取JS文件失败，状态码: {response.status_code}，使用默认模型")
+            await refresh_models()
         except Exception as e:
-            # 如果发生异常，使用默认模型
-            AVAILABLE_MODELS = default_models
-            logger.error(f"获取模型列表时出错: {e}", exc_info=True)
-        
-        # 构建模型映射
-        MODEL_MAPPING = {}
-        
-        # 1. 添加直接映射（模型ID到自身）
-        for model in AVAILABLE_MODELS:
-            MODEL_MAPPING[model["id"]] = model["id"]
-        
-        # 2. 添加别名映射
-        for alias, model_id in MODEL_ALIASES.items():
-            if model_id in MODEL_MAPPING:
-                MODEL_MAPPING[alias] = model_id
-        
-        # 3. 添加默认模型
-        MODEL_MAPPING["default"] = DEFAULT_MODEL if DEFAULT_MODEL in MODEL_MAPPING else AVAILABLE_MODELS[0]["id"]
-        
-        logger.info(f"已加载 {len(AVAILABLE_MODELS)} 个可用模型")
-        
-    except Exception as e:
-        logger.error(f"获取模型列表时出错: {e}", exc_info=True)
-        # 如果发生错误，使用默认模型
-        AVAILABLE_MODELS = default_models
-        # 构建基本映射
-        MODEL_MAPPING = {model["id"]: model["id"] for model in AVAILABLE_MODELS}
-        MODEL_MAPPING["default"] = AVAILABLE_MODELS[0]["id"]
+            logger.error(f"刷新模型列表时出错: {e}", exc_info=True)
+        await asyncio.sleep(MODEL_REFRESH_INTERVAL)
 
 # 定义数据模型
 class Message(BaseModel):
@@ -205,11 +336,51 @@ class OpenAIRequest(BaseModel):
     temperature: Optional[float] = 0.7
     top_p: Optional[float] = 1.0
     max_tokens: Optional[int] = None
+    n: Optional[int] = 1
     stream: Optional[bool] = False
+    stream_options: Optional[Dict[str, Any]] = None
     # 其他OpenAI参数...
 
+# 按模型ID或别名解析请求的模型，未知的模型名使用默认模型
+def resolve_model(name: str) -> Dict[str, Any]:
+    return MODEL_CATALOG.resolve(name) or MODEL_CATALOG.default
+
+# 检查请求是否能由该模型处理，不能时返回OpenAI格式的错误响应
+def validate_chat_request(openai_request: OpenAIRequest, model: Dict[str, Any]) -> Optional[JSONResponse]:
+    if openai_request.n is not None and not 1 <= openai_request.n <= MAX_CHOICES:
+        return openai_error_response(
+            400, f"n must be between 1 and {MAX_CHOICES}", "invalid_request_error", "invalid_value"
+        )
+    if not model["available"]:
+        return openai_error_response(
+            404, f"The model `{openai_request.model}` is currently unavailable on Akash",
+            "invalid_request_error", "model_not_found"
+        )
+    if model["image_generation"]:
+        return openai_error_response(
+            400, f"The model `{model['id']}` generates images and does not support chat completions",
+            "invalid_request_error", "model_not_supported"
+        )
+    if openai_request.max_tokens and model["max_output_tokens"] and openai_request.max_tokens > model["max_output_tokens"]:
+        return openai_error_response(
+            400, f"max_tokens is too large: {openai_request.max_tokens}. {model['id']} supports at most "
+                 f"{model['max_output_tokens']} completion tokens",
+            "invalid_request_error", "invalid_value"
+        )
+    if openai_request.max_tokens and model["context_window"] and openai_request.max_tokens > model["context_window"]:
+        return openai_error_response(
+            400, f"max_tokens ({openai_request.max_tokens}) exceeds the context window of "
+                 f"{model['id']} ({model['context_window']} tokens)",
+            "invalid_request_error", "context_length_exceeded"
+        )
+    return None
+
+# 生成一个类似Akash前端的对话ID
+def new_akash_request_id() -> str:
+    return str(uuid.uuid4()).replace("-", "")[:16]
+
 # 将请求转换为Akash请求
-def convert_to_akash_request(openai_request: OpenAIRequest) -> Dict[str, Any]:
+def convert_to_akash_request(openai_request: OpenAIRequest, model: Dict[str, Any]) -> Dict[str, Any]:
     # 提取系统消息和用户消息
     system_message = ""
     user_messages = []
@@ -224,27 +395,43 @@ def convert_to_akash_request(openai_request: OpenAIRequest) -> Dict[str, Any]:
     if not user_messages:
         user_messages.append({"role": "user", "content": "Hello"})
     
-    # 获取对应的Akash模型
-    # 如果请求的模型已经是Akash模型ID，直接使用；否则尝试从映射中获取
-    if openai_request.model in [model["id"] for model in AVAILABLE_MODELS]:
-        akash_model = openai_request.model
-    else:
-        akash_model = MODEL_MAPPING.get(openai_request.model, MODEL_MAPPING["default"])
-    
-    # 创建Akash请求
+    # 创建Akash请求（模型已由resolve_model解析为Akash模型）
     akash_request = {
-        "id": str(uuid.uuid4()).replace("-", "")[:16],  # 生成一个类似的ID
+        "id": new_akash_request_id(),
         "messages": user_messages,
-        "model": akash_model,
+        "model": model["id"],
         "system": system_message,
         "temperature": openai_request.temperature or 0.6,
         "topP": openai_request.top_p or 0.95,
         "context": []
     }
     
-    logger.info(f"Converted request to Akash format: {akash_request}")
+    # 只记录摘要，完整的对话历史可能有几MB
+    logger.info(f"Converted request to Akash format: id={akash_request['id']}, model={akash_request['model']}, "
+                f"{len(user_messages)} messages")
     return akash_request
 
+# 按模型的上下文长度压缩对话历史，返回需要添加到响应中的头（没有丢弃消息时为空）
+def compact_akash_history(openai_request: OpenAIRequest, akash_request: Dict[str, Any],
+                          model: Dict[str, Any]) -> Dict[str, str]:
+    context_window = model["context_window"] or HISTORY_DEFAULT_CONTEXT_WINDOW
+    if not HISTORY_COMPACTION or not context_window:
+        return {}
+    budget = context_window - (openai_request.max_tokens or HISTORY_OUTPUT_RESERVE)
+    result = compact_history(
+        akash_request["system"], akash_request["messages"], budget,
+        drop_middle=HISTORY_DROP_MIDDLE, keep_first=HISTORY_KEEP_FIRST_MESSAGES
+    )
+    if not result["dropped"]:
+        return {}
+    akash_request["messages"] = result["messages"]
+    # 转换为原始请求中的下标（系统消息不参与压缩）
+    positions = [index for index, msg in enumerate(openai_request.messages) if msg.role != "system"]
+    return {
+        "X-History-Dropped-Messages": format_index_ranges([positions[index] for index in result["dropped"]]),
+        "X-History-Dropped-Tokens": str(result["dropped_tokens"]),
+    }
+
 # 清理响应文本，移除思考过程和处理换行符
 def clean_response_text(text: str) -> str:
     """
@@ -273,18 +460,21 @@ def clean_response_text(text: str) -> str:
     return cleaned_text
 
 # 将Akash非流式响应转换为OpenAI响应
-def convert_to_openai_response(akash_response: str) -> Dict[str, Any]:
+def convert_to_openai_response(akash_response: str, prompt_tokens: int = 0) -> Dict[str, Any]:
     try:
         logger.info(f"Processing Akash response: {akash_response[:200]}...")
         
         # 提取完整的响应文本
         full_text = ""
+        completion_tokens = 0
         
         # 使用正则表达式提取所有0:开头的内容片段
         chunks = re.findall(r'0:"(.*?)"', akash_response)
         if chunks:
             # 合并所有文本片段
             raw_text = "".join(chunks)
+            # 按模型实际生成的文本（包括思考过程）统计输出token
+            completion_tokens = count_tokens(raw_text.replace('\\n', '\n'))
             # 清理响应文本
             full_text = clean_response_text(raw_text)
         
@@ -323,11 +513,7 @@ def convert_to_openai_response(akash_response: str) -> Dict[str, Any]:
                 },
                 "finish_reason": "stop"
             }],
-            "usage": {
-                "prompt_tokens": 0,  # 无法准确获取
-                "completion_tokens": 0,  # 无法准确获取
-                "total_tokens": 0  # 无法准确获取
-            }
+            "usage": usage(prompt_tokens, completion_tokens)
         }
         
         logger.info(f"Converted to OpenAI response: {openai_response}")
@@ -349,14 +535,46 @@ def convert_to_openai_response(akash_response: str) -> Dict[str, Any]:
             "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
         }
 
-# 处理流式响应
-async def process_real_time_streaming(response_stream) -> AsyncGenerator[str, None]:
-    """处理Akash的实时流式响应并转换为OpenAI的SSE格式"""
-    # 创建OpenAI的响应ID
-    response_id = f"chatcmpl-{uuid.uuid4()}"
+# 合并n>1时多个choice的非流式响应（提示只计算一次，输出为各choice之和）
+def merge_openai_responses(openai_responses: Dict[int, Dict[str, Any]], prompt_tokens: int) -> Dict[str, Any]:
+    indexes = sorted(openai_responses)
+    if len(indexes) == 1 and indexes[0] == 0:
+        return openai_responses[0]
+    choices = []
+    completion_tokens = 0
+    for index in indexes:
+        choices.append({**openai_responses[index]["choices"][0], "index": index})
+        completion_tokens += openai_responses[index]["usage"]["completion_tokens"]
+    return {**openai_responses[indexes[0]], "choices": choices, "usage": usage(prompt_tokens, completion_tokens)}
+
+# Akash在流中返回的错误（3:行）
+class AkashStreamError(Exception):
+    pass
+
+# 构造一个OpenAI格式的流式响应块
+def make_stream_chunk(response_id: str, choices: List[Dict[str, Any]], usage_field: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": response_id,
+        "object": "chat.completion.chunk",
+        "created": int(uuid.uuid1().time),
+        "model": "gpt-3.5-turbo",
+        "choices": choices,
+        **usage_field
+    }
+
+# 解析一个Akash流式响应，逐个产生OpenAI格式的响应块
+async def iter_stream_chunks(response_stream, response_id: str, index: int = 0,
+                             completion_counter: Optional[StreamingTokenCounter] = None,
+                             usage_field: Optional[Dict[str, Any]] = None) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    解析Akash的实时流式响应，为第index个choice产生响应块（dict），最后一个块带有finish_reason
+
+    输出token由completion_counter增量统计；上游在流中返回错误时抛出AkashStreamError
+    """
+    usage_field = usage_field or {}
     
     # 跟踪已收到的文本
-    accumulated_text = ""
+    accumulated_length = 0
     buffer = ""
     finish_reason = None
     
@@ -392,26 +610,29 @@ async def process_real_time_streaming(response_stream) -> AsyncGenerator[str, No
                     text = text_match.group(1)
                     # 处理转义字符
                     text = text.replace('\\n', '\n')
-                    accumulated_text += text
+                    accumulated_length += len(text)
+                    if completion_counter is not None:
+                        completion_counter.add(text)
                     
                     # 创建OpenAI格式的响应块
-                    openai_chunk = {
-                        "id": response_id,
-                        "object": "chat.completion.chunk",
-                        "created": int(uuid.uuid1().time),
-                        "model": "gpt-3.5-turbo",
-                        "choices": [{
-                            "index": 0,
-                            "delta": {
-                                "content": text
-                            },
-                            "finish_reason": None
-                        }]
-                    }
-                    
-                    yield f"data: {json.dumps(openai_chunk)}\n\n"
+                    yield make_stream_chunk(response_id, [{
+                        "index": index,
+                        "delta": {
+                            "content": text
+                        },
+                        "finish_reason": None
+                    }], usage_field)
                 continue
                 
+            # 上游在流中返回的错误
+            if line.startswith('3:'):
+                try:
+                    error_text = json.loads(line[2:])
+                except json.JSONDecodeError:
+                    error_text = line[2:]
+                logger.error(f"Akash stream error: {error_text}")
+                raise AkashStreamError(error_text)
+                
             # 检查是否完成
             if line.startswith('e:') or line.startswith('d:'):
                 try:
@@ -422,24 +643,115 @@ async def process_real_time_streaming(response_stream) -> AsyncGenerator[str, No
                     logger.warning(f"Could not parse finish info: {line}")
                     finish_reason = "stop"
     
-    # 发送最终的完成块
-    final_chunk = {
-        "id": response_id,
-        "object": "chat.completion.chunk",
-        "created": int(uuid.uuid1().time),
-        "model": "gpt-3.5-turbo",
-        "choices": [{
-            "index": 0,
-            "delta": {},
-            "finish_reason": finish_reason or "stop"
-        }]
-    }
-    yield f"data: {json.dumps(final_chunk)}\n\n"
+    # 最终的完成块
+    yield make_stream_chunk(response_id, [{
+        "index": index,
+        "delta": {},
+        "finish_reason": finish_reason or "stop"
+    }], usage_field)
     
-    # 发送完成标记
-    yield "data: [DONE]\n\n"
+    logger.info(f"Streaming completed (choice {index}). Total text length: {accumulated_length}")
+
+# 处理流式响应
+async def process_real_time_streaming(response_stream, prompt_tokens: int = 0, include_usage: bool = False,
+                                      on_complete: Optional[Callable[[int], None]] = None) -> AsyncGenerator[str, None]:
+    """
+    处理Akash的实时流式响应并转换为OpenAI的SSE格式
+
+    include_usage为True时（stream_options.include_usage），每个块带有"usage": null，
+    并在[DONE]之前发送一个choices为空、带有usage的块。
+    流结束（包括客户端断开）时以输出token数调用on_complete。
+    """
+    # 创建OpenAI的响应ID
+    response_id = f"chatcmpl-{uuid.uuid4()}"
+    completion_counter = StreamingTokenCounter()
+    usage_field = {"usage": None} if include_usage else {}
+    
+    try:
+        try:
+            async for openai_chunk in iter_stream_chunks(response_stream, response_id, 0, completion_counter, usage_field):
+                yield f"data: {json.dumps(openai_chunk)}\n\n"
+        except AkashStreamError as e:
+            # 转换为OpenAI格式的错误事件并结束流
+            error_body = openai_error_body(f"Akash API error: {e}", "upstream_error", "upstream_error")
+            yield f"data: {json.dumps(error_body)}\n\n"
+            yield "data: [DONE]\n\n"
+            return
+        
+        # 发送用量块
+        if include_usage:
+            usage_chunk = make_stream_chunk(response_id, [], {"usage": usage(prompt_tokens, completion_counter.total)})
+            yield f"data: {json.dumps(usage_chunk)}\n\n"
+        
+        # 发送完成标记
+        yield "data: [DONE]\n\n"
+    finally:
+        if on_complete is not None:
+            on_complete(completion_counter.total)
+
+# 合并多个Akash流式响应的响应块
+async def iter_fan_out_chunks(response_streams: Dict[int, Any], response_id: str,
+                              counters: Dict[int, StreamingTokenCounter],
+                              usage_field: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    同时读取多个choice的Akash流式响应，按到达顺序产生各choice的响应块
+
+    某个choice在流中出错（包括读取上游时的传输错误）时，只结束该choice（finish_reason为"error"），其余choice继续
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=64)
+    
+    async def pump(index: int, response_stream):
+        try:
+            async for openai_chunk in iter_stream_chunks(response_stream, response_id, index, counters[index], usage_field):
+                await queue.put(openai_chunk)
+        except Exception as e:
+            # 上游返回的错误和传输错误（读取中断、超时等）都只结束该choice，不能当作正常完成；
+            # AkashStreamError已经记录过错误内容
+            if not isinstance(e, AkashStreamError):
+                logger.error(f"choice {index} 的流式响应中断: {e!r}")
+            await queue.put(make_stream_chunk(response_id, [{
+                "index": index,
+                "delta": {},
+                "finish_reason": "error"
+            }], usage_field))
+        finally:
+            await queue.put(None)
+    
+    tasks = [asyncio.create_task(pump(index, stream)) for index, stream in response_streams.items()]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            openai_chunk = await queue.get()
+            if openai_chunk is None:
+                remaining -= 1
+                continue
+            yield openai_chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# 合并n>1时多个Akash流式响应
+async def process_fan_out_streaming(response_streams: Dict[int, Any], prompt_tokens: int = 0, include_usage: bool = False,
+                                    on_complete: Optional[Callable[[int], None]] = None) -> AsyncGenerator[str, None]:
+    """将多个Akash流式响应合并为一个SSE流，各choice的增量按到达顺序交错发送"""
+    response_id = f"chatcmpl-{uuid.uuid4()}"
+    usage_field = {"usage": None} if include_usage else {}
+    counters = {index: StreamingTokenCounter() for index in response_streams}
     
-    logger.info(f"Streaming completed. Total text length: {len(accumulated_text)}")
+    try:
+        async for openai_chunk in iter_fan_out_chunks(response_streams, response_id, counters, usage_field):
+            yield f"data: {json.dumps(openai_chunk)}\n\n"
+        
+        # 发送用量块（提示只计算一次，输出为各choice之和）
+        if include_usage:
+            completion_tokens = sum(counter.total for counter in counters.values())
+            usage_chunk = make_stream_chunk(response_id, [], {"usage": usage(prompt_tokens, completion_tokens)})
+            yield f"data: {json.dumps(usage_chunk)}\n\n"
+        
+        yield "data: [DONE]\n\n"
+    finally:
+        if on_complete is not None:
+            on_complete(sum(counter.total for counter in counters.values()))
 
 
 # 保留此函数用于非流式响应处理
@@ -533,42 +845,273 @@ async def process_streaming_response(response_text: str) -> AsyncGenerator[str,
     # 发送完成标记
     yield "data: [DONE]\n\n"
 
-# 主端点：处理OpenAI格式的聊天完成请求
-@app.post("/v1/chat/completions")
-async def chat_completions(request: Request):
+# 从请求头中获取cookie覆盖值
+def get_cookie_overrides(request: Request) -> Dict[str, str]:
+    overrides = {}
+    session_token = request.headers.get("x-akash-session-token")
+    cf_clearance = request.headers.get("x-akash-cf-clearance")
+    if session_token:
+        overrides["session_token"] = session_token
+    if cf_clearance:
+        overrides["cf_clearance"] = cf_clearance
+    return overrides
+
+# 所有上游请求共用的客户端和连接池（可以在UPSTREAM_HOSTS_FILE中按主机覆盖设置）
+UPSTREAM_DEFAULTS = HostSettings(UPSTREAM_MAX_CONNECTIONS, UPSTREAM_KEEPALIVE_EXPIRY, UPSTREAM_MIN_WARM_CONNECTIONS,
+                                 UPSTREAM_DNS_TTL)
+UPSTREAM = UpstreamPool(UPSTREAM_DEFAULTS, load_host_settings(UPSTREAM_HOSTS_FILE, UPSTREAM_DEFAULTS))
+
+# 上游端点列表：AKASH_API_URLS为空时只有AKASH_API_URL
+def upstream_urls() -> List[str]:
+    urls = [url.strip() for url in AKASH_API_URLS.split(",") if url.strip()]
+    return urls or [AKASH_API_URL]
+
+# 按延迟和错误率选择上游端点
+ENDPOINTS = EndpointSelector(upstream_urls(), UPSTREAM_EWMA_ALPHA)
+
+# 记录请求所属API key的token用量（未启用API_AUTH时没有对应的key）
+def record_token_usage(connection, prompt_tokens: int, completion_tokens: int):
+    api_key = connection.scope.get("state", {}).get("api_key")
+    if api_key is not None:
+        api_key.record_tokens(prompt_tokens, completion_tokens)
+
+# 请求所属的API key的标识（未启用认证或进程内请求时为None），批量任务记录它并计入该key的额度
+def api_key_id(connection) -> Optional[str]:
+    api_key = connection.scope.get("state", {}).get("api_key")
+    return api_key.id if api_key is not None else None
+
+# 请求的优先级通道：X-Priority请求头优先，其次是API key的默认优先级，都没有时为interactive
+# 默认优先级为batch的API key不能通过请求头提升为interactive
+def request_priority(connection) -> str:
+    api_key = connection.scope.get("state", {}).get("api_key")
+    default = api_key.priority if api_key is not None else INTERACTIVE
+    priority = connection.headers.get("x-priority", "").strip().lower()
+    if priority not in LANES or (default == BATCH and priority == INTERACTIVE):
+        return default
+    return priority
+
+# Idempotency-Key的作用域：不同API key（Authorization）的相同key互不影响
+def idempotency_scope(request: Request) -> str:
+    return scope_for(request.headers.get("authorization"))
+
+# 发送请求到Akash，连接失败时换用其他端点，其他错误按配置重试
+async def send_akash_request(client: httpx.AsyncClient, akash_request: Dict[str, Any],
+                             cookies: Dict[str, str], stream: bool) -> httpx.Response:
+    retry_count = 0
+    failed_endpoints = set()
+    while True:
+        endpoint = ENDPOINTS.select(exclude=failed_endpoints)
+        try:
+            upstream_request = client.build_request(
+                "POST",
+                endpoint.url,
+                headers=AKASH_HEADERS,
+                cookies=cookies,
+                json=akash_request,
+                timeout=None if stream else TIMEOUT  # 流式请求不设超时
+            )
+            response = await client.send(upstream_request, stream=stream)
+        except Exception as e:
+            ENDPOINTS.record(endpoint, False, error=repr(e))
+            if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)) and len(failed_endpoints) + 1 < len(ENDPOINTS):
+                # 连接失败时请求还没有发出，立即换用下一个端点，不计入重试次数
+                failed_endpoints.add(endpoint.url)
+                logger.warning(f"连接上游端点{endpoint.url}失败，换用其他端点: {e!r}")
+                continue
+            failed_endpoints.clear()
+            retry_count += 1
+            if retry_count > MAX_RETRIES:
+                raise  # 重试次数用完，抛出异常
+            logger.warning(f"请求失败，正在重试 ({retry_count}/{MAX_RETRIES}): {e}")
+            await asyncio.sleep(RETRY_DELAY * retry_count)  # 指数退避
+            continue
+        ok = response.status_code < 500
+        ENDPOINTS.record(endpoint, ok, error=None if ok else f"HTTP {response.status_code}")
+        return response
+
+def credentials_changed(used_cookies: Dict[str, str]) -> bool:
+    """共享状态中的cookie是否已经不同于请求使用的cookie"""
+    sync_shared_state()
+    return any(COOKIES.get(name) != used_cookies.get(name) for name in ("session_token", "cf_clearance"))
+
+# 凭证失效后刷新：如果其他请求或worker已经刷新过，直接使用新cookie
+# leader自己刷新；其他worker请求leader刷新，并等待共享状态中发布的新cookie（最多CREDENTIAL_WAIT_TIMEOUT秒）
+# 刷新和等待期间归还该请求占用的一个上游名额，重放前重新获得
+async def refresh_credentials_after_failure(used_cookies: Dict[str, str], ticket: Optional[Ticket] = None) -> bool:
+    """返回cookie是否已经更新（未更新或重新获得名额超时时不再重放请求）"""
+    if credentials_changed(used_cookies):
+        return True
+    if ticket is None:
+        return await wait_for_new_credentials(used_cookies)
     try:
-        # 记录原始请求
-        body_bytes = await request.body()
-        body_str = body_bytes.decode('utf-8')
-        logger.info(f"Received request: {body_str}")
+        async with ticket.suspended():
+            return await wait_for_new_credentials(used_cookies)
+    except AdmissionError:
+        logger.warning("凭证刷新后等待上游名额超时，不再重放请求")
+        return False
+
+async def wait_for_new_credentials(used_cookies: Dict[str, str]) -> bool:
+    """leader刷新凭证，其他worker等待leader发布新cookie；返回cookie是否已经更新"""
+    if CREDENTIAL_SCHEDULER.running:
+        # 刚刷新过或处于失败退避中时不再刷新，避免大量失败请求各自触发刷新
+        await CREDENTIAL_SCHEDULER.refresh_if_due()
+        return credentials_changed(used_cookies)
+    CREDENTIAL_SCHEDULER.trigger("Akash返回认证失败")
+    deadline = time.monotonic() + CREDENTIAL_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(CREDENTIAL_WAIT_POLL_INTERVAL)
+        if credentials_changed(used_cookies):
+            return True
+    logger.warning(f"等待leader刷新凭证超时（{CREDENTIAL_WAIT_TIMEOUT:.0f}秒）")
+    return False
+
+async def open_akash_responses(client: httpx.AsyncClient, akash_requests: List[Dict[str, Any]],
+                               cookie_overrides: Dict[str, str], stream: bool,
+                               ticket: Optional[Ticket] = None) -> List[Any]:
+    """并发发送多个请求（n>1），按请求顺序返回响应或失败时的异常"""
+    tasks = [
+        asyncio.ensure_future(open_akash_response(client, akash_request, cookie_overrides, stream, ticket))
+        for akash_request in akash_requests
+    ]
+    try:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    except asyncio.CancelledError:
+        # 被取消时关闭已经打开的响应，避免一直占用共享连接池中的连接
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for task in tasks:
+            if not task.cancelled() and task.exception() is None:
+                await task.result().aclose()
+        raise
+    for index, result in enumerate(results):
+        if isinstance(result, BaseException) and len(results) > 1:
+            logger.warning(f"choice {index} 的上游请求失败: {result}")
+    return results
+
+async def open_akash_response(client: httpx.AsyncClient, akash_request: Dict[str, Any],
+                              cookie_overrides: Dict[str, str], stream: bool,
+                              ticket: Optional[Ticket] = None) -> httpx.Response:
+    """
+    发送请求到Akash并检查响应类别
+
+    遇到Cloudflare挑战或认证失败时，触发一次共享的凭证刷新并用新cookie重放一次；
+    仍然失败时抛出UpstreamError。成功时返回的流式响应由调用方负责关闭。
+    """
+    for attempt in range(2):
+        cookies = {**COOKIES, **cookie_overrides}
+        with span("upstream.request", attempt=attempt, stream=stream) as request_span:
+            response = await send_akash_request(client, akash_request, cookies, stream)
+            request_span.set("http.status_code", response.status_code)
+            request_span.set("endpoint", response.request.url.host)
+        if response.status_code == 200 and "text/html" not in response.headers.get("content-type", ""):
+            return response
         
-        # 解析请求体
-        body = json.loads(body_str)
-        openai_request = OpenAIRequest(**body)
+        body = (await response.aread()).decode('utf-8', errors='replace')
+        kind = classify_upstream_response(response.status_code, response.headers, body)
+        if kind == OK:
+            return response
+        await response.aclose()
         
-        # 转换为Akash请求格式
-        akash_request = convert_to_akash_request(openai_request)
+        # 只有使用服务端cookie时，刷新后重放才有意义
+        if kind in (CHALLENGE, AUTH_FAILURE) and attempt == 0 and not cookie_overrides:
+            logger.warning(f"Akash返回{kind}（{response.status_code}），刷新凭证后重放请求")
+            if await refresh_credentials_after_failure(cookies, ticket):
+                continue
+        raise UpstreamError(kind, response.status_code, body, response.headers.get("retry-after"))
+
+# 请求在发送到上游之前被拒绝（参数或模型不合法）
+class InvalidChatRequest(Exception):
+    def __init__(self, response: JSONResponse):
+        super().__init__(response.body.decode("utf-8"))
+        self.response = response
+
+# n个生成需要一次性获得n个并发名额，超过通道容量的请求永远无法满足，直接拒绝
+def check_admission_capacity(choice_count: int, lane: str) -> None:
+    limit = ADMISSION.lane_capacity(lane)
+    if limit and choice_count > limit:
+        raise InvalidChatRequest(openai_error_response(
+            400, f"n ({choice_count}) exceeds the number of concurrent generations available to "
+                 f"{lane} requests ({limit})",
+            "invalid_request_error", "invalid_value"
+        ))
+
+# 解析并准备聊天请求（HTTP和WebSocket端点共用）
+def prepare_chat_request(openai_request: OpenAIRequest) -> Dict[str, Any]:
+    """
+    校验请求、解析模型、转换为Akash格式并压缩对话历史
+
+    Returns:
+        dict: openai_request、model、akash_requests（n>1时每个choice一个）、prompt_tokens、history_headers
+    """
+    # 确保cookie有效（同时同步其他worker更新的模型列表）
+    with span("cookies", timing=True):
+        ensure_valid_cookies()
+    
+    with span("prepare", timing=True) as prepare_span:
+        # 解析并检查请求的模型
+        model = resolve_model(openai_request.model)
+        prepare_span.set("model", model["id"])
+        error_response = validate_chat_request(openai_request, model)
+        if error_response is not None:
+            raise InvalidChatRequest(error_response)
         
-        # 获取会话令牌（实际使用时需要配置）
-        session_token = request.headers.get("x-akash-session-token")
-        cf_clearance = request.headers.get("x-akash-cf-clearance")
+        # 转换为Akash请求格式
+        akash_request = convert_to_akash_request(openai_request, model)
         
-        # 确保cookie有效
-        ensure_valid_cookies()
+        # 超出模型上下文时压缩对话历史
+        history_headers = compact_akash_history(openai_request, akash_request, model)
+        prompt_tokens = count_prompt_tokens(akash_request["system"], akash_request["messages"])
+        prepare_span.set("prompt_tokens", prompt_tokens)
+    
+    # n>1时每个choice是一次独立的上游生成，使用不同的对话ID
+    akash_requests = [akash_request] + [
+        {**akash_request, "id": new_akash_request_id()} for _ in range((openai_request.n or 1) - 1)
+    ]
+    return {
+        "openai_request": openai_request,
+        "model": model,
+        "akash_requests": akash_requests,
+        "prompt_tokens": prompt_tokens,
+        "history_headers": history_headers,
+    }
+
+# 逐块读取Akash的流式响应，结束时关闭响应
+async def iter_akash_text(akash_response: httpx.Response) -> AsyncGenerator[str, None]:
+    try:
+        # 逐块接收数据并转发
+        async for chunk in akash_response.aiter_text():
+            if chunk:
+                # 直接传递原始文本块
+                yield chunk
+    except Exception as e:
+        logger.error(f"Streaming request error: {e}", exc_info=True)
+        # 以Akash流协议的错误行传递，由流处理函数转换为错误事件
+        yield f"\n3:{json.dumps(f'Error during streaming: {e}')}\n"
+    finally:
+        await akash_response.aclose()
+
+# 执行已解析的聊天请求，返回响应（出错时返回OpenAI格式的错误响应）
+async def complete_chat(request: Request, openai_request: OpenAIRequest) -> Response:
+    try:
+        chat = prepare_chat_request(openai_request)
+        akash_request, akash_requests = chat["akash_requests"][0], chat["akash_requests"]
+        prompt_tokens, history_headers = chat["prompt_tokens"], chat["history_headers"]
+        choice_count = len(akash_requests)
         
         # 使用全局cookie，但允许通过headers覆盖
-        cookies = COOKIES.copy()
+        cookie_overrides = get_cookie_overrides(request)
         
-        if session_token:
-            cookies["session_token"] = session_token
-            
-        if cf_clearance:
-            cookies["cf_clearance"] = cf_clearance
+        # 每个上游生成都占用一个并发名额
+        lane = request_priority(request)
+        check_admission_capacity(choice_count, lane)
+        with span("admission", timing=True, permits=choice_count, lane=lane):
+            ticket = await ADMISSION.acquire(choice_count, lane)
         
         # 处理流式请求
         if openai_request.stream:
             # 使用真正的流式请求从Akash API获取响应
-            logger.info(f"Sending real-time streaming request to Akash: {akash_request}")
+            logger.info(f"Sending real-time streaming request to Akash: {akash_request['id']}")
             
             # 添加响应头，确保流式传输工作正常
             response_headers = {
@@ -576,118 +1119,362 @@ async def chat_completions(request: Request):
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
                 "Transfer-Encoding": "chunked",
-                "X-Accel-Buffering": "no"  # 禁用Nginx缓冲，确保实时流式传输
+                "X-Accel-Buffering": "no",  # 禁用Nginx缓冲，确保实时流式传输
+                **history_headers
             }
             
-            # 创建一个异步生成器，用于从Akash API获取流式响应
-            async def akash_stream_generator():
-                async with httpx.AsyncClient(timeout=None) as client:  # 无超时，因为是流式请求
-                    try:
-                        # 使用stream=True参数启用流式传输
-                        async with client.stream(
-                            "POST",
-                            AKASH_API_URL,
-                            headers=AKASH_HEADERS,
-                            cookies=cookies,
-                            json=akash_request,
-                        ) as response:
-                            # 检查响应状态
-                            if response.status_code != 200:
-                                error_text = await response.text()
-                                logger.error(f"Akash API streaming error: {error_text}")
-                                yield f"Error: {error_text}".encode('utf-8')
-                                return
-                                
-                            # 逐块接收数据并转发
-                            buffer = ""
-                            async for chunk in response.aiter_text():
-                                if chunk:
-                                    # 直接传递原始文本块
-                                    yield chunk
-                    except Exception as e:
-                        logger.error(f"Streaming request error: {e}", exc_info=True)
-                        yield f"Error during streaming: {str(e)}".encode('utf-8')
+            # 在返回流式响应之前先检查上游状态，错误时可以返回正常的错误响应
+            opened: Dict[int, httpx.Response] = {}
+            
+            # 释放并发名额并关闭上游响应（可以重复调用），未读完的响应关闭时会断开对应的上游连接
+            async def cleanup():
+                ticket.release()
+                for akash_response in opened.values():
+                    await akash_response.aclose()
+            
+            try:
+                with span("upstream", timing=True, choices=choice_count):
+                    results = await open_akash_responses(UPSTREAM.client, akash_requests, cookie_overrides, stream=True,
+                                                          ticket=ticket)
+            except BaseException:
+                await cleanup()
+                raise
+            opened.update({index: result for index, result in enumerate(results) if not isinstance(result, BaseException)})
+            if not opened:
+                await cleanup()
+                raise results[0]
+            failed = [index for index in range(choice_count) if index not in opened]
+            if failed:
+                response_headers["X-Failed-Choices"] = format_index_ranges(failed)
+            
+            include_usage = bool((openai_request.stream_options or {}).get("include_usage"))
+            on_complete = lambda completion_tokens: record_token_usage(request, prompt_tokens, completion_tokens)
+            if choice_count == 1:
+                sse_stream = process_real_time_streaming(
+                    iter_akash_text(opened[0]),
+                    prompt_tokens=prompt_tokens,
+                    include_usage=include_usage,
+                    on_complete=on_complete
+                )
+            else:
+                sse_stream = process_fan_out_streaming(
+                    {index: iter_akash_text(akash_response) for index, akash_response in opened.items()},
+                    prompt_tokens=prompt_tokens,
+                    include_usage=include_usage,
+                    on_complete=on_complete
+                )
+            
+            async def sse_stream_with_cleanup():
+                # 流式生成器跨越多次yield，不切换当前span
+                stream_span = start_span("stream", choices=choice_count)
+                events = 0
+                try:
+                    async for event in DRAIN.guard(sse_stream):
+                        if events == 0:
+                            stream_span.set("first_event_ms", round(stream_span.elapsed_ms(), 1))
+                        events += 1
+                        yield event
+                except DrainDeadline:
+                    # 排空期限已到：以错误块结束流，客户端可以重试
+                    stream_span.set("drain_deadline", True)
+                    error_body = openai_error_body("The server is restarting, please retry the request",
+                                                   "server_error", "server_shutting_down")
+                    yield f"data: {json.dumps(error_body)}\n\n"
+                    yield "data: [DONE]\n\n"
+                finally:
+                    stream_span.set("events", events)
+                    stream_span.end()
+                    await cleanup()
             
-            # 返回真正的流式响应
+            # 返回真正的流式响应（客户端在流开始前断开时由后台任务清理）
             return StreamingResponse(
-                process_real_time_streaming(akash_stream_generator()),
+                sse_stream_with_cleanup(),
                 media_type="text/event-stream",
-                headers=response_headers
+                headers=response_headers,
+                background=BackgroundTask(cleanup)
             )
         else:
             # 非流式请求
-            logger.info(f"Sending request to Akash: {akash_request}")
-            async with httpx.AsyncClient() as client:
-                # 添加重试逻辑
-                retry_count = 0
-                while True:
-                    try:
-                        response = await client.post(
-                            AKASH_API_URL,
-                            headers=AKASH_HEADERS,
-                            cookies=cookies,
-                            json=akash_request,
-                            timeout=TIMEOUT
-                        )
-                        break  # 成功则跳出循环
-                    except Exception as e:
-                        retry_count += 1
-                        if retry_count > MAX_RETRIES:
-                            raise  # 重试次数用完，抛出异常
-                        logger.warning(f"请求失败，正在重试 ({retry_count}/{MAX_RETRIES}): {e}")
-                        await asyncio.sleep(RETRY_DELAY * retry_count)  # 指数退避
+            logger.info(f"Sending request to Akash: {akash_request['id']}")
+            try:
+                with span("upstream", timing=True, choices=choice_count):
+                    results = await open_akash_responses(UPSTREAM.client, akash_requests, cookie_overrides, stream=False,
+                                                          ticket=ticket)
+            finally:
+                ticket.release()
+            akash_responses = {index: result for index, result in enumerate(results) if not isinstance(result, BaseException)}
+            if not akash_responses:
+                raise results[0]
+            response_headers = dict(history_headers)
+            failed = [index for index in range(choice_count) if index not in akash_responses]
+            if failed:
+                response_headers["X-Failed-Choices"] = format_index_ranges(failed)
             
             # 记录响应
-            logger.info(f"Akash response status: {response.status_code}")
-            
-            # 检查响应状态
-            if response.status_code != 200:
-                error_msg = f"Akash API error: {response.text}"
-                logger.error(error_msg)
-                return JSONResponse(
-                    status_code=response.status_code,
-                    content={"error": error_msg}
-                )
+            logger.info(f"Akash response status: {[r.status_code for r in akash_responses.values()]}")
             
             try:
                 # 转换为OpenAI格式并返回
-                return convert_to_openai_response(response.text)
+                with span("convert", timing=True):
+                    merged = merge_openai_responses({
+                        index: convert_to_openai_response(akash_response.text, prompt_tokens)
+                        for index, akash_response in akash_responses.items()
+                    }, prompt_tokens)
+                record_token_usage(request, merged["usage"]["prompt_tokens"], merged["usage"]["completion_tokens"])
+                return JSONResponse(merged, headers=response_headers)
             except Exception as e:
                 logger.error(f"Failed to convert Akash response: {e}", exc_info=True)
-                logger.info(f"Raw response: {response.text}")
+                raw_text = next(iter(akash_responses.values())).text
+                logger.info(f"Raw response: {raw_text}")
                 return JSONResponse(
                     status_code=500,
-                    content={"error": f"Failed to convert Akash response: {str(e)}", "raw_response": response.text[:1000]}
+                    content={"error": f"Failed to convert Akash response: {str(e)}", "raw_response": raw_text[:1000]}
                 )
     
+    except InvalidChatRequest as e:
+        return e.response
+    except AdmissionError as e:
+        logger.warning(f"Admission rejected: {e}")
+        return openai_error_response(503, "The server is overloaded, please retry later", "server_error",
+                                     "server_overloaded", headers={"Retry-After": "1"})
+    except UpstreamError as e:
+        logger.error(f"Akash API error ({e.kind}, {e.status_code}): {e.detail[:200]}")
+        return e.to_response()
     except Exception as e:
         logger.error(f"Internal server error: {e}", exc_info=True)
-        return JSONResponse(
-            status_code=500,
-            content={"error": f"Internal server error: {str(e)}"}
+        return openai_error_response(500, f"Internal server error: {str(e)}", "server_error")
+
+# 执行结果按Idempotency-Key去重（客户端超时重试时不会重复生成）
+IDEMPOTENCY = IdempotencyStore(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_MAX_BYTES)
+
+# 主端点：处理OpenAI格式的聊天完成请求
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    try:
+        with span("parse", timing=True) as parse_span:
+            # 边读边检查大小（支持压缩的请求体），直接从字节校验和解析，不经过str和dict
+            body_bytes = await read_body(request, MAX_REQUEST_BODY_BYTES)
+            parse_span.set("bytes", len(body_bytes))
+            openai_request = OpenAIRequest.model_validate_json(body_bytes)
+        # 只记录摘要，不记录完整的请求体
+        logger.info(f"Received request: model={openai_request.model}, {len(openai_request.messages)} messages, "
+                    f"{len(body_bytes)} bytes, stream={openai_request.stream}, n={openai_request.n}")
+    except RequestBodyError as e:
+        logger.warning(f"Rejected request body: {e.message}")
+        return e.to_response()
+    except ValidationError as e:
+        error = e.errors()[0]
+        location = ".".join(str(part) for part in error["loc"])
+        return openai_error_response(400, f"Invalid request body: {location + ': ' if location else ''}{error['msg']}",
+                                     "invalid_request_error", "invalid_request_body")
+    except Exception as e:
+        logger.error(f"Internal server error: {e}", exc_info=True)
+        return openai_error_response(500, f"Internal server error: {str(e)}", "server_error")
+    
+    # 相同API key和Idempotency-Key的请求只执行一次（只在本进程内去重，多进程模式下不处理）
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key is None or not IDEMPOTENCY_DEDUP:
+        return await complete_chat(request, openai_request)
+    try:
+        return await IDEMPOTENCY.execute(
+            idempotency_scope(request), idempotency_key, body_bytes, lambda: complete_chat(request, openai_request)
         )
+    except IdempotencyError as e:
+        logger.warning(f"Rejected Idempotency-Key {idempotency_key[:64]}: {e.message}")
+        return e.to_response()
+
+# 通过WebSocket执行一个流式聊天请求，将增量以紧凑帧的形式交给emit
+async def stream_ws_completion(request_id: str, body: Dict[str, Any], cookie_overrides: Dict[str, str], emit,
+                               on_usage: Optional[Callable[[int, int], None]] = None, lane: str = INTERACTIVE):
+    """
+    帧格式（n>1时带有"i"表示choice下标）:
+        {"id": ..., "d": "文本增量"}
+        {"id": ..., "f": "stop"}                  某个choice结束
+        {"id": ..., "done": true, "usage": {...}} 请求完成
+        {"id": ..., "error": {...}}               OpenAI格式的错误对象
+    """
+    try:
+        chat = prepare_chat_request(OpenAIRequest.model_validate(body))
+        check_admission_capacity(len(chat["akash_requests"]), lane)
+    except InvalidChatRequest as e:
+        await emit({"id": request_id, **json.loads(e.response.body)})
+        return
+    except Exception as e:
+        await emit({"id": request_id, **openai_error_body(f"Invalid request: {e}", "invalid_request_error")})
+        return
+    
+    akash_requests = chat["akash_requests"]
+    try:
+        ticket = await ADMISSION.acquire(len(akash_requests), lane)
+    except AdmissionError:
+        await emit({"id": request_id, **openai_error_body(
+            "The server is overloaded, please retry later", "server_error", "server_overloaded")})
+        return
+    
+    opened: Dict[int, httpx.Response] = {}
+    counters: Dict[int, StreamingTokenCounter] = {}
+    try:
+        results = await open_akash_responses(UPSTREAM.client, akash_requests, cookie_overrides, stream=True,
+                                              ticket=ticket)
+        opened.update({index: result for index, result in enumerate(results) if not isinstance(result, BaseException)})
+        if not opened:
+            raise results[0]
+        for index, result in enumerate(results):
+            if index not in opened:
+                error = result.to_body() if isinstance(result, UpstreamError) else openai_error_body(str(result), "server_error")
+                await emit({"id": request_id, "i": index, **error})
+        
+        response_id = f"chatcmpl-{uuid.uuid4()}"
+        counters.update({index: StreamingTokenCounter() for index in opened})
+        streams = {index: iter_akash_text(akash_response) for index, akash_response in opened.items()}
+        async for openai_chunk in DRAIN.guard(iter_fan_out_chunks(streams, response_id, counters, {})):
+            choice = openai_chunk["choices"][0]
+            frame = {"id": request_id}
+            if choice["index"]:
+                frame["i"] = choice["index"]
+            if choice["finish_reason"]:
+                frame["f"] = choice["finish_reason"]
+            elif choice["delta"].get("content"):
+                frame["d"] = choice["delta"]["content"]
+            else:
+                # 只有角色的首个块不需要发送
+                continue
+            await emit(frame)
+        
+        completion_tokens = sum(counter.total for counter in counters.values())
+        await emit({"id": request_id, "done": True, "usage": usage(chat["prompt_tokens"], completion_tokens)})
+    except UpstreamError as e:
+        logger.error(f"Akash API error ({e.kind}, {e.status_code}): {e.detail[:200]}")
+        await emit({"id": request_id, **e.to_body()})
+    except DrainDeadline:
+        await emit({"id": request_id, **openai_error_body(
+            "The server is restarting, please retry the request", "server_error", "server_shutting_down")})
+    finally:
+        ticket.release()
+        if on_usage is not None and counters:
+            on_usage(chat["prompt_tokens"], sum(counter.total for counter in counters.values()))
+        # 取消请求时关闭上游响应会中断仍在进行的上游连接
+        for akash_response in opened.values():
+            await akash_response.aclose()
+
+# WebSocket端点：在一个连接上复用多个流式聊天请求
+@app.websocket("/v1/chat/completions/ws")
+async def chat_completions_ws(websocket: WebSocket):
+    """
+    客户端消息:
+        {"type": "request", "id": "r1", "body": {...与/v1/chat/completions相同的请求体...}}
+        {"type": "cancel", "id": "r1"}    取消请求并中断上游连接
+
+    各请求的增量帧交错发送。发送队列有上限，客户端读取较慢时暂停读取上游，不会无限占用内存。
+    """
+    await websocket.accept()
+    cookie_overrides = get_cookie_overrides(websocket)
+    outgoing: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+    tasks: Dict[str, asyncio.Task] = {}
+    
+    async def sender():
+        while True:
+            frame = await outgoing.get()
+            await websocket.send_text(json.dumps(frame, ensure_ascii=False, separators=(",", ":")))
+    
+    async def run(request_id: str, body: Dict[str, Any]):
+        try:
+            # WebSocket请求不经过追踪中间件，每个请求单独作为一个trace
+            with span("ws.completion", request_id=request_id):
+                await stream_ws_completion(
+                    request_id, body, cookie_overrides, outgoing.put,
+                    lambda prompt_tokens, completion_tokens: record_token_usage(websocket, prompt_tokens, completion_tokens),
+                    lane
+                )
+        except Exception as e:
+            logger.error(f"WebSocket request {request_id} failed: {e}", exc_info=True)
+            await outgoing.put({"id": request_id, **openai_error_body(f"Internal server error: {e}", "server_error")})
+        finally:
+            tasks.pop(request_id, None)
+    
+    # 启用API_AUTH时，连接上的每个请求都按API key限流
+    api_key = websocket.scope.get("state", {}).get("api_key")
+    # 连接上的所有请求使用握手时确定的优先级
+    lane = request_priority(websocket)
+    sender_task = asyncio.create_task(sender())
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            # 格式错误的消息只回复错误帧，不影响连接上进行中的其他请求
+            try:
+                message = json.loads(frame.get("text") or frame.get("bytes") or "")
+            except ValueError as e:
+                await outgoing.put({"id": "", **openai_error_body(
+                    f"Invalid JSON message: {e}", "invalid_request_error", "invalid_json")})
+                continue
+            if not isinstance(message, dict):
+                await outgoing.put({"id": "", **openai_error_body(
+                    "Each message must be a JSON object", "invalid_request_error", "invalid_message")})
+                continue
+            request_id = str(message.get("id", ""))
+            message_type = message.get("type", "request")
+            if message_type == "cancel":
+                task = tasks.pop(request_id, None)
+                if task is not None:
+                    task.cancel()
+                    await outgoing.put({"id": request_id, "cancelled": True})
+            elif message_type == "request":
+                if DRAIN.draining:
+                    await outgoing.put({"id": request_id, **openai_error_body(
+                        "The server is restarting, please retry the request", "server_error", "server_shutting_down")})
+                elif not request_id or request_id in tasks:
+                    await outgoing.put({"id": request_id, **openai_error_body(
+                        "Each request needs a unique id", "invalid_request_error", "invalid_id")})
+                elif len(tasks) >= WS_MAX_CONCURRENT_REQUESTS:
+                    await outgoing.put({"id": request_id, **openai_error_body(
+                        f"Too many concurrent requests on this connection (max {WS_MAX_CONCURRENT_REQUESTS})",
+                        "rate_limit_error", "too_many_requests")})
+                elif api_key is not None and (limited := API_KEYS.admit(api_key)) is not None:
+                    await outgoing.put({"id": request_id, "retry_after": round(limited[1], 3), **openai_error_body(
+                        f"Rate limit reached for {limited[0]} per minute on API key {api_key.name}",
+                        limited[0], "rate_limit_exceeded")})
+                else:
+                    tasks[request_id] = asyncio.create_task(run(request_id, message.get("body") or {}))
+            else:
+                await outgoing.put({"id": request_id, **openai_error_body(
+                    f"Unknown message type {message_type}", "invalid_request_error", "invalid_type")})
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket disconnected, cancelling {len(tasks)} request(s)")
+    finally:
+        for task in list(tasks.values()):
+            task.cancel()
+        sender_task.cancel()
+
+# 返回预先序列化的JSON，客户端的If-None-Match匹配时返回304
+def cached_json_response(request: Request, body: bytes, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={MODELS_CACHE_MAX_AGE}"}
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if "*" in candidates or etag in candidates:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # 模型列表端点
 @app.get("/v1/models")
-def list_models():
-    """返回支持的模型列表，与OpenAI API兼容"""
-    data = []
-    
-    for model in AVAILABLE_MODELS:
-        data.append({
-            "id": model["id"],
-            "object": "model",
-            "created": int(time.time()) - 10000,  # 假设模型是最近创建的
-            "owned_by": "akash-network",
-            "permission": [],
-            "root": model["id"],
-            "parent": None
-        })
-    
-    return {
-        "object": "list",
-        "data": data
-    }
+def list_models(request: Request):
+    """返回支持的模型列表，与OpenAI API兼容（响应在模型目录变化时预先生成）"""
+    sync_shared_state()
+    catalog = MODEL_CATALOG
+    return cached_json_response(request, catalog.models_body, catalog.models_etag)
+
+# 单个模型查询端点
+@app.get("/v1/models/{model_id:path}")
+def retrieve_model(model_id: str, request: Request):
+    """按模型ID或别名返回模型对象，与OpenAI API兼容"""
+    sync_shared_state()
+    found = MODEL_CATALOG.model_body(model_id)
+    if found is None:
+        return openai_error_response(
+            404, f"The model `{model_id}` does not exist", "invalid_request_error", "model_not_found"
+        )
+    return cached_json_response(request, *found)
 
 # Embeddings端点
 @app.post("/v1/embeddings")
@@ -746,11 +1533,205 @@ async def create_embeddings(request: Request):
             status_code=500,
             content={"error": {"message": f"Error creating embeddings: {str(e)}", "type": "server_error"}}
         )
+# 在进程内执行批量请求：直接调用本应用，经过与普通请求相同的校验、压缩和并发限制，但没有网络开销
+BATCH_CLIENT = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://batch.internal", timeout=None,
+                                 headers={"Accept-Encoding": "identity", "X-Internal-Token": INTERNAL_TOKEN,
+                                          "X-Priority": BATCH})
+
+# owner是提交批量任务的API key的标识，请求计入该key的额度（仍然使用batch通道）
+async def execute_batch_request(url: str, body: Dict[str, Any], owner: Optional[str] = None):
+    headers = {"X-On-Behalf-Of": owner} if owner else None
+    response = await BATCH_CLIENT.post(url, json={**body, "stream": False}, headers=headers)
+    try:
+        content = response.json()
+    except ValueError:
+        content = {"error": {"message": response.text[:1000], "type": "server_error", "param": None, "code": None}}
+    return response.status_code, content, dict(response.headers)
+
+# 批量任务（/v1/files 和 /v1/batches）
+BATCH_STORE = BatchStore(BATCH_DIR)
+BATCH_RUNNER = BatchRunner(BATCH_STORE, execute_batch_request, BATCH_CONCURRENCY, BATCH_MAX_RETRIES, BATCH_POLL_INTERVAL)
+app.include_router(create_batch_router(BATCH_STORE, BATCH_RUNNER, BATCH_MAX_FILE_BYTES, owner_of=api_key_id))
+
 # 健康检查端点
 @app.get("/health")
 def health_check():
     return {"status": "ok", "version": "1.0.0"}
 
+# 就绪检查端点：排空模式下返回503，负载均衡器据此停止转发新请求
+@app.get("/ready")
+def readiness_check():
+    if DRAIN.draining:
+        return JSONResponse(status_code=503, content={"status": "draining", **DRAIN.stats()})
+    return {"status": "ready"}
+
+# 校验管理端点的访问权限：设置了ADMIN_TOKEN时需要Bearer令牌，否则只允许本机访问
+def check_admin(request: Request) -> Optional[JSONResponse]:
+    if ADMIN_TOKEN:
+        token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return None
+        return openai_error_response(401, "Invalid admin token", "invalid_request_error", "invalid_api_key")
+    if request.client and request.client.host in ("127.0.0.1", "::1", "localhost"):
+        return None
+    return openai_error_response(403, "Admin endpoints are only available from localhost unless ADMIN_TOKEN is set",
+                                 "invalid_request_error", "forbidden")
+
+# 进入排空模式，请求全部结束（或超时）后退出进程
+def start_drain(timeout: float) -> bool:
+    if not DRAIN.begin(timeout):
+        return False
+    # 使用SO_REUSEPORT时不再接受新连接，由同一端口上的新进程接收；已经接受的连接中的新请求返回503
+    stop_accepting()
+    # 交出leader：停止后台任务并释放锁，由新进程接管（未完成的批量任务会在新进程中继续）
+    stop_leader_tasks()
+    LEADER.release()
+    app.state.drain_task = asyncio.create_task(finish_drain())
+    return True
+
+async def finish_drain():
+    await DRAIN.wait(DRAIN_CLOSE_GRACE)
+    logger.info("排空完成，正在退出")
+    # 交给uvicorn的信号处理完成正常的关闭流程
+    signal.raise_signal(signal.SIGINT)
+
+# 读取并校验热重载的全部新配置（文件读取，在线程中执行），配置无效时抛出ValueError
+def read_configuration() -> Dict[str, Any]:
+    settings = load_settings()
+    return {
+        "settings": settings,
+        "aliases": load_aliases(settings["MODEL_ALIASES_FILE"], strict=True),
+        "api_keys": load_api_keys(API_KEYS_FILE, settings["API_KEY_DEFAULT_RPM"], settings["API_KEY_DEFAULT_TPM"],
+                                  strict=True) if API_AUTH else None,
+        # cookie文件缺失或无效时保留当前的cookie
+        "cookies": load_cookies(check_expiry=False)
+    }
+
+# 热重载依次进行，先读完的配置先替换
+RELOAD_LOCK = asyncio.Lock()
+
+# 热重载配置、模型别名、模型目录和凭证
+async def reload_configuration(broadcast: bool = True) -> Dict[str, Any]:
+    """
+    先在线程中读取并校验全部新配置（.env、别名文件、API key文件、cookie文件），全部有效后才一次性替换，
+    替换过程中没有await，请求不会看到新旧混合的配置。连接池、缓存和进行中的请求不受影响。
+    配置无效时抛出ValueError，当前配置保持不变。
+
+    broadcast为True时通过共享状态通知其他worker跟进。
+    """
+    async with RELOAD_LOCK:
+        config = await asyncio.to_thread(read_configuration)
+        settings, aliases, api_keys, cookies = (config["settings"], config["aliases"], config["api_keys"],
+                                                config["cookies"])
+        # 使用替换时的模型列表构建目录，读取配置期间模型列表可能已经更新
+        catalog = ModelCatalog(MODEL_CATALOG.raw_models, {**MODEL_ALIASES, **aliases}, settings["DEFAULT_MODEL"])
+        if catalog.resolve(settings["DEFAULT_MODEL"]) is None and catalog.default:
+            # 与启动时相同，模型列表中没有默认模型时使用第一个可用模型
+            logger.warning(f"DEFAULT_MODEL={settings['DEFAULT_MODEL']!r} 不在模型列表中，使用 {catalog.default['id']}")
+        return apply_configuration(settings, aliases, catalog, api_keys, cookies, broadcast)
+
+# 一次性替换热重载的配置（不会失败）
+def apply_configuration(settings: Dict[str, Any], aliases: Dict[str, str], catalog: ModelCatalog,
+                        api_keys: Optional[Dict[str, Any]], cookies: Optional[Dict[str, str]],
+                        broadcast: bool) -> Dict[str, Any]:
+    global USER_MODEL_ALIASES, MODEL_CATALOG, RELOAD_GENERATION
+    changed = apply_settings(settings)
+    globals().update(settings)
+    USER_MODEL_ALIASES = aliases
+    MODEL_CATALOG = catalog
+    if cookies:
+        COOKIES.clear()
+        COOKIES.update(cookies)
+    ADMISSION.resize(MAX_CONCURRENT_GENERATIONS, ADMISSION_TIMEOUT, ADMISSION_INTERACTIVE_RESERVED)
+    CREDENTIAL_SCHEDULER.lead_time = CREDENTIAL_REFRESH_LEAD_TIME
+    CREDENTIAL_SCHEDULER.jitter = CREDENTIAL_REFRESH_JITTER
+    CREDENTIAL_SCHEDULER.max_interval = CREDENTIAL_REFRESH_MAX_INTERVAL
+    CREDENTIAL_SCHEDULER.max_backoff = CREDENTIAL_REFRESH_MAX_BACKOFF
+    IDEMPOTENCY.ttl = IDEMPOTENCY_TTL
+    IDEMPOTENCY.max_entries = IDEMPOTENCY_MAX_ENTRIES
+    IDEMPOTENCY.max_bytes = IDEMPOTENCY_MAX_BYTES
+    ENDPOINTS.update(upstream_urls())
+    if api_keys is not None:
+        API_KEYS.replace(api_keys)
+    
+    if broadcast:
+        if cookies:
+            publish_cookies()
+        generation = ((SHARED_STATE.get("reload") or {}).get("generation") or 0) + 1
+        SHARED_VERSIONS["reload"] = SHARED_STATE.set("reload", {"generation": generation})
+        RELOAD_GENERATION = generation
+    logger.info(f"配置已热重载，变化的配置项: {sorted(changed) or '无'}，自定义别名 {len(aliases)} 个，"
+                f"{'已' if cookies else '未'}重新加载cookie")
+    return {
+        "changed": sorted(changed),
+        "aliases": len(aliases),
+        "default_model": catalog.default["id"] if catalog.default else None,
+        "credentials_reloaded": bool(cookies),
+        "api_keys": len(api_keys) if api_keys is not None else None
+    }
+
+# 后台热重载任务，保留引用避免任务在完成前被回收
+RELOAD_TASKS: Set[asyncio.Task] = set()
+
+# worker的事件循环，同步端点在线程池中同步共享状态时，热重载任务需要提交到这里
+MAIN_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+async def run_reload(broadcast: bool):
+    try:
+        await reload_configuration(broadcast)
+    except ValueError as e:
+        logger.error(f"{'热重载' if broadcast else '跟进其他worker的热重载'}失败，保持当前配置: {e}")
+
+def start_reload_task(broadcast: bool):
+    task = asyncio.create_task(run_reload(broadcast))
+    RELOAD_TASKS.add(task)
+    task.add_done_callback(RELOAD_TASKS.discard)
+
+# 在后台热重载（SIGHUP和跟进其他worker的热重载），可以在事件循环或线程池中调用
+def schedule_reload(broadcast: bool):
+    if MAIN_LOOP is not None:
+        MAIN_LOOP.call_soon_threadsafe(start_reload_task, broadcast)
+
+# 管理端点：热重载配置
+@app.post("/admin/reload")
+async def admin_reload(request: Request):
+    denied = check_admin(request)
+    if denied:
+        return denied
+    try:
+        return {"status": "reloaded", **(await reload_configuration())}
+    except ValueError as e:
+        logger.error(f"热重载失败，保持当前配置: {e}")
+        return openai_error_response(400, f"Invalid configuration, nothing was changed: {e}",
+                                     "invalid_request_error", "invalid_configuration")
+
+# 管理端点：进入排空模式
+@app.post("/admin/drain")
+async def admin_drain(request: Request):
+    denied = check_admin(request)
+    if denied:
+        return denied
+    body = await request.body()
+    try:
+        options = json.loads(body) if body else {}
+    except ValueError as e:
+        return openai_error_response(400, f"Invalid JSON body: {e}", "invalid_request_error", "invalid_json")
+    if not isinstance(options, dict):
+        return openai_error_response(400, "Request body must be a JSON object", "invalid_request_error", "invalid_json")
+    timeout = options.get("timeout", DRAIN_TIMEOUT)
+    # bool是int的子类，需要单独排除；NaN和无穷大也不是合法的等待时间
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not 0 <= timeout < float("inf"):
+        return openai_error_response(
+            400, "timeout must be a non-negative number of seconds", "invalid_request_error", "invalid_value"
+        )
+    if WORKERS > 1 and os.name != "nt":
+        # 多进程模式：通知主进程，由主进程向所有worker发送SIGTERM
+        os.kill(os.getppid(), signal.SIGTERM)
+        # 信号无法传递等待时间，各worker使用DRAIN_TIMEOUT
+        return {"status": "draining", "scope": "all_workers", "timeout": DRAIN_TIMEOUT}
+    started = start_drain(timeout)
+    return {"status": "draining", "scope": "worker", "already_draining": not started, **DRAIN.stats()}
+
 # 添加一个调试端点，用于直接测试Akash API
 @app.post("/debug/akash-api")
 async def debug_akash_api(request: Request):
@@ -758,43 +1739,34 @@ async def debug_akash_api(request: Request):
         # 获取请求体
         body = await request.json()
         
-        # 获取会话令牌
-        session_token = request.headers.get("x-akash-session-token")
-        cf_clearance = request.headers.get("x-akash-cf-clearance")
-        
         # 确保cookie有效
         ensure_valid_cookies()
         
         # 使用全局cookie，但允许通过headers覆盖
-        cookies = COOKIES.copy()
-        
-        if session_token:
-            cookies["session_token"] = session_token
-            
-        if cf_clearance:
-            cookies["cf_clearance"] = cf_clearance
+        cookies = {**COOKIES, **get_cookie_overrides(request)}
         
         # 发送请求到Akash
         logger.info(f"Debug: Sending request to Akash: {body}")
-        async with httpx.AsyncClient() as client:
-            # 添加重试逻辑
-            retry_count = 0
-            while True:
-                try:
-                    response = await client.post(
-                        AKASH_API_URL,
-                        headers=AKASH_HEADERS,
-                        cookies=cookies,
-                        json=body,
-                        timeout=TIMEOUT
-                    )
-                    break  # 成功则跳出循环
-                except Exception as e:
-                    retry_count += 1
-                    if retry_count > MAX_RETRIES:
-                        raise  # 重试次数用完，抛出异常
-                    logger.warning(f"调试请求失败，正在重试 ({retry_count}/{MAX_RETRIES}): {e}")
-                    await asyncio.sleep(RETRY_DELAY * retry_count)  # 指数退避
+        # 添加重试逻辑
+        retry_count = 0
+        while True:
+            try:
+                upstream_request = UPSTREAM.client.build_request(
+                    "POST",
+                    ENDPOINTS.select().url,
+                    headers=AKASH_HEADERS,
+                    cookies=cookies,
+                    json=body,
+                    timeout=TIMEOUT
+                )
+                response = await UPSTREAM.client.send(upstream_request)
+                break  # 成功则跳出循环
+            except Exception as e:
+                retry_count += 1
+                if retry_count > MAX_RETRIES:
+                    raise  # 重试次数用完，抛出异常
+                logger.warning(f"调试请求失败，正在重试 ({retry_count}/{MAX_RETRIES}): {e}")
+                await asyncio.sleep(RETRY_DELAY * retry_count)  # 指数退避
         
         # 记录响应
         logger.info(f"Debug: Akash response status: {response.status_code}")
@@ -809,22 +1781,233 @@ async def debug_akash_api(request: Request):
         logger.error(f"Debug endpoint error: {e}", exc_info=True)
         return {"error": str(e)}
 
+# 非leader进程检查leader锁的间隔（秒），旧leader排空退出后由其他进程接管
+LEADER_POLL_INTERVAL = 5
+# leader检查其他worker的凭证刷新请求的间隔（秒），超过CREDENTIAL_REQUEST_MAX_AGE秒的请求视为过期
+CREDENTIAL_REQUEST_POLL_INTERVAL = 1
+CREDENTIAL_REQUEST_MAX_AGE = 60
+LEADER_TASKS = ("credential_task", "credential_request_task", "credential_watch_task", "model_refresh_task", "batch_task")
+
+# 启动只由leader运行的后台任务（保留引用，避免任务被垃圾回收）
+def start_leader_tasks():
+    # 后台凭证刷新调度器
+    app.state.credential_task = asyncio.create_task(CREDENTIAL_SCHEDULER.run())
+    # 执行其他worker的凭证刷新请求
+    app.state.credential_request_task = asyncio.create_task(credential_request_task())
+    # 检查cookie文件是否被外部修改
+    if COOKIE_WATCH_INTERVAL > 0:
+        app.state.credential_watch_task = asyncio.create_task(CREDENTIALS.watch(COOKIE_WATCH_INTERVAL))
+    # 后台模型列表刷新
+    app.state.model_refresh_task = asyncio.create_task(model_refresh_task())
+    # 执行批量任务（包括重启前未完成的任务）
+    app.state.batch_task = asyncio.create_task(BATCH_RUNNER.run())
+
+def stop_leader_tasks():
+    for name in LEADER_TASKS:
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+            setattr(app.state, name, None)
+    watch_task = getattr(app.state, "leader_watch_task", None)
+    if watch_task is not None:
+        watch_task.cancel()
+
+# leader：轮询共享状态中其他worker的凭证刷新请求，交给调度器（并发的请求合并为一次刷新）
+async def credential_request_task():
+    handled = None
+    while True:
+        await asyncio.sleep(CREDENTIAL_REQUEST_POLL_INTERVAL)
+        try:
+            request = SHARED_STATE.get(CREDENTIAL_REFRESH_REQUEST_KEY)
+        except Exception as e:
+            logger.error(f"读取凭证刷新请求失败: {e}")
+            continue
+        if not request or request.get("requested_at") == handled:
+            continue
+        handled = request.get("requested_at")
+        if time.time() - handled < CREDENTIAL_REQUEST_MAX_AGE:
+            CREDENTIAL_SCHEDULER.trigger(f"worker {request.get('pid')}: {request.get('reason')}")
+
+# 等待当选leader（例如无中断重启时旧进程释放锁）
+async def leader_watch_task():
+    while not LEADER.is_leader():
+        await asyncio.sleep(LEADER_POLL_INTERVAL)
+    sync_shared_state()
+    # 之前的leader可能已经更新了快照
+    await load_model_snapshot()
+    start_leader_tasks()
+
+# 事件循环卡顿监控（每个worker各自监控）
+LOOP_LAG = LoopLagMonitor(LOOP_LAG_THRESHOLD_MS / 1000)
+
+def profiler_busy_response() -> JSONResponse:
+    return openai_error_response(409, "Another profiling session is already running", "invalid_request_error",
+                                 "profiler_busy")
+
+# 管理端点：在事件循环中运行cProfile，返回文本报告或pstats文件
+@app.get("/admin/profile/cprofile")
+async def admin_cprofile(request: Request, seconds: float = 10, sort: str = "cumulative", limit: int = 60,
+                         format: str = "text"):
+    denied = check_admin(request)
+    if denied:
+        return denied
+    if sort not in pstats.Stats.sort_arg_dict_default:
+        return openai_error_response(400, f"Unknown sort key {sort}", "invalid_request_error", "invalid_sort")
+    try:
+        stats = await run_cprofile(seconds)
+    except ProfilerBusy:
+        return profiler_busy_response()
+    if format == "pstats":
+        return Response(dump_pstats(stats), media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="proxy-{os.getpid()}.prof"'})
+    return Response(format_pstats(stats, sort, limit), media_type="text/plain; charset=utf-8")
+
+# 管理端点：采样调用栈，返回折叠格式（用于生成火焰图）
+@app.get("/admin/profile/sample")
+async def admin_sample(request: Request, seconds: float = 10, interval_ms: float = 5, all_threads: bool = False):
+    denied = check_admin(request)
+    if denied:
+        return denied
+    # 默认只采样事件循环线程
+    thread_ids = None if all_threads else [threading.get_ident()]
+    try:
+        collapsed = await asyncio.to_thread(sample_stacks, seconds, max(interval_ms, 1) / 1000, thread_ids)
+    except ProfilerBusy:
+        return profiler_busy_response()
+    return Response(collapsed, media_type="text/plain; charset=utf-8")
+
+# 管理端点：事件循环卡顿记录（包括阻塞时的调用栈）
+@app.get("/admin/loop-lag")
+def admin_loop_lag(request: Request):
+    denied = check_admin(request)
+    if denied:
+        return denied
+    return LOOP_LAG.stats()
+
+# 管理端点：上游连接池的占用情况和并发名额
+@app.get("/admin/upstream")
+def admin_upstream(request: Request):
+    denied = check_admin(request)
+    if denied:
+        return denied
+    return {"upstream": UPSTREAM.stats(), "endpoints": ENDPOINTS.stats(), "admission": ADMISSION.stats(),
+            "idempotency": IDEMPOTENCY.stats()}
+
+# 管理端点：各API key的额度、剩余额度和尚未写入文件的用量
+@app.get("/admin/keys")
+def admin_keys(request: Request):
+    denied = check_admin(request)
+    if denied:
+        return denied
+    return {"enabled": API_AUTH, "keys": API_KEYS.stats()}
+
+def on_sigterm():
+    start_drain(DRAIN_TIMEOUT)
+
+def on_sighup():
+    schedule_reload(broadcast=True)
+
+# SIGTERM触发排空，SIGHUP触发热重载（Windows不支持事件循环的信号处理，保持uvicorn的默认行为）
+def install_signal_handlers():
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, on_sighup)
+    except (NotImplementedError, RuntimeError, ValueError) as e:
+        logger.info(f"无法安装SIGTERM/SIGHUP处理: {e}")
+
+# worker启动时从共享状态加载，并由leader负责后台刷新
+@app.on_event("startup")
+async def on_startup():
+    global MAIN_LOOP
+    MAIN_LOOP = asyncio.get_running_loop()
+    load_shared_state()
+    if LEADER.is_leader():
+        await load_model_snapshot()
+        start_leader_tasks()
+    else:
+        app.state.leader_watch_task = asyncio.create_task(leader_watch_task())
+    install_signal_handlers()
+    if LOOP_LAG_MONITOR:
+        LOOP_LAG.start()
+    # 预热上游连接（每个worker各自的连接池），热重载后的端点在下一轮生效
+    if UPSTREAM_PREWARM_INTERVAL > 0:
+        app.state.prewarm_task = asyncio.create_task(
+            UPSTREAM.prewarm_task(lambda: ENDPOINTS.urls, UPSTREAM_PREWARM_INTERVAL, AKASH_HEADERS)
+        )
+    # 定时写入各API key的用量（每个worker写入自己的增量）
+    if API_AUTH:
+        app.state.usage_flush_task = asyncio.create_task(API_KEYS.flush_task(API_USAGE_FLUSH_INTERVAL))
+    # 配置了多个上游端点时定时探测延迟
+    if UPSTREAM_PROBE_INTERVAL > 0:
+        app.state.probe_task = asyncio.create_task(
+            ENDPOINTS.probe_task(UPSTREAM.client, UPSTREAM_PROBE_INTERVAL, AKASH_HEADERS)
+        )
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await UPSTREAM.aclose()
+    if API_AUTH:
+        await asyncio.to_thread(API_KEYS.flush)
+
+# 多进程模式的主进程：启动worker，收到SIGTERM/SIGINT后让所有worker同时排空
+def run_workers(server_config, server, sock):
+    from uvicorn.supervisors import Multiprocess
+    supervisor = Multiprocess(server_config, target=server.run, sockets=[sock])
+    supervisor.startup()
+    # worker启动时已经继承了监听socket，主进程关闭自己的副本，
+    # 否则使用SO_REUSEPORT时worker排空并关闭各自的副本后socket仍留在组中，新连接会被分配到这里
+    sock.close()
+    supervisor.should_exit.wait()
+    # 先向所有worker发送SIGTERM再等待退出（Multiprocess.shutdown逐个发送并等待，worker会依次排空，
+    # 尚未收到信号的worker继续接受新请求，重启最多需要WORKERS×DRAIN_TIMEOUT）
+    for process in supervisor.processes:
+        process.terminate()
+    supervisor.shutdown()
+
 # 启动服务器
 if __name__ == "__main__":
+    import socket
     import uvicorn
     
     # 打印配置信息
     print_config()
     
-    # 初始化cookie
-    init_cookies()
+    # 幂等去重的结果保存在各进程的内存中，多个worker之间无法共享，重试可能被分配到其他worker而重复执行
+    if IDEMPOTENCY_DEDUP and WORKERS > 1:
+        logger.error("IDEMPOTENCY_DEDUP只在单个进程内有效，不能与WORKERS>1同时使用；请设置WORKERS=1或IDEMPOTENCY_DEDUP=false")
+        raise SystemExit(1)
+    if IDEMPOTENCY_DEDUP:
+        logger.info("已启用Idempotency-Key去重（结果保存在本进程内存中）")
     
-    # 获取可用模型列表
-    fetch_available_models()
+    # 在主进程中初始化cookie（可能需要手动输入），再由各worker共享
+    init_cookies()
     
-    # 启动后台cookie更新线程
-    cookie_updater = threading.Thread(target=cookie_updater_task, daemon=True)
-    cookie_updater.start()
+    # 从快照加载模型列表，最新的列表由后台任务获取
+    init_models()
     
     logger.info("Starting OpenAI to Akash Network Proxy server...")
-    uvicorn.run(app, host=HOST, port=PORT)
\ No newline at end of file
+    if REUSE_PORT and not hasattr(socket, "SO_REUSEPORT"):
+        logger.warning("当前系统不支持SO_REUSEPORT，按普通方式监听端口")
+    # 多进程模式：uvicorn需要以导入字符串的方式加载应用
+    server_config = uvicorn.Config("openai_to_akash_proxy:app" if WORKERS > 1 else app,
+                                   host=HOST, port=PORT, workers=WORKERS)
+    sock = None
+    if REUSE_PORT and hasattr(socket, "SO_REUSEPORT"):
+        # 自行创建监听socket并设置SO_REUSEPORT，新旧进程可以同时监听同一端口
+        sock = socket.socket(socket.AF_INET6 if ":" in HOST else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((HOST, PORT))
+        sock.set_inheritable(True)
+        logger.info(f"已启用SO_REUSEPORT，监听 {HOST}:{PORT}")
+    # 只有使用SO_REUSEPORT时排空才关闭监听socket（新连接由新进程接收），否则新请求返回503
+    server = DrainableServer(server_config, close_on_drain=sock is not None)
+    if WORKERS > 1:
+        logger.info(f"以多进程模式启动，worker数: {WORKERS}")
+        run_workers(server_config, server, sock or server_config.bind_socket())
+    elif sock is not None:
+        server.run(sockets=[sock])
+    else:
+        server.run()
@@ -0,0 +1,180 @@
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("profiling")
+
+# 单次分析的最长时间（秒）
+PROFILE_MAX_SECONDS = 120
+# 卡顿记录保留的栈帧数
+STALL_STACK_LIMIT = 30
+
+
+class ProfilerBusy(Exception):
+    """已有分析正在进行"""
+
+
+# 同一时间只允许一个分析会话（cProfile和采样都会影响性能）
+_session_lock = threading.Lock()
+
+
+def _clamp_seconds(seconds: float) -> float:
+    return min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+
+
+async def run_cprofile(seconds: float) -> pstats.Stats:
+    """
+    在事件循环线程中运行cProfile，持续seconds秒
+
+    所有请求的协程都在事件循环线程中执行，因此会被完整记录；
+    asyncio.to_thread等线程中执行的代码不在统计范围内。
+    """
+    if not _session_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(_clamp_seconds(seconds))
+        finally:
+            profiler.disable()
+        return pstats.Stats(profiler)
+    finally:
+        _session_lock.release()
+
+
+def format_pstats(stats: pstats.Stats, sort: str, limit: int) -> str:
+    """pstats的文本报告"""
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+def dump_pstats(stats: pstats.Stats) -> bytes:
+    """pstats的二进制格式（可以用snakeviz、gprof2dot等工具打开）"""
+    return marshal.dumps(stats.stats)
+
+
+def _frame_name(frame) -> str:
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def _collapse(frame) -> str:
+    """将栈帧转换为折叠格式（从外到内，以分号分隔）"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample_stacks(seconds: float, interval: float, thread_ids: Optional[List[int]] = None) -> str:
+    """
+    定时采样线程的调用栈，返回折叠格式（每行"栈 次数"，可以直接用flamegraph.pl或speedscope打开）
+
+    在独立线程中调用；thread_ids为None时采样除本线程外的所有线程。
+    """
+    if not _session_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        samples: Counter = Counter()
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        deadline = time.monotonic() + _clamp_seconds(seconds)
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (thread_ids is not None and thread_id not in thread_ids):
+                    continue
+                samples[f"{names.get(thread_id, thread_id)};{_collapse(frame)}"] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+    finally:
+        _session_lock.release()
+
+
+class LoopLagMonitor:
+    """
+    事件循环卡顿监控
+
+    事件循环中的任务定时更新心跳；独立的看门狗线程发现心跳超过threshold秒未更新时，
+    立即记录事件循环线程当前的调用栈（即阻塞事件循环的代码），心跳恢复后补充卡顿时长。
+    """
+
+    def __init__(self, threshold: float, history: int = 50):
+        self.threshold = threshold
+        self.interval = min(threshold / 2, 0.05)
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self.max_lag = 0.0
+        self.total_stalls = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._current_stall: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True).start()
+        logger.info(f"事件循环卡顿监控已启动（阈值 {self.threshold * 1000:.0f}ms）")
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - expected
+            self.max_lag = max(self.max_lag, lag)
+            stall = self._current_stall
+            if stall is not None:
+                # 看门狗已记录调用栈，补充实际卡顿时长
+                stall["duration_ms"] = round((now - stall["_started"]) * 1000, 1)
+                self._current_stall = None
+                logger.warning(f"事件循环卡顿 {stall['duration_ms']}ms，阻塞位置: {stall['stack'][-1] if stall['stack'] else '?'}")
+            self._heartbeat = now
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            heartbeat = self._heartbeat
+            if self._current_stall is not None or time.monotonic() - heartbeat < self.threshold + self.interval:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = traceback.format_list(traceback.extract_stack(frame, limit=STALL_STACK_LIMIT)) if frame else []
+            stall = {
+                "at": time.time(),
+                "duration_ms": None,
+                "stack": [line.strip() for line in stack],
+                "_started": heartbeat + self.interval,
+            }
+            self.total_stalls += 1
+            self.stalls.append(stall)
+            self._current_stall = stall
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "total_stalls": self.total_stalls,
+            "recent_stalls": [
+                {key: value for key, value in stall.items() if not key.startswith("_")}
+                for stall in reversed(self.stalls)
+            ],
+        }
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("shared-state")
+
+# 跨平台文件锁：Linux/Mac使用fcntl，Windows使用msvcrt
+try:
+    import fcntl
+
+    def _try_lock(fd: int) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+except ImportError:
+    import msvcrt
+
+    def _try_lock(fd: int) -> bool:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+
+class SharedState:
+    """
+    多进程共享状态存储
+
+    基于SQLite的简单键值存储，用于在多个worker进程之间共享Cookie和模型列表。
+    其他进程的写入通过PRAGMA data_version检测，读取方只在数据真正变化时才重新加载，
+    不需要定时轮询。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._data_version = self._read_data_version()
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取一个键的值，不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def get_if_changed(self, key: str, version: Optional[float]) -> Tuple[Optional[Any], Optional[float]]:
+        """
+        仅在键的写入时间不同于version时读取其值
+
+        返回(值, 写入时间)，键未变化或不存在时值为None；写入时间作为下次调用的version。
+        其他键的写入同样会改变data_version，读取方用它只处理真正变化的键。
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value, updated_at FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        if row[1] == version:
+            return None, version
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any) -> float:
+        """写入一个键的值，返回写入时间（即get_if_changed使用的version）"""
+        data = json.dumps(value, ensure_ascii=False)
+        updated_at = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO state (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (key, data, updated_at)
+            )
+        return updated_at
+
+    def has_changed(self) -> bool:
+        """
+        检查自上次调用以来是否有其他进程写入过数据
+
+        data_version只在其他连接提交事务时变化，本进程自己的写入不会触发。
+        """
+        with self._lock:
+            version = self._read_data_version()
+            changed = version != self._data_version
+            self._data_version = version
+        return changed
+
+
+class LeaderElection:
+    """
+    基于文件锁的leader选举
+
+    持有锁的进程负责刷新Cookie和模型列表，进程退出时锁自动释放，
+    其他进程下次调用is_leader()时即可接管。
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self._fd: Optional[int] = None
+        self._is_leader = False
+
+    def is_leader(self) -> bool:
+        """返回当前进程是否为leader，尚未当选时尝试非阻塞获取锁"""
+        if self._is_leader:
+            return True
+        if self._fd is None:
+            self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT)
+        if _try_lock(self._fd):
+            self._is_leader = True
+            logger.info(f"进程 {os.getpid()} 当选为leader")
+        return self._is_leader
+
+    def release(self) -> None:
+        """放弃leader身份（关闭文件即释放锁），其他进程下次调用is_leader()时接管"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._is_leader:
+            self._is_leader = False
+            logger.info(f"进程 {os.getpid()} 已释放leader")
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+from config import TOKENIZER, TIKTOKEN_ENCODING
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("token-counter")
+
+# 每条消息在对话格式中的额外开销（角色、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+# 助手回复的起始标记
+REPLY_PRIMING_TOKENS = 3
+# 流式统计时，积累到这个长度才计数一次（片段太小时估算的取整误差会累积）
+STREAM_FLUSH_CHARS = 64
+# 消息计数缓存的条目数上限
+MESSAGE_CACHE_SIZE = 8192
+# 短于这个长度的消息直接计数（计数本身比计算摘要便宜，也不值得占用缓存）
+MESSAGE_CACHE_MIN_CHARS = 256
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    快速估算文本的token数
+
+    英文等ASCII文本大约4个字符一个token，中日韩等非ASCII字符大约一个字符一个token。
+    只用到len和encode（都在C中完成），不逐字符遍历。
+    """
+    if not text:
+        return 0
+    length = len(text)
+    # 非ASCII字符在UTF-8中占2~4个字节，按常见的3字节字符估算其数量
+    non_ascii = min((len(text.encode("utf-8", errors="replace")) - length) // 2, length)
+    return (length - non_ascii + 3) // 4 + non_ascii
+
+
+def _load_tokenizer(name: str) -> Callable[[str], int]:
+    """
+    按配置选择分词器
+
+    auto: 安装了tiktoken时使用tiktoken，否则使用估算
+    tiktoken: 使用tiktoken（未安装时退回估算）
+    heuristic: 始终使用估算
+    """
+    if name in ("auto", "tiktoken"):
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+            logger.info(f"使用tiktoken统计token（{TIKTOKEN_ENCODING}）")
+            return lambda text: len(encoding.encode(text, disallowed_special=())) if text else 0
+        except ImportError:
+            if name == "tiktoken":
+                logger.warning("未安装 tiktoken，使用估算统计token")
+                logger.info("请运行: pip install tiktoken")
+        except Exception as e:
+            logger.warning(f"加载tiktoken编码 {TIKTOKEN_ENCODING} 失败，使用估算统计token: {e}")
+    return estimate_tokens
+
+
+# 当前使用的分词器
+_tokenizer: Callable[[str], int] = _load_tokenizer(TOKENIZER)
+
+
+def set_tokenizer(tokenizer: Callable[[str], int]) -> None:
+    """替换分词器（参数为返回token数的函数），同时清空缓存的计数"""
+    global _tokenizer
+    _tokenizer = tokenizer
+    _message_cache.clear()
+
+
+def count_tokens(text: str) -> int:
+    """使用当前的分词器统计文本的token数"""
+    return _tokenizer(text)
+
+
+# (角色, 内容摘要) -> token数。只保存摘要而不保存消息原文，缓存不会让长对话的全文一直留在内存中
+_message_cache: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+
+
+def count_message_tokens(role: str, content: str) -> int:
+    """统计一条消息的token数，相同的消息（例如每次都会重复发送的系统提示和历史消息）只计算一次"""
+    if len(content) < MESSAGE_CACHE_MIN_CHARS:
+        return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    key = (role, hashlib.blake2b(content.encode("utf-8", errors="surrogatepass"), digest_size=16).digest())
+    tokens = _message_cache.get(key)
+    if tokens is not None:
+        _message_cache.move_to_end(key)
+        return tokens
+    tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    _message_cache[key] = tokens
+    if len(_message_cache) > MESSAGE_CACHE_SIZE:
+        _message_cache.popitem(last=False)
+    return tokens
+
+
+def count_prompt_tokens(system: str, messages: List[Dict[str, Any]]) -> int:
+    """统计实际发送给上游的提示的token数"""
+    total = count_message_tokens("system", system) if system else 0
+    total += sum(count_message_tokens(msg["role"], msg["content"]) for msg in messages)
+    return total + REPLY_PRIMING_TOKENS
+
+
+class StreamingTokenCounter:
+    """
+    增量统计流式输出的token数
+
+    新到达的文本积累到一定长度后，对其中已经完整的部分（到最后一个空白为止，
+    没有空白时为全部）计数，剩余部分留到下一次，不需要在流结束时重新处理全文。
+    """
+
+    def __init__(self):
+        self.tokens = 0
+        self._pending = ""
+
+    def add(self, text: str) -> None:
+        text = self._pending + text
+        if len(text) < STREAM_FLUSH_CHARS:
+            self._pending = text
+            return
+        cut = max(text.rfind(" "), text.rfind("\n"))
+        if cut <= 0:
+            cut = len(text)
+        self.tokens += count_tokens(text[:cut])
+        self._pending = text[cut:]
+
+    @property
+    def total(self) -> int:
+        return self.tokens + count_tokens(self._pending)
+
+
+def usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, int]:
+    """OpenAI格式的usage对象"""
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
@@ -0,0 +1,290 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("tracing")
+
+# W3C traceparent: 版本-trace id-父span id-标志
+TRACEPARENT_PATTERN = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# 当前请求（或后台任务）中正在进行的span
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    """解析traceparent请求头，返回(trace_id, parent_span_id)，格式无效时返回None"""
+    if not header:
+        return None
+    match = TRACEPARENT_PATTERN.match(header.strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+class Span:
+    """
+    一个计时区间
+
+    timing为True的span结束时，其耗时会加入所属trace根span的Server-Timing。
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "root", "attributes",
+                 "start_ns", "_start", "duration", "error", "timing", "timings")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, trace_id: Optional[str] = None,
+                 parent_id: Optional[str] = None, attributes: Optional[Dict[str, Any]] = None, timing: bool = False):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else (trace_id or _new_id(16))
+        self.span_id = _new_id(8)
+        self.parent_id = parent.span_id if parent else parent_id
+        self.root = parent.root if parent else self
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self.timing = timing
+        self.timings: List[Tuple[str, float]] = []
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def end(self) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        if self.timing and self.root is not self:
+            self.root.timings.append((self.name, self.duration * 1000))
+        if EXPORTER is not None:
+            EXPORTER.export(self)
+
+    def server_timing(self) -> str:
+        """Server-Timing响应头的值"""
+        return ", ".join(f"{name};dur={duration:.1f}" for name, duration in self.timings)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出格式（字段与OTLP JSON的span一致）"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.start_ns + int((self.duration or 0) * 1e9),
+            "attributes": self.attributes,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+
+class _NoopSpan:
+    """关闭追踪时使用，所有操作都不做任何事"""
+
+    timings: List[Tuple[str, float]] = []
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def elapsed_ms(self) -> float:
+        return 0.0
+
+    def end(self) -> None:
+        pass
+
+    def server_timing(self) -> str:
+        return ""
+
+
+NOOP_SPAN = _NoopSpan()
+ENABLED = True
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, timing: bool = False, **attributes) -> Any:
+    """
+    开始一个span但不设为当前span，需要调用end()结束
+
+    用于跨越多次yield的流式生成器：在生成器中切换contextvar会影响调用方的上下文。
+    """
+    if not ENABLED:
+        return NOOP_SPAN
+    return Span(name, parent=_current_span.get(), attributes=attributes, timing=timing)
+
+
+@contextmanager
+def span(name: str, timing: bool = False, **attributes) -> Iterator[Any]:
+    """在with块中记录一个span，并设为当前span（块内开始的span以它为父span）"""
+    if not ENABLED:
+        yield NOOP_SPAN
+        return
+    current = Span(name, parent=_current_span.get(), attributes=attributes, timing=timing)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+class JsonlSpanExporter:
+    """
+    将结束的span写入按大小轮转的本地JSONL文件
+
+    请求路径上只把span放入队列，由后台线程批量序列化和写入；
+    队列满时丢弃span（并计数），不会阻塞请求。
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int,
+                 batch_size: int = 512, flush_interval: float = 1.0, max_queue: int = 65536):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain_batch(self, block: bool) -> List[Span]:
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._drain_batch(block=True)
+            if batch:
+                self._write(batch)
+
+    def flush(self) -> None:
+        """写入队列中剩余的span（进程退出时调用）"""
+        while True:
+            batch = self._drain_batch(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch: List[Span]) -> None:
+        data = "".join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n" for span in batch)
+        with self._lock:
+            try:
+                if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(data)
+            except OSError as e:
+                logger.warning(f"写入追踪文件{self.path}失败，丢弃 {len(batch)} 个span: {e}")
+
+    def _rotate(self) -> None:
+        # traces.jsonl -> traces.jsonl.1 -> traces.jsonl.2 ...，超出保留数量的文件被删除
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+# 当前的导出器，为None时只计算Server-Timing，不写入文件
+EXPORTER: Optional[JsonlSpanExporter] = None
+
+
+def configure(enabled: bool, path: str = "", max_bytes: int = 0, backups: int = 0) -> None:
+    """启用或关闭追踪；path不为空时将span导出到该文件"""
+    global ENABLED, EXPORTER
+    ENABLED = enabled
+    if enabled and path:
+        EXPORTER = JsonlSpanExporter(path, max_bytes, backups)
+        logger.info(f"追踪数据将写入 {path}")
+
+
+class TracingMiddleware:
+    """
+    为每个HTTP请求创建根span（沿用请求头traceparent中的trace id），
+    响应头中加入Server-Timing（根span下timing=True的各阶段耗时）和X-Trace-Id。
+
+    根span在响应体发送完毕后结束，流式响应的根span覆盖整个流。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        parent = parse_traceparent(traceparent)
+        root = Span(
+            f"{scope['method']} {scope['path']}",
+            trace_id=parent[0] if parent else None,
+            parent_id=parent[1] if parent else None,
+        )
+        token = _current_span.set(root)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                root.set("http.status_code", message["status"])
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", root.trace_id.encode()))
+                if root.timings:
+                    headers.append((b"server-timing", root.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end()
@@ -0,0 +1,390 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import socket
+import time
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpcore
+import httpx
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger("upstream")
+
+# 预热请求的超时（秒）
+WARM_TIMEOUT = 10.0
+# 选择端点时错误率的权重：错误率为100%的端点相当于延迟增加这么多秒
+ERROR_PENALTY = 5.0
+
+
+class HostSettings:
+    """单个上游主机的连接池设置"""
+
+    FIELDS: Dict[str, Callable[[Any], Any]] = {
+        "max_connections": int,
+        "keepalive_expiry": float,
+        "min_warm_connections": int,
+        "dns_ttl": float,
+        "warm_path": str,
+    }
+
+    def __init__(self, max_connections: int, keepalive_expiry: float, min_warm_connections: int,
+                 dns_ttl: float, warm_path: str = "/"):
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.min_warm_connections = min_warm_connections
+        self.dns_ttl = dns_ttl
+        self.warm_path = warm_path
+
+    def merged(self, overrides: Dict[str, Any]) -> "HostSettings":
+        """以overrides覆盖部分设置，返回新的设置；包含未知的设置项或取值无效时抛出ValueError"""
+        values = self.to_dict()
+        for name, value in overrides.items():
+            if name not in self.FIELDS:
+                raise ValueError(f"未知的设置项 {name}")
+            try:
+                values[name] = self.FIELDS[name](value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{name}={value!r} 格式错误")
+        if values["max_connections"] < 1:
+            raise ValueError("max_connections 至少为1")
+        if values["min_warm_connections"] > values["max_connections"]:
+            raise ValueError("min_warm_connections 不能超过 max_connections")
+        return HostSettings(**values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+def load_host_settings(path: str, defaults: HostSettings) -> Dict[str, HostSettings]:
+    """
+    从JSON文件加载按主机覆盖的连接池设置（{"主机名": {"min_warm_connections": 4, ...}}），文件不存在时返回空字典
+
+    文件无效时记录错误并返回空字典。
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            hosts = json.load(f)
+        if not isinstance(hosts, dict) or not all(isinstance(value, dict) for value in hosts.values()):
+            raise ValueError("主机设置文件必须是JSON对象，每个主机对应一个对象")
+        settings = {str(host).lower(): defaults.merged(overrides) for host, overrides in hosts.items()}
+        logger.info(f"已从{path}加载 {len(settings)} 个主机的连接池设置")
+        return settings
+    except Exception as e:
+        logger.error(f"加载主机设置文件时出错: {e}")
+        return {}
+
+
+def _is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class CachingResolverBackend(httpcore.AsyncNetworkBackend):
+    """
+    带DNS缓存的网络后端
+
+    解析结果缓存ttl秒；解析失败时继续使用过期的结果（上游地址很少变化，DNS故障不应导致请求失败）。
+    依次尝试解析出的地址，全部连接失败时清除缓存，下次重新解析。
+    TLS仍使用原始主机名（SNI和证书校验由httpcore按请求的主机名进行）。
+    """
+
+    def __init__(self, ttl: float, backend: Optional[httpcore.AsyncNetworkBackend] = None):
+        self.ttl = ttl
+        self._backend = backend or httpcore.AnyIOBackend()
+        self._cache: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        # 正在进行的解析，同一主机的并发连接只解析一次
+        self._pending: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.hits = 0
+        self.lookups = 0
+
+    async def resolve(self, host: str, port: int) -> List[str]:
+        if _is_ip_address(host):
+            return [host]
+        key = (host, port)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.hits += 1
+            return cached[1]
+        pending = self._pending.get(key)
+        if pending is None:
+            self.lookups += 1
+            pending = self._pending[key] = asyncio.ensure_future(
+                asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            )
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        try:
+            infos = await asyncio.shield(pending)
+        except OSError as e:
+            if cached is not None:
+                logger.warning(f"解析{host}失败，继续使用缓存的地址: {e}")
+                return cached[1]
+            raise httpcore.ConnectError(str(e))
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        if self.ttl > 0:
+            self._cache[key] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                          local_address: Optional[str] = None,
+                          socket_options: Optional[Iterable[Any]] = None) -> httpcore.AsyncNetworkStream:
+        last_error: Optional[Exception] = None
+        for address in await self.resolve(host, port):
+            try:
+                return await self._backend.connect_tcp(address, port, timeout=timeout, local_address=local_address,
+                                                       socket_options=socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                last_error = e
+        self._cache.pop((host, port), None)
+        raise last_error or httpcore.ConnectError(f"No addresses for {host}")
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None,
+                                  socket_options: Optional[Iterable[Any]] = None) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "hits": self.hits,
+            "lookups": self.lookups,
+            "entries": {
+                f"{host}:{port}": {"addresses": addresses, "expires_in": round(max(expires - now, 0), 1)}
+                for (host, port), (expires, addresses) in self._cache.items()
+            },
+        }
+
+
+class _HostPool:
+    """一个主机（或默认）的传输层及其预热状态"""
+
+    def __init__(self, settings: HostSettings, ssl_context):
+        self.settings = settings
+        self.resolver = CachingResolverBackend(settings.dns_ttl)
+        self.transport = httpx.AsyncHTTPTransport(verify=ssl_context)
+        # httpx的传输层没有暴露network_backend参数，替换为使用DNS缓存的连接池
+        self.transport._pool = httpcore.AsyncConnectionPool(
+            ssl_context=ssl_context,
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_connections,
+            keepalive_expiry=settings.keepalive_expiry,
+            network_backend=self.resolver,
+        )
+        self.last_warm: Optional[float] = None
+        self.warm_failures = 0
+
+    def stats(self) -> Dict[str, Any]:
+        pool = self.transport._pool
+        connections = pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        closed = sum(1 for connection in connections if connection.is_closed())
+        return {
+            "settings": self.settings.to_dict(),
+            "connections": len(connections) - closed,
+            "idle": idle,
+            "active": len(connections) - idle - closed,
+            "waiting": sum(1 for status in pool._requests if status.connection is None),
+            "last_warm_ago": round(time.monotonic() - self.last_warm, 1) if self.last_warm else None,
+            "warm_failures": self.warm_failures,
+            "dns": self.resolver.stats(),
+        }
+
+
+class UpstreamPool:
+    """
+    所有上游请求共用的HTTP客户端
+
+    - 每个在主机设置文件中配置的主机使用独立的传输层（连接数、空闲连接保持时间、DNS缓存时间、预热连接数），
+      其余主机使用默认设置
+    - 所有传输层共用一个SSLContext，证书只加载一次
+    - 后台任务定时向上游发送轻量请求，保持至少min_warm_connections个已完成TLS握手的空闲连接，
+      空闲一段时间后的第一个请求不需要重新解析DNS和握手
+    - 不保存上游返回的Set-Cookie，每个请求的cookie由调用方传入，不同请求之间不会互相影响
+    """
+
+    def __init__(self, defaults: HostSettings, host_settings: Optional[Dict[str, HostSettings]] = None):
+        self.defaults = defaults
+        self.ssl_context = httpx.create_ssl_context()
+        self.hosts = {host: _HostPool(settings, self.ssl_context) for host, settings in (host_settings or {}).items()}
+        self.default = _HostPool(defaults, self.ssl_context)
+        self.client = httpx.AsyncClient(
+            timeout=None,
+            transport=self.default.transport,
+            mounts={f"all://{host}": pool.transport for host, pool in self.hosts.items()},
+        )
+        self.client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    def _pool_for(self, host: str) -> _HostPool:
+        return self.hosts.get(host.lower(), self.default)
+
+    async def warm(self, url: str, headers: Optional[Dict[str, str]] = None) -> None:
+        """
+        同时发送min_warm_connections个HEAD请求：已有的空闲连接被复用（并刷新空闲时间），不足的部分新建连接
+        """
+        parts = urlsplit(url)
+        pool = self._pool_for(parts.hostname or "")
+        count = pool.settings.min_warm_connections
+        if count <= 0:
+            return
+        warm_url = f"{parts.scheme}://{parts.netloc}{pool.settings.warm_path}"
+
+        async def ping():
+            response = await self.client.head(warm_url, headers=headers, timeout=WARM_TIMEOUT)
+            await response.aclose()
+
+        results = await asyncio.gather(*(ping() for _ in range(count)), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        pool.last_warm = time.monotonic()
+        if errors:
+            pool.warm_failures += 1
+            logger.warning(f"预热{parts.netloc}的连接时有 {len(errors)}/{count} 个失败: {errors[0]!r}")
+
+    async def prewarm_task(self, get_urls: Callable[[], List[str]], interval: float,
+                           headers: Optional[Dict[str, str]] = None) -> None:
+        """定时预热get_urls()返回的上游（每次重新获取，热重载后的地址立即生效）"""
+        while True:
+            origins = {}
+            for url in get_urls():
+                parts = urlsplit(url)
+                origins.setdefault((parts.scheme, parts.netloc), url)
+            for url in origins.values():
+                try:
+                    await self.warm(url, headers)
+                except Exception as e:
+                    logger.error(f"预热上游连接时出错: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hosts": {host: pool.stats() for host, pool in self.hosts.items()},
+            "default": self.default.stats(),
+        }
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class Endpoint:
+    """一个上游端点及其延迟和错误率的指数加权移动平均（EWMA）"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def score(self) -> float:
+        """越小越好；还没有探测结果的端点延迟按0计算，会被优先尝试"""
+        return (self.latency or 0.0) + ERROR_PENALTY * self.error_rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "score": round(self.score(), 3),
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class EndpointSelector:
+    """
+    在多个等价的上游端点中选择一个
+
+    - 延迟来自定时探测（对端点地址发送HEAD请求，测量到响应头的时间），所有端点使用相同的方式测量，结果可以直接比较；
+      真实请求到响应头的时间包含模型排队，不计入延迟
+    - 错误率来自真实请求和探测：连接失败、超时和5xx记为失败
+    - 每个请求选择score最小的端点；连接失败时由调用方排除该端点后重新选择
+    """
+
+    def __init__(self, urls: List[str], alpha: float):
+        self.alpha = alpha
+        self.endpoints: List[Endpoint] = []
+        self.update(urls)
+
+    def update(self, urls: List[str]) -> None:
+        """更换端点列表（热重载时使用），保留仍在列表中的端点的统计"""
+        existing = {endpoint.url: endpoint for endpoint in self.endpoints}
+        self.endpoints = [existing.get(url) or Endpoint(url) for url in dict.fromkeys(urls)]
+
+    @property
+    def urls(self) -> List[str]:
+        return [endpoint.url for endpoint in self.endpoints]
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def select(self, exclude: Iterable[str] = ()) -> Endpoint:
+        """返回score最小的端点（相同时按配置顺序）；所有端点都被排除时在全部端点中选择"""
+        excluded = set(exclude)
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.url not in excluded] or self.endpoints
+        return min(candidates, key=Endpoint.score)
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else current + self.alpha * (sample - current)
+
+    def record(self, endpoint: Endpoint, ok: bool, latency: Optional[float] = None,
+               error: Optional[str] = None) -> None:
+        endpoint.requests += 1
+        endpoint.error_rate = self._ewma(endpoint.error_rate, 0.0 if ok else 1.0)
+        if latency is not None:
+            endpoint.latency = self._ewma(endpoint.latency, latency)
+        if not ok:
+            endpoint.failures += 1
+            endpoint.last_error = error
+
+    async def probe(self, client: httpx.AsyncClient, headers: Optional[Dict[str, str]] = None,
+                    timeout: float = WARM_TIMEOUT) -> None:
+        """并发探测所有端点"""
+
+        async def probe_one(endpoint: Endpoint):
+            started = time.perf_counter()
+            try:
+                response = await client.head(endpoint.url, headers=headers, timeout=timeout)
+                await response.aclose()
+            except Exception as e:
+                self.record(endpoint, False, error=f"probe: {e!r}")
+                return
+            latency = time.perf_counter() - started
+            ok = response.status_code < 500
+            self.record(endpoint, ok, latency, None if ok else f"probe: HTTP {response.status_code}")
+
+        await asyncio.gather(*(probe_one(endpoint) for endpoint in list(self.endpoints)))
+
+    async def probe_task(self, client: httpx.AsyncClient, interval: float,
+                         headers: Optional[Dict[str, str]] = None) -> None:
+        """定时探测；只有一个端点时不需要选择，跳过探测"""
+        while True:
+            if len(self.endpoints) > 1:
+                try:
+                    await self.probe(client, headers)
+                except Exception as e:
+                    logger.error(f"探测上游端点时出错: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        selected = self.select().url if self.endpoints else None
+        return {
+            "selected": selected,
+            "endpoints": [endpoint.to_dict() for endpoint in self.endpoints],
+        }
@@ -0,0 +1,94 @@
+import re
+from typing import Dict, Optional
+
+from fastapi.responses import JSONResponse
+
+# 上游响应分类
+OK = "ok"
+CHALLENGE = "challenge"        # Cloudflare挑战页面，通常是cf_clearance失效
+AUTH_FAILURE = "auth_failure"  # session_token失效
+RATE_LIMIT = "rate_limit"      # 上游限流
+MODEL_ERROR = "model_error"    # 其他错误（模型不可用、参数错误、上游故障等）
+
+# Cloudflare挑战页面的特征
+CHALLENGE_MARKERS = re.compile(
+    r'Just a moment|cf-chl|challenge-platform|cf_chl_opt|Checking your browser|Attention Required',
+    re.IGNORECASE
+)
+
+
+def classify_upstream_response(status_code: int, headers: Dict[str, str], body: str = "") -> str:
+    """根据状态码、响应头和响应体判断上游响应的类别"""
+    content_type = headers.get("content-type", "")
+    if headers.get("cf-mitigated") == "challenge":
+        return CHALLENGE
+    # Akash正常返回的是文本流，出现HTML基本都是Cloudflare的拦截页面
+    if "text/html" in content_type and (status_code in (403, 503) or CHALLENGE_MARKERS.search(body[:4096])):
+        return CHALLENGE
+    if status_code == 200:
+        return OK
+    if status_code == 401:
+        return AUTH_FAILURE
+    if status_code == 403:
+        return CHALLENGE if CHALLENGE_MARKERS.search(body[:4096]) else AUTH_FAILURE
+    if status_code == 429:
+        return RATE_LIMIT
+    return MODEL_ERROR
+
+
+def openai_error_body(message: str, error_type: str, code: Optional[str] = None, param: Optional[str] = None) -> Dict:
+    """构造OpenAI格式的错误对象"""
+    return {
+        "error": {
+            "message": message,
+            "type": error_type,
+            "param": param,
+            "code": code
+        }
+    }
+
+
+def openai_error_response(status_code: int, message: str, error_type: str, code: Optional[str] = None,
+                          headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    """返回OpenAI格式的错误响应"""
+    return JSONResponse(
+        status_code=status_code,
+        content=openai_error_body(message, error_type, code),
+        headers=headers
+    )
+
+
+class UpstreamError(Exception):
+    """上游请求最终失败（已完成凭证刷新和重放）时抛出"""
+
+    def __init__(self, kind: str, status_code: int, detail: str, retry_after: Optional[str] = None):
+        super().__init__(detail)
+        self.kind = kind
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def to_body(self) -> Dict:
+        """转换为OpenAI格式的错误对象"""
+        status, error_type, code, message = self._describe()
+        return openai_error_body(message, error_type, code)
+
+    def to_response(self) -> JSONResponse:
+        """转换为OpenAI格式的错误响应"""
+        status, error_type, code, message = self._describe()
+        headers = {"Retry-After": self.retry_after} if self.retry_after else None
+        return openai_error_response(status, message, error_type, code, headers)
+
+    def _describe(self):
+        detail = self.detail[:500]
+        if self.kind == CHALLENGE:
+            return 503, "upstream_error", "upstream_challenge", \
+                "Akash returned a Cloudflare challenge and credentials could not be refreshed"
+        if self.kind == AUTH_FAILURE:
+            return 502, "upstream_error", "upstream_auth_failed", \
+                f"Akash rejected the session credentials ({self.status_code})"
+        if self.kind == RATE_LIMIT:
+            return 429, "rate_limit_error", "rate_limit_exceeded", f"Akash rate limit exceeded: {detail}"
+        if 400 <= self.status_code < 500:
+            return self.status_code, "invalid_request_error", "upstream_rejected", f"Akash API error: {detail}"
+        return 502, "upstream_error", "upstream_error", f"Akash API error ({self.status_code}): {detail}"